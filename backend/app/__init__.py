@@ -5,6 +5,8 @@ from flask_jwt_extended import JWTManager
 from flask_mail import Mail
 from flask_migrate import Migrate
 from app.models import db, init_db
+from app.utils.cache import init_cache
+from app.utils.realtime import init_realtime
 from app.config import DevelopmentConfig, ProductionConfig
 from dotenv import load_dotenv
 
@@ -40,6 +42,8 @@ def create_app():
     jwt = JWTManager(app)
     mail.init_app(app)
     init_db(app)
+    init_cache()
+    init_realtime(app)
     Migrate(app, db)
     
     # ... (rest of your app setup) ...
@@ -17,6 +17,11 @@ class Config:
     MAIL_USERNAME = os.getenv('MAIL_USERNAME')
     MAIL_PASSWORD = os.getenv('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.getenv('MAIL_DEFAULT_SENDER')
+    # Live events: 'local' delivers within this process only; 'database' shares them
+    # between worker processes through the realtime_events table.
+    REALTIME_BACKEND = os.getenv('REALTIME_BACKEND', 'local')
+    REALTIME_POLL_INTERVAL = float(os.getenv('REALTIME_POLL_INTERVAL', 1))
+    REALTIME_EVENT_RETENTION = int(os.getenv('REALTIME_EVENT_RETENTION', 300))
 
 class DevelopmentConfig(Config):
     DEBUG = True
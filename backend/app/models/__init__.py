@@ -21,11 +21,12 @@ def init_db(app):
         from app.models.enrollment_form_model import EnrollmentForm
         from app.models.enrollment_submission_model import EnrollmentSubmission
         from app.models.financial_model import (
-            StudentFinancialAccount, PresetChargeItem, Invoice, 
+            StudentFinancialAccount, AccountBalance, PresetChargeItem, Invoice, 
             InvoiceItem, Payment, Credit, BillingPlan, Subscription,
-            PresetDiscount
+            PresetDiscount, InvoiceRun, InvoiceBatch, AgingSnapshot, PaymentAllocation
         )
-        from app.models.subsidy_model import Subsidy
+        from app.models.subsidy_model import Subsidy, StudentSubsidy, SubsidyClaim, SubsidyClaimLine
         from app.models.message_log_model import MessageLog
+        from app.models.realtime_event_model import RealtimeEvent
         
         db.create_all()
\ No newline at end of file
@@ -12,6 +12,9 @@ class ConversationParticipant(db.Model):
     
     # New field to track the last time an email/push notification was sent
     last_notified_at = db.Column(db.DateTime, nullable=True)
+    # Messages from others since last_read_at, bumped by send_message and zeroed when the
+    # conversation is read, so the unread badge is a single SUM over the user's rows.
+    unread_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
 
     staff = db.relationship('Staff', back_populates='conversation_associations')
     super_admin = db.relationship('SuperAdmin', back_populates='conversation_associations')
@@ -24,8 +27,12 @@ class Conversation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    # Pointer to the newest message and its time (the creation time until there is one), kept
+    # by send_message so the inbox is ordered and previewed without scanning messages.
+    last_message_id = db.Column(db.Integer, db.ForeignKey('messages.id', use_alter=True, name='fk_conversations_last_message_id', ondelete='SET NULL'), nullable=True)
+    last_activity_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), server_default=db.func.now(), nullable=False, index=True)
     
-    messages = db.relationship('Message', backref='conversation', lazy='dynamic', cascade="all, delete-orphan", order_by='Message.created_at')
+    messages = db.relationship('Message', backref='conversation', lazy='dynamic', cascade="all, delete-orphan", order_by='Message.created_at', foreign_keys='Message.conversation_id')
     participants = db.relationship('ConversationParticipant', back_populates='conversation', cascade="all, delete-orphan")
 
     def get_participants(self):
@@ -40,6 +47,8 @@ class Conversation(db.Model):
 
 class Message(db.Model):
     __tablename__ = 'messages'
+    # Serves the chat window's incremental and history fetches (id ranges within a conversation).
+    __table_args__ = (db.Index('ix_messages_conversation_id_id', 'conversation_id', 'id'),)
 
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
@@ -47,22 +56,20 @@ class Message(db.Model):
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=False)
     sender_type = db.Column(db.String(50))
     sender_id = db.Column(db.Integer)
+    # Copied from the sender when the message is sent (as MessageLog does), so history renders
+    # without looking senders up. Older messages have none and are resolved in bulk instead.
+    sender_name = db.Column(db.String(100), nullable=True)
 
     __mapper_args__ = {'polymorphic_on': sender_type}
     
-    def to_dict(self):
-        from app.models.staff_model import Staff
-        from app.models.super_admin_model import SuperAdmin
-
-        sender_name = "Unknown"
-        sender_model = None
-        if self.sender_type == 'staff':
-            sender_model = Staff.query.get(self.sender_id)
-        elif self.sender_type == 'superadmin':
-            sender_model = SuperAdmin.query.get(self.sender_id)
-        
-        if sender_model:
-            sender_name = sender_model.name
+    def to_dict(self, sender_names=None):
+        """'sender_names' maps (sender_type, sender_id) to a name, as built by resolve_sender_names."""
+        sender_name = self.sender_name
+        if sender_name is None:
+            if sender_names is None:
+                from app.utils.messaging import resolve_sender_names
+                sender_names = resolve_sender_names([self])
+            sender_name = sender_names.get((self.sender_type, self.sender_id), "Unknown")
 
         return {
             'id': self.id,
@@ -11,10 +11,41 @@ class StudentFinancialAccount(db.Model):
     payments = db.relationship('Payment', backref='account', lazy='dynamic', cascade="all, delete-orphan")
     credits = db.relationship('Credit', backref='account', lazy='dynamic', cascade="all, delete-orphan")
     subscriptions = db.relationship('Subscription', backref='account', lazy='dynamic', cascade="all, delete-orphan")
+    balance = db.relationship('AccountBalance', backref='account', uselist=False, cascade="all, delete-orphan")
 
     def to_dict(self):
         return { 'id': self.id, 'student_id': self.student_id, 'student_name': f"{self.student.first_name} {self.student.last_name}" }
 
+class AccountBalance(db.Model):
+    # Running totals for an account, kept in step with every invoice, payment and credit write.
+    # 'flask rebuild-balances' recomputes them from the ledger and repairs any drift.
+    __tablename__ = 'account_balances'
+    account_id = db.Column(db.Integer, db.ForeignKey('student_financial_accounts.id'), primary_key=True)
+    total_invoiced = db.Column(db.Float, default=0, nullable=False)
+    total_paid = db.Column(db.Float, default=0, nullable=False)
+    total_credited = db.Column(db.Float, default=0, nullable=False)
+    last_invoice_at = db.Column(db.DateTime, nullable=True)
+    last_invoice_amount = db.Column(db.Float, nullable=True)
+    last_payment_at = db.Column(db.DateTime, nullable=True)
+    last_payment_amount = db.Column(db.Float, nullable=True)
+    last_credit_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def open_balance(self):
+        return (self.total_invoiced or 0) - ((self.total_paid or 0) + (self.total_credited or 0))
+
+    def to_dict(self):
+        return {
+            'account_id': self.account_id, 'open_balance': self.open_balance,
+            'total_invoiced': self.total_invoiced, 'total_paid': self.total_paid, 'total_credited': self.total_credited,
+            'last_invoice_date': self.last_invoice_at.isoformat() if self.last_invoice_at else None,
+            'last_invoice_amount': self.last_invoice_amount,
+            'last_payment_date': self.last_payment_at.isoformat() if self.last_payment_at else None,
+            'last_payment_amount': self.last_payment_amount,
+            'last_credit_date': self.last_credit_at.isoformat() if self.last_credit_at else None
+        }
+
 class PresetChargeItem(db.Model):
     __tablename__ = 'preset_charge_items'
     id = db.Column(db.Integer, primary_key=True)
@@ -36,18 +67,33 @@ class PresetDiscount(db.Model):
 
 class Invoice(db.Model):
     __tablename__ = 'invoices'
+    # A subscription can only be billed once per period, whichever run or worker gets there first.
+    # A batch of one-off invoices holds at most one invoice per account.
+    __table_args__ = (
+        db.UniqueConstraint('subscription_id', 'billing_period', name='uq_invoice_subscription_period'),
+        db.UniqueConstraint('batch_id', 'account_id', name='uq_invoice_batch_account'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     account_id = db.Column(db.Integer, db.ForeignKey('student_financial_accounts.id'), nullable=False)
     status = db.Column(db.String(50), default='Draft', nullable=False) # Draft, Sent, Paid, Overdue, Void
     due_date = db.Column(db.Date, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    # Set for invoices generated from a Subscription; billing_period is the next_invoice_date that was billed
+    subscription_id = db.Column(db.Integer, db.ForeignKey('subscriptions.id'), nullable=True)
+    billing_period = db.Column(db.Date, nullable=True)
+    # Set for one-off invoices raised for a group of students in one InvoiceBatch
+    batch_id = db.Column(db.Integer, db.ForeignKey('invoice_batches.id'), nullable=True)
+    # Stored so lists and balances never have to load invoice_items. total_amount follows the
+    # items (see the listeners below); amount_paid is the sum of the invoice's payment allocations.
+    total_amount = db.Column(db.Float, default=0, server_default='0', nullable=False)
+    amount_paid = db.Column(db.Float, default=0, server_default='0', nullable=False)
     
     items = db.relationship('InvoiceItem', backref='invoice', cascade="all, delete-orphan")
     payments = db.relationship('Payment', backref='invoice', lazy='dynamic')
-    
+
     @property
-    def total_amount(self):
-        return sum(float(item.amount or 0) for item in self.items)
+    def amount_due(self):
+        return (self.total_amount or 0) - (self.amount_paid or 0)
 
     def to_dict(self):
         return {
@@ -55,7 +101,8 @@ class Invoice(db.Model):
             'due_date': self.due_date.isoformat() if self.due_date else None,
             'created_at': self.created_at.isoformat() + 'Z',
             'items': [item.to_dict() for item in self.items],
-            'total_amount': self.total_amount
+            'total_amount': self.total_amount,
+            'amount_paid': self.amount_paid
         }
 
 class InvoiceItem(db.Model):
@@ -68,6 +115,22 @@ class InvoiceItem(db.Model):
     def to_dict(self):
         return { 'id': self.id, 'description': self.description, 'amount': self.amount }
 
+# Keep Invoice.total_amount in step with items added, removed or re-priced through the ORM.
+# Bulk inserts of InvoiceItem rows must set or adjust the invoice total themselves.
+@db.event.listens_for(Invoice.items, 'append')
+def _add_item_to_total(invoice, item, initiator):
+    invoice.total_amount = (invoice.total_amount or 0) + float(item.amount or 0)
+
+@db.event.listens_for(Invoice.items, 'remove')
+def _remove_item_from_total(invoice, item, initiator):
+    invoice.total_amount = (invoice.total_amount or 0) - float(item.amount or 0)
+
+@db.event.listens_for(InvoiceItem.amount, 'set')
+def _reprice_item_in_total(item, value, oldvalue, initiator):
+    if item.invoice is not None:
+        previous = oldvalue if isinstance(oldvalue, (int, float, str)) else 0
+        item.invoice.total_amount = (item.invoice.total_amount or 0) + float(value or 0) - float(previous or 0)
+
 class Payment(db.Model):
     __tablename__ = 'payments'
     id = db.Column(db.Integer, primary_key=True)
@@ -76,7 +139,7 @@ class Payment(db.Model):
     amount = db.Column(db.Float, nullable=False)
     method = db.Column(db.String(50), nullable=False)
     notes = db.Column(db.Text, nullable=True)
-    transaction_date = db.Column(db.DateTime, default=datetime.utcnow)
+    transaction_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     def to_dict(self):
         return { 'id': self.id, 'amount': self.amount, 'method': self.method, 'notes': self.notes, 'transaction_date': self.transaction_date.isoformat() + 'Z' }
@@ -87,11 +150,29 @@ class Credit(db.Model):
     account_id = db.Column(db.Integer, db.ForeignKey('student_financial_accounts.id'), nullable=False)
     amount = db.Column(db.Float, nullable=False)
     reason = db.Column(db.String(255), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     def to_dict(self):
         return { 'id': self.id, 'amount': self.amount, 'reason': self.reason, 'created_at': self.created_at.isoformat() + 'Z' }
 
+class PaymentAllocation(db.Model):
+    # How much of a payment or credit went to which invoice. Written by the allocation
+    # engine in app/utils/allocation.py; sum by invoice_id for what each invoice has received.
+    __tablename__ = 'payment_allocations'
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('student_financial_accounts.id'), nullable=False, index=True)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id'), nullable=False, index=True)
+    payment_id = db.Column(db.Integer, db.ForeignKey('payments.id'), nullable=True, index=True)
+    credit_id = db.Column(db.Integer, db.ForeignKey('credits.id'), nullable=True, index=True)
+    amount = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id, 'invoice_id': self.invoice_id, 'payment_id': self.payment_id,
+            'credit_id': self.credit_id, 'amount': self.amount, 'created_at': self.created_at.isoformat() + 'Z'
+        }
+
 class BillingPlan(db.Model):
     __tablename__ = 'billing_plans'
     id = db.Column(db.Integer, primary_key=True)
@@ -132,4 +213,55 @@ class Subscription(db.Model):
             'end_date': self.end_date.isoformat() if self.end_date else None,
             'next_invoice_date': self.next_invoice_date.isoformat(),
             'total_amount': sum(float(item.get('amount') or 0) for item in self.items_json)
-        }
\ No newline at end of file
+        }
+
+class InvoiceBatch(db.Model):
+    # One-off charges (trips, uniforms, activities) invoiced to a group of students at once.
+    __tablename__ = 'invoice_batches'
+    id = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(255), nullable=False)
+    created_by = db.Column(db.String(120), nullable=True)
+    invoice_count = db.Column(db.Integer, default=0, nullable=False)
+    total_amount = db.Column(db.Float, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    invoices = db.relationship('Invoice', backref='batch', lazy='dynamic')
+
+    def to_dict(self):
+        return {
+            'id': self.id, 'description': self.description, 'created_by': self.created_by,
+            'invoice_count': self.invoice_count, 'total_amount': self.total_amount,
+            'created_at': self.created_at.isoformat() + 'Z'
+        }
+
+class InvoiceRun(db.Model):
+    # Checkpoint for 'flask generate-invoices'. One row per run (and per worker partition),
+    # so a crashed run picks up after the last committed chunk.
+    __tablename__ = 'invoice_runs'
+    id = db.Column(db.Integer, primary_key=True)
+    run_date = db.Column(db.Date, nullable=False)
+    account_id_from = db.Column(db.Integer, nullable=True)
+    account_id_to = db.Column(db.Integer, nullable=True)
+    last_subscription_id = db.Column(db.Integer, default=0, nullable=False)
+    status = db.Column(db.String(50), default='Running', nullable=False) # Running, Completed, Failed
+    invoices_created = db.Column(db.Integer, default=0, nullable=False)
+    failed_subscriptions = db.Column(db.Integer, default=0, nullable=False)
+    error = db.Column(db.Text, nullable=True)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+
+class AgingSnapshot(db.Model):
+    # Cached accounts-receivable aging per account, rebuilt by 'flask refresh-aging'.
+    __tablename__ = 'aging_snapshots'
+    account_id = db.Column(db.Integer, db.ForeignKey('student_financial_accounts.id'), primary_key=True)
+    student_id = db.Column(db.Integer, nullable=False)
+    student_name = db.Column(db.String(201), nullable=False)
+    current = db.Column(db.Float, default=0, nullable=False)
+    days_1_30 = db.Column(db.Float, default=0, nullable=False)
+    days_31_60 = db.Column(db.Float, default=0, nullable=False)
+    days_61_90 = db.Column(db.Float, default=0, nullable=False)
+    days_over_90 = db.Column(db.Float, default=0, nullable=False)
+    total_open = db.Column(db.Float, default=0, nullable=False)
+    as_of = db.Column(db.Date, nullable=False)
+    generated_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,15 @@
+from app.models import db
+from datetime import datetime
+
+class RealtimeEvent(db.Model):
+    # Outbox for live events when several worker processes share them through the database
+    # (REALTIME_BACKEND=database). Rows are written in the publishing transaction, read by each
+    # worker's poller, and pruned by later publishes (or the prune-realtime-events command)
+    # once older than REALTIME_EVENT_RETENTION seconds.
+    __tablename__ = 'realtime_events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(100), nullable=False)
+    event = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False) # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
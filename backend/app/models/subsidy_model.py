@@ -8,11 +8,92 @@ class Subsidy(db.Model):
     name = db.Column(db.String(150), unique=True, nullable=False)
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Running totals across all claims, moved in SQL as claims are generated and paid
+    # (see app/utils/subsidies.py) so listing subsidies never sums claim rows.
+    total_invoiced = db.Column(db.Float, default=0, server_default='0', nullable=False)
+    total_received = db.Column(db.Float, default=0, server_default='0', nullable=False)
+
+    awards = db.relationship('StudentSubsidy', backref='subsidy', lazy='dynamic', cascade="all, delete-orphan")
+    claims = db.relationship('SubsidyClaim', backref='subsidy', lazy='dynamic', cascade="all, delete-orphan")
+
+    @property
+    def outstanding(self):
+        return (self.total_invoiced or 0) - (self.total_received or 0)
 
     def to_dict(self):
-        # We can add invoiced/received amounts later through queries
         return {
             'id': self.id,
             'name': self.name,
             'is_active': self.is_active,
-        }
\ No newline at end of file
+            'invoiced': self.total_invoiced or 0,
+            'received': self.total_received or 0,
+            'outstanding': self.outstanding,
+        }
+
+class StudentSubsidy(db.Model):
+    # The monthly amount an agency covers for a student while the award is active.
+    __tablename__ = 'student_subsidies'
+    __table_args__ = (db.UniqueConstraint('subsidy_id', 'student_id', name='uq_student_subsidy'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    subsidy_id = db.Column(db.Integer, db.ForeignKey('subsidies.id'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('students.id'), nullable=False, index=True)
+    monthly_amount = db.Column(db.Float, nullable=False)
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=True)
+    is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    student = db.relationship('Student')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'subsidy_id': self.subsidy_id,
+            'student_id': self.student_id,
+            'student_name': f"{self.student.first_name} {self.student.last_name}" if self.student else None,
+            'monthly_amount': self.monthly_amount,
+            'start_date': self.start_date.isoformat(),
+            'end_date': self.end_date.isoformat() if self.end_date else None,
+            'is_active': self.is_active,
+        }
+
+class SubsidyClaim(db.Model):
+    # One claim per subsidy per month, billing the agency for the covered part of each invoice.
+    __tablename__ = 'subsidy_claims'
+    __table_args__ = (db.UniqueConstraint('subsidy_id', 'period', name='uq_subsidy_claim_period'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    subsidy_id = db.Column(db.Integer, db.ForeignKey('subsidies.id'), nullable=False)
+    period = db.Column(db.Date, nullable=False) # First day of the claimed month
+    status = db.Column(db.String(50), default='Submitted', nullable=False) # Submitted, Partially Paid, Paid
+    amount = db.Column(db.Float, default=0, nullable=False)
+    amount_received = db.Column(db.Float, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    lines = db.relationship('SubsidyClaimLine', backref='claim', cascade="all, delete-orphan")
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'subsidy_id': self.subsidy_id,
+            'period': self.period.strftime('%Y-%m'),
+            'status': self.status,
+            'amount': self.amount,
+            'amount_received': self.amount_received,
+            'outstanding': self.amount - self.amount_received,
+            'created_at': self.created_at.isoformat() + 'Z',
+        }
+
+class SubsidyClaimLine(db.Model):
+    __tablename__ = 'subsidy_claim_lines'
+    __table_args__ = (db.UniqueConstraint('claim_id', 'student_id', name='uq_subsidy_claim_student'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    claim_id = db.Column(db.Integer, db.ForeignKey('subsidy_claims.id'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('students.id'), nullable=False)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id'), nullable=False, index=True)
+    amount = db.Column(db.Float, nullable=False)
+
+    def to_dict(self):
+        return {'id': self.id, 'student_id': self.student_id, 'invoice_id': self.invoice_id, 'amount': self.amount}
@@ -1,38 +1,93 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required
-# In the future, you would import models like Invoice, Payment, etc.
-# from app.models.invoice_model import Invoice 
+from app.models import db
+from app.models.financial_model import Invoice, Payment
+from app.utils.billing import CLOSED_INVOICE_STATUSES, SETTLEMENT_TOLERANCE
+from app.utils.cache import cached
+from app.utils.forecast import revenue_forecast
+from sqlalchemy import select, func, case, or_
+from datetime import datetime, date
 
 accounting_bp = Blueprint('accounting', __name__)
 
+# The dashboard is opened constantly; billing writes in this process invalidate the cache
+# on commit, and the TTL bounds how stale writes from other workers can be.
+OVERVIEW_CACHE_TTL = 60
+FORECAST_CACHE_TTL = 300
+MAX_FORECAST_MONTHS = 36
+
+def _compute_overview():
+    today = date.today()
+    start_of_year = datetime(today.year, 1, 1)
+    start_of_month = datetime(today.year, today.month, 1)
+
+    # Only this year's payments are read, through the transaction_date index.
+    revenue_ytd, revenue_mtd = db.session.execute(
+        select(
+            func.coalesce(func.sum(Payment.amount), 0),
+            func.coalesce(func.sum(case((Payment.transaction_date >= start_of_month, Payment.amount), else_=0)), 0)
+        ).where(Payment.transaction_date >= start_of_year)
+    ).one()
+
+    open_amount = Invoice.total_amount - Invoice.amount_paid
+    is_overdue = Invoice.due_date < today
+    pending_invoices, overdue_invoices, outstanding, overdue_balance = db.session.execute(
+        select(
+            func.count(case((or_(Invoice.due_date.is_(None), Invoice.due_date >= today), Invoice.id))),
+            func.count(case((is_overdue, Invoice.id))),
+            func.coalesce(func.sum(open_amount), 0),
+            func.coalesce(func.sum(case((is_overdue, open_amount), else_=0)), 0)
+        ).where(Invoice.status.notin_(CLOSED_INVOICE_STATUSES), open_amount > SETTLEMENT_TOLERANCE)
+    ).one()
+
+    return {
+        "total_revenue": float(revenue_ytd),
+        "revenue_this_month": float(revenue_mtd),
+        "pending_invoices": pending_invoices,
+        "overdue_payments": overdue_invoices,
+        "outstanding_balance": float(outstanding),
+        "overdue_balance": float(overdue_balance),
+        # There is no expenses model yet.
+        "total_expenses": 0,
+        "as_of": today.isoformat(),
+    }
+
 @accounting_bp.route('/overview', methods=['GET'])
 @jwt_required()
 def get_accounting_overview():
     """
     Provides a summary of key metrics for the Accounting dashboard.
+    Revenue is year-to-date payments; pending and overdue count open invoices by due date.
     """
     try:
-        # --- IMPORTANT ---
-        # These are placeholders for now. As you build your accounting models
-        # (e.g., Invoices, Payments, Expenses), you will replace these zeros
-        # with real database queries.
-        
-        # Example of a future query:
-        # total_revenue = db.session.query(db.func.sum(Payment.amount)).scalar() or 0
-        
-        total_revenue = 0
-        pending_invoices = 0
-        overdue_payments = 0
-        total_expenses = 0
+        metrics, _ = cached('accounting_overview', ['invoices', 'payments'], OVERVIEW_CACHE_TTL, _compute_overview)
 
         data = {
-            "total_revenue": f"{total_revenue:,.2f}",
-            "pending_invoices": pending_invoices,
-            "overdue_payments": overdue_payments,
-            "total_expenses": f"{total_expenses:,.2f}",
+            **metrics,
+            "total_revenue": f"{metrics['total_revenue']:,.2f}",
+            "revenue_this_month": f"{metrics['revenue_this_month']:,.2f}",
+            "outstanding_balance": f"{metrics['outstanding_balance']:,.2f}",
+            "overdue_balance": f"{metrics['overdue_balance']:,.2f}",
+            "total_expenses": f"{metrics['total_expenses']:,.2f}",
         }
 
         return jsonify(data), 200
     except Exception as e:
         # Log the error e
-        return jsonify({"error": "An error occurred while fetching accounting data."}), 500
\ No newline at end of file
+        return jsonify({"error": "An error occurred while fetching accounting data."}), 500
+
+@accounting_bp.route('/forecast', methods=['GET'])
+@jwt_required()
+def get_revenue_forecast():
+    """Projected monthly revenue from active subscriptions, by plan and grade. '?months' defaults to 12."""
+    months = request.args.get('months', 12, type=int)
+    if not months or not 1 <= months <= MAX_FORECAST_MONTHS:
+        return jsonify({"error": f"months must be between 1 and {MAX_FORECAST_MONTHS}."}), 400
+
+    forecast, _ = cached(
+        f'revenue_forecast:{date.today().isoformat()}:{months}',
+        ['subscriptions', 'student_financial_accounts', 'students'],
+        FORECAST_CACHE_TTL,
+        lambda: revenue_forecast(months)
+    )
+    return jsonify(forecast), 200
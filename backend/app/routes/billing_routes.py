@@ -1,14 +1,30 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt
 from app.models import db
 from app.models.staff_model import Staff
 from app.models.super_admin_model import SuperAdmin
 from app.models.student_model import Student
-from app.models.financial_model import StudentFinancialAccount, Invoice, InvoiceItem, Payment, Credit, BillingPlan, Subscription, PresetChargeItem, PresetDiscount
+from app.models.financial_model import StudentFinancialAccount, AccountBalance, Invoice, InvoiceItem, Payment, Credit, BillingPlan, Subscription, PresetChargeItem, PresetDiscount, AgingSnapshot
 from app.models.activity_log_model import log_activity
-from sqlalchemy import func
+from app.utils.billing import (
+    ensure_financial_accounts, ensure_account_balances, record_balance_activity, student_selector_filter,
+    ledger_page, encode_ledger_cursor, decode_ledger_cursor, aging_report, AGING_BUCKETS,
+    iter_transactions, EXPORT_COLUMNS, family_rollups
+)
+from app.utils.cache import cached
+from app.utils.payment_import import import_payments
+from app.utils.allocation import allocate_account_funds, invoice_allocations
+from app.utils.invoicing import create_invoice_batch, BILLING_CYCLES
+from app.utils.notifications import send_emails_in_background
+from sqlalchemy import select, insert, func
+from sqlalchemy.orm import joinedload
 from datetime import datetime, date
 from dateutil.relativedelta import relativedelta
+import csv
+import hashlib
+import io
+import json
+import zlib
 
 billing_bp = Blueprint('billing', __name__)
 
@@ -19,13 +35,38 @@ def get_actor():
         return SuperAdmin.query.filter_by(email=email).first()
     return Staff.query.filter_by(email=email).first()
 
+# Catalog reads are served from the in-process cache, which drops an entry as soon as a
+# write to one of its tables commits; the TTL covers writes made by other worker processes.
+CATALOG_CACHE_TTL = 300
+SUBSCRIPTIONS_CACHE_TTL = 60
+FAMILIES_CACHE_TTL = 60
+FAMILY_TABLES = ['parents', 'students', 'student_financial_accounts', 'account_balances']
+
+def cached_catalog_response(key, tables, ttl, load):
+    """
+    Returns a JSON list from the cache, tagged with an ETag derived from its content so
+    clients revalidating with If-None-Match get a 304 while the catalog is unchanged.
+    """
+    def compute():
+        data = load()
+        etag = hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+        return data, etag
+
+    (data, etag), _ = cached(key, tables, ttl, compute)
+    response = jsonify(data)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
 # === Recurring Plan Endpoints ===
 
 @billing_bp.route('/plans', methods=['GET'])
 @jwt_required()
 def get_billing_plans():
-    plans = BillingPlan.query.filter_by(is_active=True).order_by(BillingPlan.name).all()
-    return jsonify([p.to_dict() for p in plans]), 200
+    def load():
+        plans = BillingPlan.query.filter_by(is_active=True).order_by(BillingPlan.name).all()
+        return [p.to_dict() for p in plans]
+    return cached_catalog_response('billing_plans', ['billing_plans'], CATALOG_CACHE_TTL, load)
 
 @billing_bp.route('/plans', methods=['POST'])
 @jwt_required()
@@ -56,8 +97,10 @@ def create_billing_plan():
 @billing_bp.route('/preset-items', methods=['GET'])
 @jwt_required()
 def get_preset_items():
-    items = PresetChargeItem.query.filter_by(is_active=True).order_by(PresetChargeItem.description).all()
-    return jsonify([i.to_dict() for i in items]), 200
+    def load():
+        items = PresetChargeItem.query.filter_by(is_active=True).order_by(PresetChargeItem.description).all()
+        return [i.to_dict() for i in items]
+    return cached_catalog_response('preset_items', ['preset_charge_items'], CATALOG_CACHE_TTL, load)
 
 @billing_bp.route('/preset-items', methods=['POST'])
 @jwt_required()
@@ -107,8 +150,10 @@ def delete_preset_item(item_id):
 @billing_bp.route('/discounts', methods=['GET'])
 @jwt_required()
 def get_preset_discounts():
-    discounts = PresetDiscount.query.filter_by(is_active=True).order_by(PresetDiscount.description).all()
-    return jsonify([d.to_dict() for d in discounts]), 200
+    def load():
+        discounts = PresetDiscount.query.filter_by(is_active=True).order_by(PresetDiscount.description).all()
+        return [d.to_dict() for d in discounts]
+    return cached_catalog_response('preset_discounts', ['preset_discounts'], CATALOG_CACHE_TTL, load)
 
 @billing_bp.route('/discounts', methods=['POST'])
 @jwt_required()
@@ -152,49 +197,109 @@ def delete_preset_discount(discount_id):
 @billing_bp.route('/subscriptions', methods=['GET'])
 @jwt_required()
 def get_subscriptions():
-    subs = Subscription.query.filter_by(status='Active').all()
-    return jsonify([s.to_dict() for s in subs]), 200
+    def load():
+        subs = (
+            Subscription.query.filter_by(status='Active')
+            .options(joinedload(Subscription.account).joinedload(StudentFinancialAccount.student))
+            .all()
+        )
+        return [s.to_dict() for s in subs]
+    tables = ['subscriptions', 'student_financial_accounts', 'students']
+    return cached_catalog_response('active_subscriptions', tables, SUBSCRIPTIONS_CACHE_TTL, load)
 
 @billing_bp.route('/subscriptions', methods=['POST'])
 @jwt_required()
 def create_subscriptions():
+    """
+    Enrolls a group of students in a recurring plan. Students are picked either by
+    explicit 'student_ids' or server-side with a 'selector' ({grade_level, status}).
+    Returns a per-student report of which subscriptions were created or skipped and why.
+    """
     actor = get_actor()
     data = request.get_json()
     student_ids = data.get('student_ids', [])
+    selector = data.get('selector') or {}
     plan_data = data.get('plan_data', {})
-    if not all([student_ids, plan_data]):
-        return jsonify({"error": "Student IDs and plan data are required."}), 400
+    student_filter = student_selector_filter(student_ids, selector.get('grade_level'), selector.get('status'))
+    if student_filter is None or not plan_data:
+        return jsonify({"error": "Student IDs (or a selector) and plan data are required."}), 400
 
-    start_date = datetime.strptime(plan_data['start_date'], '%Y-%m-%dT%H:%M:%S.%fZ').date()
-    
-    for student_id in student_ids:
-        student = Student.query.get(student_id)
-        if not student or not student.financial_account: continue
-
-        # Calculate the first invoice date
+    try:
+        start_date = datetime.strptime(plan_data['start_date'], '%Y-%m-%dT%H:%M:%S.%fZ').date()
+        end_date = datetime.strptime(plan_data['end_date'], '%Y-%m-%dT%H:%M:%S.%fZ').date() if plan_data.get('end_date') else None
         invoice_day = int(plan_data['invoice_generation_day'])
-        next_invoice_date = start_date.replace(day=invoice_day)
-        if start_date.day > invoice_day:
-            next_invoice_date += relativedelta(months=1)
-
-        sub = Subscription(
-            account_id=student.financial_account.id,
-            plan_name=plan_data['plan_name'],
-            cycle=plan_data['cycle'],
-            start_date=start_date,
-            end_date=datetime.strptime(plan_data['end_date'], '%Y-%m-%dT%H:%M:%S.%fZ').date() if plan_data.get('end_date') else None,
-            invoice_generation_day=invoice_day,
-            due_day=int(plan_data['due_day']),
-            next_invoice_date=next_invoice_date,
-            items_json=plan_data['items_json']
+        due_day = int(plan_data['due_day'])
+    except (KeyError, ValueError, TypeError):
+        return jsonify({"error": "Plan start date, invoice day and due day are required and must be valid."}), 400
+    if plan_data.get('cycle') not in BILLING_CYCLES:
+        return jsonify({"error": f"Billing cycle must be one of: {', '.join(BILLING_CYCLES)}."}), 400
+
+    # Calculate the first invoice date (the same for every student in the batch)
+    next_invoice_date = start_date + relativedelta(day=invoice_day)
+    if start_date.day > invoice_day:
+        next_invoice_date = start_date + relativedelta(months=1, day=invoice_day)
+
+    if ensure_financial_accounts(student_filter):
+        db.session.flush()
+    students = db.session.execute(
+        select(Student.id, Student.first_name, Student.last_name, StudentFinancialAccount.id)
+        .join(StudentFinancialAccount, StudentFinancialAccount.student_id == Student.id)
+        .where(student_filter)
+        .order_by(Student.last_name, Student.first_name)
+    ).all()
+    already_enrolled = set(db.session.execute(
+        select(Subscription.account_id).where(
+            Subscription.account_id.in_([account_id for _, _, _, account_id in students]),
+            Subscription.plan_name == plan_data['plan_name'],
+            Subscription.status == 'Active'
         )
-        db.session.add(sub)
-    
-    log_activity(actor, f"Created recurring plan '{plan_data['plan_name']}' for {len(student_ids)} student(s)")
+    ).scalars())
+
+    results, rows = [], []
+    for student_id, first_name, last_name, account_id in students:
+        result = {'student_id': student_id, 'student_name': f"{first_name} {last_name}"}
+        if account_id in already_enrolled:
+            results.append({**result, 'status': 'skipped', 'reason': f"Already enrolled in '{plan_data['plan_name']}'."})
+            continue
+        rows.append({
+            'account_id': account_id, 'plan_name': plan_data['plan_name'], 'status': 'Active',
+            'cycle': plan_data['cycle'], 'start_date': start_date, 'end_date': end_date,
+            'invoice_generation_day': invoice_day, 'due_day': due_day,
+            'next_invoice_date': next_invoice_date, 'items_json': plan_data['items_json']
+        })
+        results.append({**result, 'status': 'created'})
+
+    found_ids = {student_id for student_id, _, _, _ in students}
+    for student_id in student_ids:
+        if student_id not in found_ids:
+            results.append({'student_id': student_id, 'student_name': None, 'status': 'skipped', 'reason': "Student not found or not selected."})
+
+    if rows:
+        db.session.execute(insert(Subscription), rows)
+    log_activity(actor, f"Created recurring plan '{plan_data['plan_name']}' for {len(rows)} student(s)")
     db.session.commit()
-    return jsonify({"message": "Recurring plans created successfully."}), 201
+    return jsonify({
+        "message": "Recurring plans created successfully.",
+        "created": len(rows),
+        "skipped": len(results) - len(rows),
+        "results": results
+    }), 201
 
 
+@billing_bp.route('/accounts/<int:student_id>/invoices', methods=['GET'])
+@jwt_required()
+def get_invoice_allocations(student_id):
+    """A student's invoices with the payments and credits allocated to each and what remains outstanding."""
+    account = StudentFinancialAccount.query.filter_by(student_id=student_id).first_or_404()
+    invoices = [{
+        'id': row['id'], 'status': row['status'],
+        'due_date': row['due_date'].isoformat() if row['due_date'] else None,
+        'created_at': row['created_at'].isoformat() + 'Z',
+        'total_amount': row['total_amount'], 'allocated': row['allocated'],
+        'outstanding': round(max(row['outstanding'], 0), 2)
+    } for row in invoice_allocations(account.id)]
+    return jsonify(invoices), 200
+
 @billing_bp.route('/accounts/<int:student_id>/invoices', methods=['POST'])
 @jwt_required()
 def create_invoice(student_id):
@@ -216,14 +321,64 @@ def create_invoice(student_id):
     )
     
     for item in items:
-        new_item = InvoiceItem(description=item['description'], amount=item['amount'])
+        new_item = InvoiceItem(description=item['description'], amount=float(item['amount'] or 0))
         new_invoice.items.append(new_item)
     
     db.session.add(new_invoice)
+    db.session.flush()
+    record_balance_activity('invoice', [(account.id, new_invoice.total_amount, new_invoice.created_at)])
+    # Credit or prepayment sitting on the account goes straight onto the new invoice.
+    allocate_account_funds([account.id])
     log_activity(actor, f"Created invoice for {student.first_name} {student.last_name}", new_invoice)
     db.session.commit()
     return jsonify(new_invoice.to_dict()), 201
 
+@billing_bp.route('/invoices/batch', methods=['POST'])
+@jwt_required()
+def create_batch_invoices():
+    """
+    Invoices a one-off charge to a group of students: explicit 'student_ids' or a 'selector'
+    ({grade_level, status}). Items come from 'preset_item_ids', ad-hoc 'items', or both.
+    """
+    actor = get_actor()
+    data = request.get_json()
+    selector = data.get('selector') or {}
+    student_filter = student_selector_filter(data.get('student_ids', []), selector.get('grade_level'), selector.get('status'))
+    if student_filter is None:
+        return jsonify({"error": "Student IDs or a selector are required."}), 400
+
+    try:
+        items = [{'description': item['description'], 'amount': float(item['amount'] or 0)} for item in data.get('items', [])]
+        due_date = datetime.strptime(data['due_date'], '%Y-%m-%d').date() if data.get('due_date') else None
+    except (KeyError, ValueError, TypeError):
+        return jsonify({"error": "Each item needs a description and amount, and due_date must be YYYY-MM-DD."}), 400
+    status = data.get('status', 'Sent')
+    if status not in ('Draft', 'Sent'):
+        return jsonify({"error": "Batch invoices must be created as 'Draft' or 'Sent'."}), 400
+
+    preset_ids = data.get('preset_item_ids', [])
+    if preset_ids:
+        presets = PresetChargeItem.query.filter(PresetChargeItem.id.in_(preset_ids), PresetChargeItem.is_active.is_(True)).all()
+        if len(presets) != len(set(preset_ids)):
+            return jsonify({"error": "One or more preset items were not found or are inactive."}), 400
+        items = [{'description': p.description, 'amount': p.amount} for p in presets] + items
+    if not items:
+        return jsonify({"error": "Invoice must have at least one item."}), 400
+
+    description = data.get('description') or ', '.join(item['description'] for item in items)
+    batch, invoices, emails = create_invoice_batch(
+        student_filter, items, description[:255], due_date=due_date,
+        status=status, created_by=actor.name if actor else None
+    )
+    if not invoices:
+        db.session.rollback()
+        return jsonify({"error": "No students matched the selection."}), 404
+
+    log_activity(actor, f"Invoiced '{batch.description}' to {len(invoices)} student(s)", batch)
+    db.session.commit()
+    send_emails_in_background(emails)
+    return jsonify({"batch": batch.to_dict(), "invoices": invoices, "emails_queued": len(emails)}), 201
+
 @billing_bp.route('/accounts/<int:student_id>/payments', methods=['POST'])
 @jwt_required()
 def receive_payment(student_id):
@@ -235,20 +390,46 @@ def receive_payment(student_id):
     amount = data.get('amount')
     if not amount or float(amount) <= 0: return jsonify({"error": "Invalid payment amount."}), 400
 
-    new_payment = Payment(account_id=account.id, invoice_id=data.get('invoice_id'), amount=float(amount), method=data.get('method', 'Cash'), notes=data.get('notes'), transaction_date=datetime.utcnow())
+    invoice_id = data.get('invoice_id')
+    if invoice_id and not Invoice.query.filter(Invoice.id == invoice_id, Invoice.account_id == account.id, Invoice.status != 'Void').first():
+        return jsonify({"error": "Invoice not found for this account, or it has been voided."}), 404
+
+    new_payment = Payment(account_id=account.id, invoice_id=invoice_id, amount=float(amount), method=data.get('method', 'Cash'), notes=data.get('notes'), transaction_date=datetime.utcnow())
     db.session.add(new_payment)
-    
-    if data.get('invoice_id'):
-        invoice = Invoice.query.get(data.get('invoice_id'))
-        if invoice:
-            total_paid_for_invoice = db.session.query(func.sum(Payment.amount)).filter_by(invoice_id=invoice.id).scalar() or 0
-            if total_paid_for_invoice >= invoice.total_amount:
-                invoice.status = 'Paid'
+    db.session.flush()
+    record_balance_activity('payment', [(account.id, new_payment.amount, new_payment.transaction_date)])
+    allocate_account_funds([account.id])
 
     log_activity(actor, f"Recorded payment of ${amount} for {student.first_name} {student.last_name}", new_payment)
     db.session.commit()
     return jsonify(new_payment.to_dict()), 201
 
+@billing_bp.route('/payments/import', methods=['POST'])
+@jwt_required()
+def import_payments_file():
+    """
+    Records a deposit file of payments in one request. Accepts a CSV upload ('file') or a
+    text/csv body; each row is matched by invoice id, student id number or parent email.
+    '?dry_run=true' returns the match report without recording anything.
+    """
+    actor = get_actor()
+    upload = request.files.get('file')
+    file_text = upload.read().decode('utf-8-sig') if upload else request.get_data(as_text=True)
+    if not file_text.strip():
+        return jsonify({"error": "A CSV file of payments is required."}), 400
+    dry_run = request.args.get('dry_run', 'false').lower() in ['true', '1']
+
+    try:
+        report, summary = import_payments(file_text, default_method=request.args.get('method', 'Bank Transfer'), dry_run=dry_run)
+        if not dry_run and summary['matched'] + summary['unapplied']:
+            log_activity(actor, f"Imported {summary['matched'] + summary['unapplied']} payments totalling ${summary['amount_recorded']:,.2f}")
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": f"Payment import failed: {e}"}), 500
+
+    return jsonify({"dry_run": dry_run, "summary": summary, "rows": report}), 200 if dry_run else 201
+
 @billing_bp.route('/accounts/<int:student_id>/credits', methods=['POST'])
 @jwt_required()
 def add_credit(student_id):
@@ -263,6 +444,9 @@ def add_credit(student_id):
 
     new_credit = Credit(account_id=account.id, amount=float(amount), reason=reason)
     db.session.add(new_credit)
+    db.session.flush()
+    record_balance_activity('credit', [(account.id, new_credit.amount, new_credit.created_at)])
+    allocate_account_funds([account.id])
     log_activity(actor, f"Added credit of ${amount} for {student.first_name} {student.last_name}", new_credit)
     db.session.commit()
     return jsonify(new_credit.to_dict()), 201
@@ -270,66 +454,206 @@ def add_credit(student_id):
 @billing_bp.route('/accounts', methods=['GET'])
 @jwt_required()
 def get_all_accounts():
-    students = Student.query.filter_by(status='Active').order_by(Student.last_name, Student.first_name).all()
+    active = Student.status == 'Active'
+    created = ensure_financial_accounts(active)
+    created += ensure_account_balances(select(StudentFinancialAccount.id).join(Student).where(active))
+    if created:
+        db.session.commit()
+
+    rows = db.session.execute(
+        select(Student.id, Student.first_name, Student.last_name, AccountBalance)
+        .join(StudentFinancialAccount, StudentFinancialAccount.student_id == Student.id)
+        .join(AccountBalance, AccountBalance.account_id == StudentFinancialAccount.id)
+        .where(active)
+        .order_by(Student.last_name, Student.first_name)
+    ).all()
+
     results = []
-    for student in students:
-        if not student.financial_account:
-            account = StudentFinancialAccount(student=student)
-            db.session.add(account)
-            db.session.commit()
-        else:
-            account = student.financial_account
-
-        total_invoiced = db.session.query(func.sum(InvoiceItem.amount)).join(Invoice).filter(Invoice.account_id == account.id).scalar() or 0
-        total_paid = db.session.query(func.sum(Payment.amount)).filter(Payment.account_id == account.id).scalar() or 0
-        total_credited = db.session.query(func.sum(Credit.amount)).filter(Credit.account_id == account.id).scalar() or 0
-        balance = total_invoiced - (total_paid + total_credited)
-        last_invoice = Invoice.query.filter_by(account_id=account.id).order_by(Invoice.created_at.desc()).first()
-        last_payment = Payment.query.filter_by(account_id=account.id).order_by(Payment.transaction_date.desc()).first()
-        
+    for student_id, first_name, last_name, balance in rows:
         results.append({
-            'student_id': student.id, 'student_name': f"{student.first_name} {student.last_name}",
-            'open_balance': balance, 'last_invoice_date': last_invoice.created_at.isoformat() if last_invoice else None,
-            'last_invoice_amount': last_invoice.total_amount if last_invoice else None,
-            'last_payment_date': last_payment.transaction_date.isoformat() if last_payment else None,
-            'last_payment_amount': last_payment.amount if last_payment else None
+            'student_id': student_id, 'student_name': f"{first_name} {last_name}",
+            'open_balance': balance.open_balance,
+            'last_invoice_date': balance.last_invoice_at.isoformat() if balance.last_invoice_at else None,
+            'last_invoice_amount': balance.last_invoice_amount,
+            'last_payment_date': balance.last_payment_at.isoformat() if balance.last_payment_at else None,
+            'last_payment_amount': balance.last_payment_amount
         })
     return jsonify(results), 200
 
+@billing_bp.route('/families', methods=['GET'])
+@jwt_required()
+def get_family_accounts():
+    """
+    Balances per parent across all of their children's accounts, for front-desk lookups.
+    Supports '?page', '?per_page' (max 200) and '?search' (parent or child name, email, phone).
+    """
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 50, type=int)
+    if not page or page < 1 or not per_page or not 1 <= per_page <= 200:
+        return jsonify({"error": "page must be at least 1 and per_page between 1 and 200."}), 400
+    search = (request.args.get('search') or '').strip() or None
+
+    if search:
+        # Searches go straight to the database; caching each term typed would only fill the cache.
+        families, total = family_rollups(page, per_page, search)
+    else:
+        (families, total), _ = cached(
+            f'families:{page}:{per_page}', FAMILY_TABLES, FAMILIES_CACHE_TTL,
+            lambda: family_rollups(page, per_page)
+        )
+    return jsonify({
+        'families': families, 'page': page, 'per_page': per_page,
+        'total': total, 'pages': (total + per_page - 1) // per_page
+    }), 200
+
 @billing_bp.route('/accounts/<int:student_id>', methods=['GET'])
 @jwt_required()
 def get_student_ledger(student_id):
     student = Student.query.get_or_404(student_id)
+    student_name = f"{student.first_name} {student.last_name}"
     account = student.financial_account
-    if not account: return jsonify({"transactions": [], "summary": {}}), 200
-
-    invoices = Invoice.query.filter_by(account_id=account.id).all()
-    payments = Payment.query.filter_by(account_id=account.id).all()
-    credits = Credit.query.filter_by(account_id=account.id).all()
+    if not account: return jsonify({"transactions": [], "summary": {}, "student_name": student_name, "next_cursor": None}), 200
+
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+        before = decode_ledger_cursor(request.args['before']) if request.args.get('before') else None
+    except ValueError:
+        return jsonify({"error": "Invalid 'before' cursor or 'limit'."}), 400
+
+    rows = ledger_page(account.id, before=before, limit=limit)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    # Item descriptions are only needed for the invoices on this page.
+    invoice_ids = [row['id'] for row in rows if row['type'] == 'Invoice']
+    descriptions = {}
+    if invoice_ids:
+        items = db.session.execute(
+            select(InvoiceItem.invoice_id, InvoiceItem.description)
+            .where(InvoiceItem.invoice_id.in_(invoice_ids)).order_by(InvoiceItem.id)
+        )
+        for invoice_id, description in items:
+            descriptions.setdefault(invoice_id, []).append(description)
 
     transactions = []
-    balance = 0
-    all_tx = []
-    for inv in invoices: all_tx.append({'type': 'Invoice', 'date': inv.created_at, 'obj': inv})
-    for p in payments: all_tx.append({'type': 'Payment', 'date': p.transaction_date, 'obj': p})
-    for c in credits: all_tx.append({'type': 'Credit', 'date': c.created_at, 'obj': c})
-    all_tx.sort(key=lambda x: x['date'], reverse=True)
-    
-    for tx_item in reversed(all_tx):
-        if tx_item['type'] == 'Invoice': balance += tx_item['obj'].total_amount
-        else: balance -= tx_item['obj'].amount
-        tx_item['balance'] = balance
-
-    for tx_item in all_tx:
-        obj = tx_item['obj']
-        if tx_item['type'] == 'Invoice': transactions.append({'type': 'Invoice', 'date': obj.created_at.isoformat() + 'Z', 'description': ", ".join([i.description for i in obj.items]), 'amount': obj.total_amount, 'status': obj.status, 'balance': tx_item['balance']})
-        elif tx_item['type'] == 'Payment': transactions.append({'type': 'Payment', 'date': obj.transaction_date.isoformat() + 'Z', 'description': f"Payment via {obj.method}", 'amount': -obj.amount, 'status': 'Success', 'balance': tx_item['balance']})
-        elif tx_item['type'] == 'Credit': transactions.append({'type': 'Credit', 'date': obj.created_at.isoformat() + 'Z', 'description': obj.reason, 'amount': -obj.amount, 'status': 'Applied', 'balance': tx_item['balance']})
-
-    total_invoiced = sum(inv.total_amount for inv in invoices)
-    total_paid = sum(p.amount for p in payments)
-    total_credited = sum(c.amount for c in credits)
-    final_balance = total_invoiced - (total_paid + total_credited)
-
-    summary = {"paid": total_paid, "credited": total_credited, "unpaid": final_balance}
-    return jsonify({"transactions": transactions, "summary": summary, "student_name": f"{student.first_name} {student.last_name}"}), 200
\ No newline at end of file
+    for row in rows:
+        if row['type'] == 'Invoice': description = ", ".join(descriptions.get(row['id'], []))
+        elif row['type'] == 'Payment': description = f"Payment via {row['detail']}"
+        else: description = row['detail']
+        transactions.append({'id': row['id'], 'type': row['type'], 'date': row['date'].isoformat() + 'Z', 'description': description, 'amount': row['amount'], 'status': row['status'], 'balance': row['balance']})
+
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = encode_ledger_cursor(last['date'], last['type'], last['id'])
+
+    if not account.balance and ensure_account_balances([account.id]):
+        db.session.commit()
+    balance_row = account.balance
+    summary = {"paid": balance_row.total_paid, "credited": balance_row.total_credited, "unpaid": balance_row.open_balance}
+    return jsonify({"transactions": transactions, "summary": summary, "student_name": student_name, "next_cursor": next_cursor}), 200
+
+
+# === Reports ===
+
+@billing_bp.route('/reports/aging', methods=['GET'])
+@jwt_required()
+def get_aging_report():
+    """
+    Accounts-receivable aging per account and school-wide. Serves the snapshot written by
+    'flask refresh-aging' when it was taken today; a missing or older snapshot, or '?live=true',
+    gets a fresh computation instead, so a stopped refresh job never serves stale buckets.
+    """
+    live = request.args.get('live', 'false').lower() in ['true', '1']
+    fresh = not live and db.session.scalar(select(func.max(AgingSnapshot.as_of))) == date.today()
+    snapshot = AgingSnapshot.query.order_by(AgingSnapshot.total_open.desc()).all() if fresh else []
+
+    if snapshot:
+        accounts = [{
+            'account_id': s.account_id, 'student_id': s.student_id, 'student_name': s.student_name,
+            **{name: getattr(s, name) for name, _ in AGING_BUCKETS}, 'total_open': s.total_open
+        } for s in snapshot]
+        as_of, generated_at, source = snapshot[0].as_of, snapshot[0].generated_at, 'snapshot'
+    else:
+        as_of, generated_at, source = date.today(), datetime.utcnow(), 'live'
+        accounts = aging_report(as_of)
+
+    totals = {name: sum(a[name] for a in accounts) for name, _ in AGING_BUCKETS}
+    totals['total_open'] = sum(a['total_open'] for a in accounts)
+    return jsonify({
+        'as_of': as_of.isoformat(), 'generated_at': generated_at.isoformat() + 'Z', 'source': source,
+        'buckets': [name for name, _ in AGING_BUCKETS],
+        'totals': totals, 'accounts': accounts
+    }), 200
+
+
+# === Export ===
+
+EXPORT_FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+def _export_lines(fmt, rows):
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({**row, 'date': row['date'].isoformat() if row['date'] else None})
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        for row in rows:
+            yield json.dumps({**row, 'date': row['date'].isoformat() + 'Z' if row['date'] else None}) + '\n'
+
+def _export_chunks(lines, compress, chunk_size=64 * 1024):
+    """Groups lines into ~64KB chunks, gzip-compressing them on the fly when asked."""
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    pending, size = [], 0
+    for line in lines:
+        pending.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            data = ''.join(pending).encode('utf-8')
+            pending, size = [], 0
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+    data = ''.join(pending).encode('utf-8')
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+@billing_bp.route('/export', methods=['GET'])
+@jwt_required()
+def export_transactions():
+    """
+    Streams every invoice, payment and credit in a date range across all accounts as CSV or
+    JSON Lines, for reconciliation. '?start_date' and '?end_date' are inclusive (YYYY-MM-DD);
+    '?gzip=true' compresses the download.
+    """
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": "Format must be 'csv' or 'jsonl'."}), 400
+    try:
+        start = datetime.strptime(request.args['start_date'], '%Y-%m-%d')
+        end = datetime.strptime(request.args['end_date'], '%Y-%m-%d') + relativedelta(days=1)
+    except (KeyError, ValueError):
+        return jsonify({"error": "start_date and end_date are required in YYYY-MM-DD format."}), 400
+    if end <= start:
+        return jsonify({"error": "end_date must not be before start_date."}), 400
+
+    compress = request.args.get('gzip', 'false').lower() in ['true', '1']
+    filename = f"transactions_{start:%Y%m%d}_{(end - relativedelta(days=1)):%Y%m%d}.{fmt}"
+    mimetype = EXPORT_FORMATS[fmt]
+    if compress:
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    body = _export_chunks(_export_lines(fmt, iter_transactions(start, end)), compress)
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
@@ -7,7 +7,7 @@ from app.models.enrollment_form_model import EnrollmentForm
 from app.models.enrollment_submission_model import EnrollmentSubmission
 from app.models.lead_model import Lead
 from app.models.student_model import Student, Parent
-from app.models.financial_model import StudentFinancialAccount
+from app.models.financial_model import StudentFinancialAccount, AccountBalance
 from app.models.staff_model import Staff
 from app.models.super_admin_model import SuperAdmin
 from app.models.activity_log_model import log_activity
@@ -33,7 +33,7 @@ def _perform_lead_conversion(lead):
     new_student.parents.append(parent)
     db.session.add(new_student)
     
-    financial_account = StudentFinancialAccount(student=new_student)
+    financial_account = StudentFinancialAccount(student=new_student, balance=AccountBalance())
     db.session.add(financial_account)
     
     lead.status = "Enrolled"
@@ -1,4 +1,4 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, Response
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from app.models import db
 from app.models.staff_model import Staff
@@ -7,13 +7,27 @@ from app.models.conversation_model import Conversation, Message, StaffMessage, S
 from app.models.notification_model import Notification
 from app.models.message_log_model import MessageLog
 from app.utils.notifications import send_email_in_background, send_push_notification
-from sqlalchemy import and_, or_, func
+from app.utils.realtime import publish, subscribe, unsubscribe, user_channel, channel_for
+from app.utils.messaging import (
+    record_new_message, mark_conversation_read, unread_total, count_unread_messages,
+    inbox_page, encode_inbox_cursor, decode_inbox_cursor, is_conversation_participant, resolve_sender_names
+)
+from sqlalchemy import and_, or_
 from datetime import datetime, timezone, timedelta
 import json
 import os
+import time
 
 messaging_bp = Blueprint('messaging', __name__)
 
+# Serve the unread badge from the stored per-participant counters; set UNREAD_COUNTERS=false
+# to count from the messages instead (e.g. until `flask rebuild-unread-counts` has been run).
+UNREAD_COUNTERS_ENABLED = os.getenv('UNREAD_COUNTERS', 'true').lower() != 'false'
+# A comment line is sent when the stream is idle this long, so proxies keep the connection open.
+STREAM_HEARTBEAT = 15
+# Streams end after this many seconds; the browser reconnects, which re-checks the token.
+STREAM_MAX_AGE = 30 * 60
+
 def get_current_user():
     claims = get_jwt()
     email = get_jwt_identity()
@@ -33,24 +47,43 @@ def get_unread_count():
     if not user:
         return jsonify({"count": 0}), 200
 
-    total_unread = 0
-    for conv in user.conversations:
-        participant_entry = ConversationParticipant.query.filter_by(
-            conversation_id=conv.id,
-            staff_id=user.id if role == 'staff' else None,
-            super_admin_id=user.id if role == 'superadmin' else None
-        ).first()
+    if UNREAD_COUNTERS_ENABLED:
+        return jsonify({"count": unread_total(user, role)}), 200
+    return jsonify({"count": count_unread_messages(user, role)}), 200
 
-        last_read_at = participant_entry.last_read_at if participant_entry else datetime.min.replace(tzinfo=timezone.utc)
+@messaging_bp.route('/stream', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def stream_events():
+    """
+    Server-Sent Events stream of the user's live events: 'message' (a new message in one of
+    their conversations), 'notification' and 'task'. The first event is 'ready'.
+    Browsers' EventSource can't send headers, so the token may also be passed as '?jwt='.
+    """
+    user, role = get_current_user()
+    if not user:
+        return jsonify({"error": "User not found"}), 404
+    subscription = subscribe([user_channel(role, user.id)])
+    # The stream itself never touches the database; don't hold a connection for its lifetime.
+    db.session.remove()
 
-        unread_in_conv = db.session.query(func.count(Message.id)).filter(
-            Message.conversation_id == conv.id,
-            Message.created_at > last_read_at,
-            or_(Message.sender_type != role, Message.sender_id != user.id)
-        ).scalar()
-        total_unread += unread_in_conv
+    def generate():
+        try:
+            yield "retry: 5000\nevent: ready\ndata: {}\n\n"
+            ends_at = time.monotonic() + STREAM_MAX_AGE
+            while time.monotonic() < ends_at:
+                item = subscription.get(timeout=STREAM_HEARTBEAT)
+                if item is None:
+                    yield ": keepalive\n\n"
+                    continue
+                event_name, data = item
+                yield f"event: {event_name}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            unsubscribe(subscription)
 
-    return jsonify({"count": total_unread}), 200
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
 
 @messaging_bp.route('/users', methods=['GET'])
 @jwt_required()
@@ -70,36 +103,30 @@ def get_users_for_messaging():
 @messaging_bp.route('/conversations', methods=['GET'])
 @jwt_required()
 def get_conversations():
+    """
+    The user's inbox, most recently active first, one page at a time.
+    Supports '?limit' (max 200) and '?before', the 'next_cursor' of the previous page.
+    """
     user, role = get_current_user()
     if not user:
         return jsonify({"error": "User not found"}), 404
-    
-    user_conversations = user.conversations
-    response_data = []
-    for conv in user_conversations:
-        participants = [p for p in conv.get_participants() if p.id != user.id or p.__class__.__name__.lower() != role]
-        participant_names = ", ".join([p.name for p in participants]) or "Yourself"
-        last_message = conv.messages.order_by(db.desc(Message.created_at)).first()
-        participant_entry = ConversationParticipant.query.filter_by(
-            conversation_id=conv.id,
-            staff_id=user.id if role == 'staff' else None,
-            super_admin_id=user.id if role == 'superadmin' else None
-        ).first()
-        last_read_at = participant_entry.last_read_at if participant_entry else datetime.min.replace(tzinfo=timezone.utc)
-        unread_count = db.session.query(Message).filter(
-            Message.conversation_id == conv.id,
-            Message.created_at > last_read_at,
-            or_(Message.sender_type != role, Message.sender_id != user.id)
-        ).count()
-        response_data.append({
-            'id': conv.id,
-            'participant_names': participant_names,
-            'last_message': last_message.content if last_message else "No messages yet.",
-            'last_message_time': last_message.created_at.isoformat() + 'Z' if last_message else conv.created_at.isoformat() + 'Z',
-            'unread_count': unread_count
-        })
-    response_data.sort(key=lambda x: x['last_message_time'], reverse=True)
-    return jsonify(response_data), 200
+
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+        before = decode_inbox_cursor(request.args['before']) if request.args.get('before') else None
+    except ValueError:
+        return jsonify({"error": "Invalid 'before' cursor or 'limit'."}), 400
+
+    conversations = inbox_page(user, role, before=before, limit=limit, use_counters=UNREAD_COUNTERS_ENABLED)
+    has_more = len(conversations) > limit
+    conversations = conversations[:limit]
+
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_inbox_cursor(conversations[-1]['last_activity_at'], conversations[-1]['id'])
+    for conv in conversations:
+        del conv['last_activity_at']
+    return jsonify({"conversations": conversations, "next_cursor": next_cursor}), 200
 
 @messaging_bp.route('/conversations', methods=['POST'])
 @jwt_required()
@@ -130,21 +157,40 @@ def start_conversation():
 @messaging_bp.route('/conversations/<int:conversation_id>/messages', methods=['GET'])
 @jwt_required()
 def get_messages(conversation_id):
+    """
+    Messages of a conversation, oldest first, read through the (conversation_id, id) index.
+    '?after_id' returns only messages newer than that id (for polling), '?before_id' the ones
+    just older (for loading history); without either, the latest '?limit' (default 50, max 200).
+    """
     user, role = get_current_user()
-    conv = Conversation.query.get_or_404(conversation_id)
-    is_participant = any(p for p in user.conversations if p.id == conversation_id)
-    if not is_participant:
+    Conversation.query.get_or_404(conversation_id)
+    if not is_conversation_participant(conversation_id, user, role):
         return jsonify({"error": "Forbidden"}), 403
-    messages = conv.messages.all()
-    participant_entry = ConversationParticipant.query.filter_by(
-        conversation_id=conversation_id,
-        staff_id=user.id if role == 'staff' else None,
-        super_admin_id=user.id if role == 'superadmin' else None
-    ).first()
-    if participant_entry:
-        participant_entry.last_read_at=datetime.now(timezone.utc)
+
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+        after_id = int(request.args['after_id']) if request.args.get('after_id') else None
+        before_id = int(request.args['before_id']) if request.args.get('before_id') else None
+    except ValueError:
+        return jsonify({"error": "Invalid 'after_id', 'before_id' or 'limit'."}), 400
+
+    query = Message.query.filter(Message.conversation_id == conversation_id)
+    if after_id is not None:
+        messages = query.filter(Message.id > after_id).order_by(Message.id).limit(limit).all()
+    else:
+        if before_id is not None:
+            query = query.filter(Message.id < before_id)
+        messages = query.order_by(Message.id.desc()).limit(limit).all()[::-1]
+
+    # Serialized before the commit below, which would expire every message and reload each one.
+    sender_names = resolve_sender_names(messages)
+    payload = [m.to_dict(sender_names) for m in messages]
+
+    # History pages and empty polls leave the read marker alone, so an idle poll writes nothing.
+    if before_id is None and (after_id is None or messages):
+        mark_conversation_read(conversation_id, user, role)
         db.session.commit()
-    return jsonify([m.to_dict() for m in messages]), 200
+    return jsonify(payload), 200
 
 @messaging_bp.route('/conversations/<int:conversation_id>/messages', methods=['POST'])
 @jwt_required()
@@ -159,13 +205,17 @@ def send_message(conversation_id):
     if not is_participant:
         return jsonify({"error": "Forbidden"}), 403
     if role == 'superadmin':
-        new_message = SuperAdminMessage(content=content, sender_id=user.id)
+        new_message = SuperAdminMessage(content=content, sender_id=user.id, sender_name=user.name)
     else: # staff
-        new_message = StaffMessage(content=content, sender_id=user.id)
+        new_message = StaffMessage(content=content, sender_id=user.id, sender_name=user.name)
     conv.messages.append(new_message)
+    record_new_message(new_message, user, role)
     
     all_participants_in_convo = [p.staff or p.super_admin for p in conv.participants]
     all_names = sorted([p.name for p in all_participants_in_convo if p])
+    publish([channel_for(p) for p in all_participants_in_convo if p], 'message', {
+        'conversation_id': conversation_id, 'message': new_message.to_dict()
+    })
     
     new_log = MessageLog(
         conversation_id=conversation_id,
@@ -1,13 +1,18 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required
 from app.models import db
-from app.models.subsidy_model import Subsidy
+from app.models.student_model import Student
+from app.models.subsidy_model import Subsidy, StudentSubsidy, SubsidyClaim
+from app.utils.subsidies import generate_subsidy_claims, record_claim_payment
+from sqlalchemy.orm import joinedload
+from datetime import datetime
 
 subsidy_bp = Blueprint('subsidy', __name__)
 
 @subsidy_bp.route('/', methods=['GET'])
 @jwt_required()
 def get_subsidies():
+    # Invoiced and received amounts are stored on each subsidy, so this stays a single query.
     subsidies = Subsidy.query.order_by(Subsidy.name).all()
     return jsonify([s.to_dict() for s in subsidies]), 200
 
@@ -25,4 +30,79 @@ def create_subsidy():
     new_subsidy = Subsidy(name=name)
     db.session.add(new_subsidy)
     db.session.commit()
-    return jsonify(new_subsidy.to_dict()), 201
\ No newline at end of file
+    return jsonify(new_subsidy.to_dict()), 201
+
+@subsidy_bp.route('/<int:subsidy_id>/students', methods=['GET'])
+@jwt_required()
+def get_subsidy_students(subsidy_id):
+    Subsidy.query.get_or_404(subsidy_id)
+    awards = StudentSubsidy.query.filter_by(subsidy_id=subsidy_id).options(joinedload(StudentSubsidy.student)).all()
+    return jsonify([a.to_dict() for a in awards]), 200
+
+@subsidy_bp.route('/<int:subsidy_id>/students', methods=['POST'])
+@jwt_required()
+def award_subsidy(subsidy_id):
+    """Links a student to a subsidy with the monthly amount the agency covers."""
+    Subsidy.query.get_or_404(subsidy_id)
+    data = request.get_json()
+    try:
+        student_id = int(data['student_id'])
+        monthly_amount = float(data['monthly_amount'])
+        start_date = datetime.strptime(data['start_date'], '%Y-%m-%d').date()
+        end_date = datetime.strptime(data['end_date'], '%Y-%m-%d').date() if data.get('end_date') else None
+    except (KeyError, ValueError, TypeError):
+        return jsonify({"error": "student_id, monthly_amount and start_date (YYYY-MM-DD) are required."}), 400
+    if monthly_amount <= 0:
+        return jsonify({"error": "monthly_amount must be positive."}), 400
+    Student.query.get_or_404(student_id)
+
+    award = StudentSubsidy.query.filter_by(subsidy_id=subsidy_id, student_id=student_id).first()
+    if award:
+        award.monthly_amount, award.start_date, award.end_date = monthly_amount, start_date, end_date
+        award.is_active = data.get('is_active', True)
+        status_code = 200
+    else:
+        award = StudentSubsidy(subsidy_id=subsidy_id, student_id=student_id, monthly_amount=monthly_amount, start_date=start_date, end_date=end_date)
+        db.session.add(award)
+        status_code = 201
+    db.session.commit()
+    return jsonify(award.to_dict()), status_code
+
+@subsidy_bp.route('/<int:subsidy_id>/claims', methods=['GET'])
+@jwt_required()
+def get_subsidy_claims(subsidy_id):
+    Subsidy.query.get_or_404(subsidy_id)
+    claims = SubsidyClaim.query.filter_by(subsidy_id=subsidy_id).order_by(SubsidyClaim.period.desc()).all()
+    return jsonify([c.to_dict() for c in claims]), 200
+
+@subsidy_bp.route('/claims/<int:claim_id>', methods=['GET'])
+@jwt_required()
+def get_subsidy_claim(claim_id):
+    claim = SubsidyClaim.query.get_or_404(claim_id)
+    return jsonify({**claim.to_dict(), 'lines': [line.to_dict() for line in claim.lines]}), 200
+
+@subsidy_bp.route('/claims/generate', methods=['POST'])
+@jwt_required()
+def generate_claims():
+    """Creates this month's (or 'month': 'YYYY-MM') claim for every active subsidy, or for 'subsidy_ids'."""
+    data = request.get_json() or {}
+    try:
+        period = datetime.strptime(data['month'], '%Y-%m').date() if data.get('month') else datetime.utcnow().date().replace(day=1)
+    except ValueError:
+        return jsonify({"error": "month must be in YYYY-MM format."}), 400
+
+    report = generate_subsidy_claims(period, data.get('subsidy_ids'))
+    db.session.commit()
+    return jsonify({'period': period.strftime('%Y-%m'), 'subsidies': report}), 201
+
+@subsidy_bp.route('/claims/<int:claim_id>/payments', methods=['POST'])
+@jwt_required()
+def receive_claim_payment(claim_id):
+    data = request.get_json() or {}
+    amount = data.get('amount')
+    if not amount or float(amount) <= 0:
+        return jsonify({"error": "Invalid payment amount."}), 400
+    if not record_claim_payment(claim_id, float(amount)):
+        return jsonify({"error": "Claim not found."}), 404
+    db.session.commit()
+    return jsonify(SubsidyClaim.query.get(claim_id).to_dict()), 201
@@ -7,6 +7,7 @@ from app.models.staff_model import Staff
 from app.models.super_admin_model import SuperAdmin
 from app.models.activity_log_model import log_activity
 from app.utils.notifications import create_notifications_and_send_emails
+from app.utils.realtime import publish, channel_for
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from sqlalchemy import or_
 from datetime import datetime
@@ -129,6 +130,8 @@ def create_task():
     if recipients:
          create_notifications_and_send_emails(list(recipients), message, new_task)
 
+    db.session.flush()
+    publish([channel_for(staff) for staff in recipients], 'task', {'task_id': new_task.id, 'title': new_task.title})
     db.session.commit()
     return jsonify(new_task.to_dict()), 201
 
@@ -180,6 +183,7 @@ def update_task(id):
         message = f"{actor.name} assigned you a task: '{task.title}' for the lead {student_name}."
         if new_recipients:
             create_notifications_and_send_emails(list(new_recipients), message, task)
+            publish([channel_for(staff) for staff in new_recipients], 'task', {'task_id': task.id, 'title': task.title})
     
     db.session.commit()
     return jsonify(task.to_dict()), 200
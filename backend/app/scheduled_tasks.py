@@ -1,91 +1,332 @@
+import os
+import time
 import click
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
 from flask.cli import with_appcontext
-from datetime import date
+from datetime import date, datetime
 from dateutil.relativedelta import relativedelta
 from .models import db
-from .models.financial_model import Subscription, Invoice, InvoiceItem
-from .models.student_model import Parent
-from .utils.notifications import send_email_in_background
-import os
+from .models.activity_log_model import log_activity
+from .models.financial_model import Subscription
+from .utils.billing import rebuild_balances, backfill_invoice_totals, refresh_aging_snapshot, mark_overdue_invoices
+from .utils.payment_import import import_payments
+from .utils.allocation import allocate_all_funds
+from .utils.statements import collect_statements, render_statement_batch
+from .utils.notifications import send_html_emails_in_background
+from .utils.subsidies import generate_subsidy_claims, rebuild_subsidy_totals
+from .utils.realtime import prune_realtime_events
+from .utils.messaging import rebuild_unread_counts, rebuild_last_messages, backfill_sender_names
+from .utils.invoicing import run_invoice_generation, run_invoice_partition, partition_due_accounts, preview_invoice_generation
 
 @click.command('generate-invoices', help='Checks for subscriptions due and generates invoices.')
+@click.option('--chunk-size', default=200, show_default=True, help='Subscriptions billed and committed per chunk.')
+@click.option('--workers', default=1, show_default=True, help='Worker processes, each billing its own account id range.')
+@click.option('--catch-up', is_flag=True, help='Bill every missed period up to today instead of one period per subscription.')
+@click.option('--dry-run', is_flag=True, help='Report what would be billed without writing anything.')
 @with_appcontext
-def generate_invoices_command():
+def generate_invoices_command(chunk_size, workers, catch_up, dry_run):
     """
     This is the scheduled task. 
     It finds all active subscriptions where the next_invoice_date is today or in the past
-    and generates a new invoice for them.
+    and generates a new invoice for them, committing one chunk at a time. An interrupted
+    run resumes from its last committed chunk the next time it is started the same day.
+    With --catch-up, subscriptions that are months behind get all their missed periods in one pass.
     """
     today = date.today()
-    due_subscriptions = Subscription.query.filter(
+    due_count = db.session.query(Subscription.id).filter(
         Subscription.status == 'Active',
         Subscription.next_invoice_date <= today
-    ).all()
+    ).count()
 
-    if not due_subscriptions:
+    if not due_count:
         print("No invoices to generate today.")
         return
 
-    print(f"Found {len(due_subscriptions)} subscription(s) due for invoicing.")
-
-    for sub in due_subscriptions:
-        print(f"Processing subscription for student: {sub.account.student.first_name} {sub.account.student.last_name}")
-        
-        # Calculate the due date for the new invoice
-        due_date = today.replace(day=sub.due_day)
-        if today.day > sub.due_day:
-            due_date += relativedelta(months=1)
-
-        # Create the new invoice
-        new_invoice = Invoice(
-            account_id=sub.account_id,
-            status='Sent', # Automatically mark as 'Sent'
-            due_date=due_date
-        )
-        
-        # Add items from the subscription template
-        for item_data in sub.items_json:
-            # THIS IS THE FIX: Treat an empty string for amount as 0
-            amount = float(item_data.get('amount') or 0)
-            item = InvoiceItem(
-                description=item_data.get('description', ''),
-                amount=amount
-            )
-            new_invoice.items.append(item)
-        
-        db.session.add(new_invoice)
-        
-        # --- Send Email Notification to Parent ---
-        parent = sub.account.student.parents[0] if sub.account.student.parents else None
-        if parent:
-            student_name = f"{sub.account.student.first_name} {sub.account.student.last_name}"
-            frontend_url = os.getenv('FRONTEND_URL', 'http://localhost:5173')
-            # The parent portal link doesn't exist yet, so we'll link to a placeholder
-            action_link = f"{frontend_url}/parent/billing"
-
-            email_data = {
-                'message': f"A new tuition invoice for {student_name} is ready. The total amount is ${new_invoice.total_amount:.2f} and is due on {due_date.strftime('%B %d, %Y')}.",
-                'action_link': action_link
-            }
-            send_email_in_background(
-                subject=f"New Tuition Invoice for {student_name}",
-                recipients=[parent.email],
-                template_data=email_data
-            )
-            print(f"  - Invoice email queued for {parent.email}")
-
-
-        if sub.cycle == 'Monthly':
-            sub.next_invoice_date += relativedelta(months=1)
-        
-        print(f"  - Invoice created. Next invoice date set to: {sub.next_invoice_date.isoformat()}")
+    print(f"Found {due_count} subscription(s) due for invoicing.")
+
+    if dry_run:
+        report = preview_invoice_generation(today, catch_up)
+        print(f"Dry run: {report['invoices']} invoice(s) for {report['subscriptions']} subscription(s), totalling ${report['total_amount']:,.2f}.")
+        for month, totals in sorted(report['by_month'].items()):
+            print(f"  - {month}: {totals['invoices']} invoice(s), ${totals['total_amount']:,.2f}")
+        if report['ending']:
+            print(f"  - {report['ending']} subscription(s) would end (past their end date).")
+        return
+
+    if workers <= 1:
+        results = [run_invoice_generation(today, chunk_size, catch_up=catch_up)]
+    else:
+        partitions = partition_due_accounts(workers, today)
+        print(f"Billing across {len(partitions)} worker(s): " + ", ".join(f"accounts {lo}-{hi}" for lo, hi in partitions))
+        # Each worker builds its own app and database connections, so use fresh interpreters.
+        with ProcessPoolExecutor(max_workers=len(partitions), mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [pool.submit(run_invoice_partition, lo, hi, chunk_size, today.isoformat(), catch_up) for lo, hi in partitions]
+            results = [f.result() for f in futures]
+
+    created = sum(r['invoices_created'] for r in results)
+    failed = sum(r['failed'] for r in results)
+    print(f"Successfully committed {created} new invoice(s) to the database.")
+    if failed:
+        print(f"{failed} subscription(s) could not be billed; see the invoice_runs table for details.")
+
+@click.command('rebuild-balances', help='Verifies stored account balances against the ledger and repairs drift.')
+@click.option('--check-only', is_flag=True, help='Report drifted accounts without rewriting them.')
+@with_appcontext
+def rebuild_balances_command(check_only):
+    """
+    Reconciliation task for the account_balances table.
+    Recomputes every account from its invoices, payments and credits and rewrites
+    any balance row that disagrees (or is missing).
+    """
+    checked, drifted = rebuild_balances(repair=not check_only)
+    print(f"Checked {checked} account(s); {len(drifted)} out of sync.")
+    if drifted:
+        print(f"  - Drifted account ids: {', '.join(str(a) for a in drifted[:50])}{' ...' if len(drifted) > 50 else ''}")
+
+    if check_only or not drifted:
+        return
+    try:
+        db.session.commit()
+        print("Repaired balances committed to the database.")
+    except Exception as e:
+        db.session.rollback()
+        print(f"An error occurred. Rolling back changes. Error: {e}")
 
+@click.command('backfill-invoice-totals', help='Rebuilds the stored invoice total and amount paid from items and payment allocations.')
+@click.option('--batch-size', default=5000, show_default=True, help='Invoice ids updated per transaction.')
+@with_appcontext
+def backfill_invoice_totals_command(batch_size):
+    """
+    Data migration and repair for the invoices.total_amount and invoices.amount_paid columns.
+    amount_paid is rebuilt from payment_allocations, then any payments and credits not yet
+    allocated are applied, oldest invoices first. It is safe to run again.
+    """
+    updated = backfill_invoice_totals(batch_size)
+    print(f"Backfilled totals for {updated} invoice(s).")
+    created, applied = allocate_all_funds()
+    print(f"Created {created} allocations; ${applied:,.2f} applied to open invoices.")
+
+@click.command('refresh-aging', help='Rebuilds the cached accounts-receivable aging snapshot.')
+@with_appcontext
+def refresh_aging_command():
+    """
+    Scheduled task behind GET /api/billing/reports/aging.
+    Recomputes the aging buckets for every account and swaps in the new snapshot.
+    """
     try:
+        count = refresh_aging_snapshot()
         db.session.commit()
-        print("Successfully committed all new invoices to the database.")
+        print(f"Aging snapshot refreshed for {count} account(s) with open balances.")
     except Exception as e:
         db.session.rollback()
         print(f"An error occurred. Rolling back changes. Error: {e}")
 
+@click.command('mark-overdue', help='Marks unpaid invoices past their due date as Overdue, optionally adding a late fee.')
+@click.option('--late-fee', type=float, envvar='LATE_FEE_AMOUNT', default=None, help='Fee added to each newly overdue invoice (or set LATE_FEE_AMOUNT).')
+@click.option('--fee-description', default='Late fee', show_default=True, help='Invoice item description for the fee.')
+@with_appcontext
+def mark_overdue_command(late_fee, fee_description):
+    today = date.today()
+    try:
+        marked, fees, fee_total = mark_overdue_invoices(today, late_fee=late_fee, fee_description=fee_description)
+        if marked:
+            summary = f"Marked {marked} invoices overdue as of {today.isoformat()}"
+            if fees:
+                summary += f" and applied {fees} late fees totalling ${fee_total:,.2f}"
+            log_activity(None, summary)
+        db.session.commit()
+        print(f"{marked} invoices marked overdue. {fees} late fees applied (${fee_total:,.2f}).")
+    except Exception as e:
+        db.session.rollback()
+        print(f"Overdue sweep failed: {e}")
+
+@click.command('import-payments', help='Records a CSV deposit file of payments, matching rows to accounts and invoices.')
+@click.argument('csv_file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--method', default='Bank Transfer', show_default=True, help='Payment method for rows that do not name one.')
+@click.option('--dry-run', is_flag=True, help='Print the match report without recording anything.')
+@with_appcontext
+def import_payments_command(csv_file, method, dry_run):
+    try:
+        report, summary = import_payments(csv_file.read(), default_method=method, dry_run=dry_run)
+        for entry in report:
+            if entry['status'] != 'matched':
+                print(f"Row {entry['row']}: {entry['status']} - {entry['message']}")
+        if not dry_run:
+            db.session.commit()
+        print(
+            f"{'Dry run: ' if dry_run else ''}{summary['matched']} matched, {summary['unapplied']} unapplied, "
+            f"{summary['unmatched']} unmatched, {summary['error']} invalid of {summary['total_rows']} rows. "
+            f"${summary['amount_recorded']:,.2f} {'would be ' if dry_run else ''}recorded."
+        )
+    except Exception as e:
+        db.session.rollback()
+        print(f"Payment import failed: {e}")
+
+@click.command('allocate-funds', help='Applies unallocated payments and credits to the oldest open invoices of every account.')
+@click.option('--batch-size', default=500, show_default=True, help='Accounts allocated and committed per batch.')
+@with_appcontext
+def allocate_funds_command(batch_size):
+    try:
+        created, applied = allocate_all_funds(batch_size=batch_size)
+        print(f"Created {created} allocations; ${applied:,.2f} applied to open invoices.")
+    except Exception as e:
+        db.session.rollback()
+        print(f"Allocation failed: {e}")
+
+@click.command('generate-statements', help='Renders a monthly account statement for every family.')
+@click.option('--month', default=None, help='Statement month as YYYY-MM. Defaults to last month.')
+@click.option('--output-dir', type=click.Path(file_okay=False), default=None, help='Write each statement to an HTML file in this directory.')
+@click.option('--email', is_flag=True, help='Email each statement to the parent.')
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True, help='Rendering processes.')
+@click.option('--batch-size', default=50, show_default=True, help='Statements handed to a worker at a time.')
+@click.option('--include-inactive', is_flag=True, help='Also produce statements for families with no activity and nothing owing.')
+@with_appcontext
+def generate_statements_command(month, output_dir, email, workers, batch_size, include_inactive):
+    """
+    Ledger data for every family is read up front in a few bulk queries, then the HTML is
+    rendered across a process pool, since rendering is CPU-bound and the database is not
+    needed for it.
+    """
+    if not output_dir and not email:
+        print("Nothing to do: pass --output-dir and/or --email.")
+        return
+    try:
+        period_start = datetime.strptime(month, '%Y-%m') if month else datetime.combine(date.today().replace(day=1), datetime.min.time()) - relativedelta(months=1)
+    except ValueError:
+        print("--month must be in YYYY-MM format.")
+        return
+    period_end = period_start + relativedelta(months=1)
+
+    started = time.perf_counter()
+    statements = collect_statements(period_start, period_end, include_inactive)
+    loaded = time.perf_counter()
+    if not statements:
+        print(f"No statements to generate for {period_start:%Y-%m}.")
+        return
+
+    batches = [statements[i:i + batch_size] for i in range(0, len(statements), batch_size)]
+    if workers <= 1 or len(batches) == 1:
+        rendered = [doc for batch in batches for doc in render_statement_batch(batch)]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(batches)), mp_context=multiprocessing.get_context('spawn')) as pool:
+            rendered = [doc for docs in pool.map(render_statement_batch, batches) for doc in docs]
+    finished_rendering = time.perf_counter()
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        for parent_id, _, html in rendered:
+            with open(os.path.join(output_dir, f"statement_{period_start:%Y-%m}_parent_{parent_id}.html"), 'w', encoding='utf-8') as f:
+                f.write(html)
+    if email:
+        subject = f"Account Statement for {period_start:%B %Y}"
+        send_html_emails_in_background([(subject, [address], html) for _, address, html in rendered if address])
+    finished = time.perf_counter()
+
+    render_time = finished_rendering - loaded
+    print(f"Generated {len(rendered)} statement(s) for {period_start:%Y-%m} in {finished - started:.2f}s.")
+    print(f"  - Data loaded in {loaded - started:.2f}s; rendered in {render_time:.2f}s ({len(rendered) / max(render_time, 1e-6):,.0f} statements/sec).")
+    print(f"  - Overall throughput: {len(rendered) / max(finished - started, 1e-6):,.0f} statements/sec.")
+    if output_dir:
+        print(f"  - Written to {output_dir}.")
+    if email:
+        print(f"  - {sum(1 for _, address, _ in rendered if address)} email(s) queued.")
+
+@click.command('generate-subsidy-claims', help='Creates the monthly claim for every active subsidy.')
+@click.option('--month', default=None, help='Claim month as YYYY-MM. Defaults to the current month.')
+@with_appcontext
+def generate_subsidy_claims_command(month):
+    try:
+        period = datetime.strptime(month, '%Y-%m').date() if month else date.today().replace(day=1)
+    except ValueError:
+        print("--month must be in YYYY-MM format.")
+        return
+    try:
+        report = generate_subsidy_claims(period)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Claim generation failed: {e}")
+        return
+
+    for entry in report:
+        line = f"  - {entry['name']}: {entry['status']}"
+        if entry['status'] == 'created':
+            line += f", {entry['students']} student(s), ${entry['amount']:,.2f}"
+        if entry['missing_invoices']:
+            line += f" ({len(entry['missing_invoices'])} awarded student(s) have no invoice this month)"
+        print(line)
+    created = [e for e in report if e['status'] == 'created']
+    print(f"Created {len(created)} claim(s) for {period:%Y-%m} totalling ${sum(e['amount'] for e in created):,.2f}.")
+
+@click.command('rebuild-subsidy-totals', help='Recomputes stored subsidy invoiced/received totals from their claims.')
+@with_appcontext
+def rebuild_subsidy_totals_command():
+    try:
+        updated = rebuild_subsidy_totals()
+        db.session.commit()
+        print(f"Recomputed totals for {updated} subsidies.")
+    except Exception as e:
+        db.session.rollback()
+        print(f"Rebuild failed: {e}")
+
+@click.command('rebuild-unread-counts', help='Recomputes stored unread message counters from the messages.')
+@with_appcontext
+def rebuild_unread_counts_command():
+    try:
+        updated = rebuild_unread_counts()
+        db.session.commit()
+        print(f"Recomputed unread counters for {updated} conversation participant(s).")
+    except Exception as e:
+        db.session.rollback()
+        print(f"Rebuild failed: {e}")
+
+@click.command('rebuild-last-messages', help='Points every conversation at its newest message for the inbox.')
+@with_appcontext
+def rebuild_last_messages_command():
+    try:
+        updated = rebuild_last_messages()
+        db.session.commit()
+        print(f"Updated the last message of {updated} conversation(s).")
+    except Exception as e:
+        db.session.rollback()
+        print(f"Rebuild failed: {e}")
+
+@click.command('backfill-sender-names', help='Copies sender names onto messages sent before messages stored them.')
+@with_appcontext
+def backfill_sender_names_command():
+    try:
+        updated = backfill_sender_names()
+        db.session.commit()
+        print(f"Stored the sender name on {updated} message(s).")
+    except Exception as e:
+        db.session.rollback()
+        print(f"Backfill failed: {e}")
+
+@click.command('prune-realtime-events', help='Deletes live events older than REALTIME_EVENT_RETENTION seconds.')
+@with_appcontext
+def prune_realtime_events_command():
+    try:
+        deleted = prune_realtime_events(current_app.config['REALTIME_EVENT_RETENTION'])
+        db.session.commit()
+        print(f"Deleted {deleted} realtime event(s).")
+    except Exception as e:
+        db.session.rollback()
+        print(f"Prune failed: {e}")
+
 def register_commands(app):
-    app.cli.add_command(generate_invoices_command)
\ No newline at end of file
+    app.cli.add_command(generate_invoices_command)
+    app.cli.add_command(rebuild_balances_command)
+    app.cli.add_command(backfill_invoice_totals_command)
+    app.cli.add_command(refresh_aging_command)
+    app.cli.add_command(mark_overdue_command)
+    app.cli.add_command(import_payments_command)
+    app.cli.add_command(allocate_funds_command)
+    app.cli.add_command(generate_statements_command)
+    app.cli.add_command(generate_subsidy_claims_command)
+    app.cli.add_command(rebuild_subsidy_totals_command)
+    app.cli.add_command(rebuild_unread_counts_command)
+    app.cli.add_command(rebuild_last_messages_command)
+    app.cli.add_command(backfill_sender_names_command)
+    app.cli.add_command(prune_realtime_events_command)
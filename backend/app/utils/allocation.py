@@ -0,0 +1,173 @@
+from sqlalchemy import select, insert, update, delete, func, bindparam
+from app.models import db
+from app.models.financial_model import StudentFinancialAccount, Invoice, Payment, Credit, PaymentAllocation
+from app.utils.billing import apply_invoice_settlements, CLOSED_INVOICE_STATUSES, SETTLEMENT_TOLERANCE
+
+
+def _unallocated(session, model, fund_column, date_column, account_ids, *extra_columns):
+    """Rows of 'model' (payments or credits) in the accounts that still have money left to allocate."""
+    allocated = (
+        select(fund_column.label('fund_id'), func.sum(PaymentAllocation.amount).label('allocated'))
+        .where(PaymentAllocation.account_id.in_(account_ids), fund_column.isnot(None))
+        .group_by(fund_column)
+        .subquery()
+    )
+    remaining = model.amount - func.coalesce(allocated.c.allocated, 0)
+    return session.execute(
+        select(model.id, model.account_id, date_column.label('occurred_at'), remaining.label('remaining'), *extra_columns)
+        .outerjoin(allocated, allocated.c.fund_id == model.id)
+        .where(model.account_id.in_(account_ids), remaining > SETTLEMENT_TOLERANCE)
+    ).all()
+
+
+def allocate_account_funds(account_ids, session=None):
+    """
+    Applies the unallocated payments and credits of the given accounts to their open invoices
+    in the current transaction; this is the only place payments and credits reach amount_paid,
+    which always equals the invoice's allocations. A payment made against a specific invoice
+    goes to it first, up to what it still owes; the rest of that payment and all other funds
+    are spread first-in, first-out over the open invoices, oldest due first. amount_paid moves
+    in one bulk UPDATE. The accounts are locked for the duration, so concurrent runs never
+    allocate the same money twice. Returns (allocations_created, amount_applied).
+    """
+    session = session or db.session
+    account_ids = list(account_ids)
+    if not account_ids:
+        return 0, 0.0
+    session.flush()
+    session.execute(
+        select(StudentFinancialAccount.id).where(StudentFinancialAccount.id.in_(account_ids)).with_for_update()
+    ).all()
+
+    payments = _unallocated(session, Payment, PaymentAllocation.payment_id, Payment.transaction_date, account_ids, Payment.invoice_id)
+    credits = _unallocated(session, Credit, PaymentAllocation.credit_id, Credit.created_at, account_ids)
+    if not payments and not credits:
+        return 0, 0.0
+
+    open_invoices, due = {}, {}
+    for inv in session.execute(
+        select(Invoice.id, Invoice.account_id, (Invoice.total_amount - Invoice.amount_paid).label('due'))
+        .where(
+            Invoice.account_id.in_(account_ids),
+            Invoice.status.notin_(CLOSED_INVOICE_STATUSES),
+            Invoice.total_amount - Invoice.amount_paid > SETTLEMENT_TOLERANCE
+        )
+        .order_by(Invoice.account_id, Invoice.due_date.is_(None), Invoice.due_date, Invoice.id)
+    ):
+        open_invoices.setdefault(inv.account_id, []).append(inv.id)
+        due[inv.id] = inv.due
+
+    allocations, settlements = [], {}
+
+    def allocate(account_id, invoice_id, amount, fund_id, fund_column):
+        allocations.append({
+            'account_id': account_id, 'invoice_id': invoice_id, 'amount': amount,
+            'payment_id': fund_id if fund_column == 'payment_id' else None,
+            'credit_id': fund_id if fund_column == 'credit_id' else None,
+        })
+        settlements[invoice_id] = settlements.get(invoice_id, 0.0) + amount
+        due[invoice_id] -= amount
+
+    funds = []
+    for p in sorted(payments, key=lambda p: (p.occurred_at is None, p.occurred_at, p.id)):
+        remaining = p.remaining
+        if p.invoice_id and due.get(p.invoice_id, 0) > SETTLEMENT_TOLERANCE:
+            applied = min(remaining, due[p.invoice_id])
+            allocate(p.account_id, p.invoice_id, applied, p.id, 'payment_id')
+            remaining -= applied
+        if remaining > SETTLEMENT_TOLERANCE:
+            funds.append((p.occurred_at, 0, p.id, p.account_id, remaining, 'payment_id'))
+    funds.extend((c.occurred_at, 1, c.id, c.account_id, c.remaining, 'credit_id') for c in credits)
+
+    for _, _, fund_id, account_id, remaining, fund_column in sorted(funds, key=lambda f: (f[0] is None, f[0], f[1], f[2])):
+        queue = open_invoices.get(account_id, [])
+        while remaining > SETTLEMENT_TOLERANCE and queue:
+            invoice_id = queue[0]
+            if due[invoice_id] <= SETTLEMENT_TOLERANCE:
+                queue.pop(0)
+                continue
+            applied = min(remaining, due[invoice_id])
+            allocate(account_id, invoice_id, applied, fund_id, fund_column)
+            remaining -= applied
+
+    if allocations:
+        session.execute(insert(PaymentAllocation), allocations)
+    apply_invoice_settlements(settlements, session)
+    return len(allocations), round(sum(settlements.values()), 2)
+
+
+def release_excess_allocations(invoice_ids):
+    """
+    For invoices whose total was lowered below what has been allocated to them, gives the
+    surplus back to the payments and credits it came from, newest allocation first, so the
+    allocation engine can apply it elsewhere. Allocations are trimmed or deleted in bulk and
+    amount_paid comes down to the new total. Returns the ids of the accounts with money freed.
+    """
+    over = db.session.execute(
+        select(Invoice.id, Invoice.account_id, (Invoice.amount_paid - Invoice.total_amount).label('excess'))
+        .where(Invoice.id.in_(list(invoice_ids)), Invoice.amount_paid - Invoice.total_amount > SETTLEMENT_TOLERANCE)
+    ).all()
+    if not over:
+        return set()
+    excess = {inv.id: inv.excess for inv in over}
+
+    deleted, trimmed = [], []
+    for allocation_id, invoice_id, amount in db.session.execute(
+        select(PaymentAllocation.id, PaymentAllocation.invoice_id, PaymentAllocation.amount)
+        .where(PaymentAllocation.invoice_id.in_(excess))
+        .order_by(PaymentAllocation.invoice_id, PaymentAllocation.id.desc())
+    ):
+        if excess[invoice_id] <= SETTLEMENT_TOLERANCE:
+            continue
+        if amount <= excess[invoice_id] + SETTLEMENT_TOLERANCE:
+            deleted.append(allocation_id)
+            excess[invoice_id] -= amount
+        else:
+            trimmed.append({'b_id': allocation_id, 'b_amount': amount - excess[invoice_id]})
+            excess[invoice_id] = 0
+
+    if deleted:
+        db.session.execute(delete(PaymentAllocation).where(PaymentAllocation.id.in_(deleted)))
+    if trimmed:
+        table = PaymentAllocation.__table__
+        db.session.execute(update(table).where(table.c.id == bindparam('b_id')).values(amount=bindparam('b_amount')), trimmed)
+    table = Invoice.__table__
+    db.session.execute(
+        update(table).where(table.c.id == bindparam('b_id')).values(amount_paid=table.c.total_amount),
+        [{'b_id': inv.id} for inv in over]
+    )
+    return {inv.account_id for inv in over}
+
+
+def allocate_all_funds(batch_size=500, session=None):
+    """Runs the allocation engine over every account, committing one batch of accounts at a time."""
+    session = session or db.session
+    last_id, created, applied = 0, 0, 0.0
+    while True:
+        account_ids = session.execute(
+            select(StudentFinancialAccount.id).where(StudentFinancialAccount.id > last_id)
+            .order_by(StudentFinancialAccount.id).limit(batch_size)
+        ).scalars().all()
+        if not account_ids:
+            break
+        batch_created, batch_applied = allocate_account_funds(account_ids, session)
+        session.commit()
+        created += batch_created
+        applied += batch_applied
+        last_id = account_ids[-1]
+    return created, round(applied, 2)
+
+
+def invoice_allocations(account_id):
+    """Every invoice of an account with what has been allocated to it, in one grouped query."""
+    allocated = func.coalesce(func.sum(PaymentAllocation.amount), 0)
+    return db.session.execute(
+        select(
+            Invoice.id, Invoice.status, Invoice.due_date, Invoice.created_at, Invoice.total_amount,
+            allocated.label('allocated'), (Invoice.total_amount - allocated).label('outstanding')
+        )
+        .outerjoin(PaymentAllocation, PaymentAllocation.invoice_id == Invoice.id)
+        .where(Invoice.account_id == account_id)
+        .group_by(Invoice.id, Invoice.status, Invoice.due_date, Invoice.created_at, Invoice.total_amount)
+        .order_by(Invoice.due_date.is_(None), Invoice.due_date, Invoice.id)
+    ).mappings().all()
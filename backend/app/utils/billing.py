@@ -0,0 +1,698 @@
+import base64
+from datetime import datetime, date, timedelta
+from sqlalchemy import func, select, insert, update, case, bindparam, literal, union_all, and_, or_
+from app.models import db
+from app.models.student_model import Student, Parent, parent_student_association
+from app.models.financial_model import StudentFinancialAccount, AccountBalance, Invoice, InvoiceItem, Payment, Credit, AgingSnapshot, PaymentAllocation
+
+# Which AccountBalance columns each kind of ledger activity moves:
+# (running total, last activity timestamp, last activity amount)
+BALANCE_COLUMNS = {
+    'invoice': ('total_invoiced', 'last_invoice_at', 'last_invoice_amount'),
+    'payment': ('total_paid', 'last_payment_at', 'last_payment_amount'),
+    'credit': ('total_credited', 'last_credit_at', None),
+}
+
+
+def ensure_financial_accounts(student_filter):
+    """
+    Creates the missing StudentFinancialAccount rows for every student matching
+    'student_filter' with a single bulk insert. Returns the number of accounts created.
+    """
+    missing_ids = db.session.execute(
+        select(Student.id)
+        .outerjoin(StudentFinancialAccount, StudentFinancialAccount.student_id == Student.id)
+        .where(StudentFinancialAccount.id.is_(None), student_filter)
+    ).scalars().all()
+
+    if missing_ids:
+        db.session.execute(insert(StudentFinancialAccount), [{'student_id': sid} for sid in missing_ids])
+    return len(missing_ids)
+
+
+def student_selector_filter(student_ids=None, grade_level=None, status=None):
+    """
+    Builds a Student filter for bulk billing requests. Explicit ids, grade level(s) and
+    status(es) are combined; when no ids are given, only 'Active' students are selected
+    unless another status is asked for. Returns None if nothing would be selected.
+    """
+    if not (student_ids or grade_level or status):
+        return None
+    if not student_ids and not status:
+        status = 'Active'
+
+    criteria = []
+    if student_ids:
+        criteria.append(Student.id.in_(student_ids))
+    if grade_level:
+        criteria.append(Student.grade_level.in_(grade_level if isinstance(grade_level, list) else [grade_level]))
+    if status:
+        criteria.append(Student.status.in_(status if isinstance(status, list) else [status]))
+    return and_(*criteria)
+
+
+def summarize_accounts(account_scope):
+    """
+    Computes invoiced/paid/credited totals and the last invoice and payment for
+    every account id selected by 'account_scope' (a SELECT of account ids).
+    Uses a fixed number of grouped queries regardless of how many accounts match.
+    Returns a dict keyed by account id.
+    """
+    summaries = {}
+
+    def entry(account_id):
+        if account_id not in summaries:
+            summaries[account_id] = {
+                'total_invoiced': 0.0, 'total_paid': 0.0, 'total_credited': 0.0,
+                'last_invoice_at': None, 'last_invoice_amount': None,
+                'last_payment_at': None, 'last_payment_amount': None,
+                'last_credit_at': None,
+            }
+        return summaries[account_id]
+
+    invoiced = db.session.execute(
+        select(Invoice.account_id, func.sum(Invoice.total_amount))
+        .where(Invoice.account_id.in_(account_scope))
+        .group_by(Invoice.account_id)
+    )
+    for account_id, total in invoiced:
+        entry(account_id)['total_invoiced'] = float(total or 0)
+
+    paid = db.session.execute(
+        select(Payment.account_id, func.sum(Payment.amount))
+        .where(Payment.account_id.in_(account_scope))
+        .group_by(Payment.account_id)
+    )
+    for account_id, total in paid:
+        entry(account_id)['total_paid'] = float(total or 0)
+
+    credited = db.session.execute(
+        select(Credit.account_id, func.sum(Credit.amount), func.max(Credit.created_at))
+        .where(Credit.account_id.in_(account_scope))
+        .group_by(Credit.account_id)
+    )
+    for account_id, total, last_credit_at in credited:
+        summary = entry(account_id)
+        summary['total_credited'] = float(total or 0)
+        summary['last_credit_at'] = last_credit_at
+
+    # Latest invoice per account, ranked in the database instead of one query per account.
+    ranked_invoices = select(
+        Invoice.account_id, Invoice.created_at, Invoice.total_amount,
+        func.row_number().over(
+            partition_by=Invoice.account_id,
+            order_by=(Invoice.created_at.desc(), Invoice.id.desc())
+        ).label('rn')
+    ).where(Invoice.account_id.in_(account_scope)).subquery()
+    last_invoices = db.session.execute(
+        select(ranked_invoices.c.account_id, ranked_invoices.c.created_at, ranked_invoices.c.total_amount)
+        .where(ranked_invoices.c.rn == 1)
+    )
+    for account_id, created_at, total in last_invoices:
+        summary = entry(account_id)
+        summary['last_invoice_at'] = created_at
+        summary['last_invoice_amount'] = float(total or 0)
+
+    ranked_payments = select(
+        Payment.account_id, Payment.transaction_date, Payment.amount,
+        func.row_number().over(
+            partition_by=Payment.account_id,
+            order_by=(Payment.transaction_date.desc(), Payment.id.desc())
+        ).label('rn')
+    ).where(Payment.account_id.in_(account_scope)).subquery()
+    last_payments = db.session.execute(
+        select(ranked_payments.c.account_id, ranked_payments.c.transaction_date, ranked_payments.c.amount)
+        .where(ranked_payments.c.rn == 1)
+    )
+    for account_id, transaction_date, amount in last_payments:
+        summary = entry(account_id)
+        summary['last_payment_at'] = transaction_date
+        summary['last_payment_amount'] = amount
+
+    return summaries
+
+
+def _balance_row(account_id, summary):
+    row = {'account_id': account_id, 'updated_at': datetime.utcnow()}
+    for total_col, last_at_col, last_amount_col in BALANCE_COLUMNS.values():
+        row[total_col] = summary.get(total_col, 0.0)
+        row[last_at_col] = summary.get(last_at_col)
+        if last_amount_col:
+            row[last_amount_col] = summary.get(last_amount_col)
+    return row
+
+
+def ensure_account_balances(account_scope):
+    """
+    Seeds AccountBalance rows for accounts in 'account_scope' that don't have one yet,
+    computing their starting totals from the full ledger in one grouped pass.
+    """
+    missing_ids = db.session.execute(
+        select(StudentFinancialAccount.id)
+        .outerjoin(AccountBalance, AccountBalance.account_id == StudentFinancialAccount.id)
+        .where(AccountBalance.account_id.is_(None), StudentFinancialAccount.id.in_(account_scope))
+    ).scalars().all()
+    if not missing_ids:
+        return 0
+
+    summaries = summarize_accounts(missing_ids)
+    db.session.execute(
+        insert(AccountBalance),
+        [_balance_row(account_id, summaries.get(account_id, {})) for account_id in missing_ids]
+    )
+    return len(missing_ids)
+
+
+def record_balance_activity(kind, entries):
+    """
+    Applies new ledger rows to the running balances in the current transaction.
+    'kind' is 'invoice', 'payment' or 'credit'; 'entries' is an iterable of
+    (account_id, amount, occurred_at) tuples. The new rows must already be flushed,
+    since accounts without a balance row are seeded from the ledger itself.
+    """
+    total_col, last_at_col, last_amount_col = BALANCE_COLUMNS[kind]
+
+    # Fold the entries into one delta per account so bulk callers issue one UPDATE per account.
+    deltas = {}
+    for account_id, amount, occurred_at in entries:
+        delta = deltas.setdefault(account_id, {'amount': 0.0, 'at': None, 'last_amount': None})
+        delta['amount'] += float(amount or 0)
+        if delta['at'] is None or (occurred_at and occurred_at >= delta['at']):
+            delta['at'], delta['last_amount'] = occurred_at, float(amount or 0)
+    if not deltas:
+        return
+
+    db.session.flush()
+    account_ids = list(deltas)
+    existing_ids = set(db.session.execute(
+        select(AccountBalance.account_id).where(AccountBalance.account_id.in_(account_ids))
+    ).scalars())
+
+    # Increments are done in SQL so concurrent writers never overwrite each other's totals.
+    table = AccountBalance.__table__
+    is_newer = (table.c[last_at_col].is_(None)) | (table.c[last_at_col] <= bindparam('b_at'))
+    values = {
+        total_col: table.c[total_col] + bindparam('b_amount'),
+        last_at_col: case((is_newer, bindparam('b_at')), else_=table.c[last_at_col]),
+        'updated_at': datetime.utcnow(),
+    }
+    if last_amount_col:
+        values[last_amount_col] = case((is_newer, bindparam('b_last_amount')), else_=table.c[last_amount_col])
+    stmt = update(table).where(table.c.account_id == bindparam('b_account_id')).values(**values)
+
+    params = [
+        {'b_account_id': account_id, 'b_amount': delta['amount'], 'b_at': delta['at'], 'b_last_amount': delta['last_amount']}
+        for account_id, delta in deltas.items() if account_id in existing_ids
+    ]
+    if params:
+        db.session.execute(stmt, params)
+
+    # Accounts without a balance row are seeded from the ledger, which already includes these entries.
+    missing_ids = [account_id for account_id in account_ids if account_id not in existing_ids]
+    if missing_ids:
+        ensure_account_balances(missing_ids)
+
+
+def record_balance_adjustment(kind, entries):
+    """
+    Applies changes to the amounts of existing ledger rows, such as a fee added to an
+    invoice, in the current transaction. 'entries' is an iterable of (account_id, amount,
+    occurred_at) where occurred_at is the original row's timestamp. Totals move by the
+    amount; the last-activity amount only moves when the adjusted row is the latest one.
+    """
+    total_col, last_at_col, last_amount_col = BALANCE_COLUMNS[kind]
+
+    deltas = {}
+    for account_id, amount, occurred_at in entries:
+        delta = deltas.setdefault(account_id, {'amount': 0.0, 'at': None, 'last_amount': 0.0})
+        delta['amount'] += float(amount or 0)
+        if delta['at'] is None or (occurred_at and occurred_at > delta['at']):
+            delta['at'], delta['last_amount'] = occurred_at, float(amount or 0)
+        elif occurred_at == delta['at']:
+            delta['last_amount'] += float(amount or 0)
+    if not deltas:
+        return
+
+    db.session.flush()
+    account_ids = list(deltas)
+    existing_ids = set(db.session.execute(
+        select(AccountBalance.account_id).where(AccountBalance.account_id.in_(account_ids))
+    ).scalars())
+
+    table = AccountBalance.__table__
+    values = {total_col: table.c[total_col] + bindparam('b_amount'), 'updated_at': datetime.utcnow()}
+    if last_amount_col:
+        values[last_amount_col] = case(
+            (table.c[last_at_col] == bindparam('b_at'), table.c[last_amount_col] + bindparam('b_last_amount')),
+            else_=table.c[last_amount_col]
+        )
+    stmt = update(table).where(table.c.account_id == bindparam('b_account_id')).values(**values)
+
+    params = [
+        {'b_account_id': account_id, 'b_amount': delta['amount'], 'b_at': delta['at'], 'b_last_amount': delta['last_amount']}
+        for account_id, delta in deltas.items() if account_id in existing_ids
+    ]
+    if params:
+        db.session.execute(stmt, params)
+
+    missing_ids = [account_id for account_id in account_ids if account_id not in existing_ids]
+    if missing_ids:
+        ensure_account_balances(missing_ids)
+
+
+def rebuild_balances(repair=True):
+    """
+    Recomputes every account balance from the ledger and compares it with the stored row.
+    Returns (accounts_checked, drifted_account_ids). When 'repair' is set, drifted and
+    missing rows are rewritten in bulk.
+    """
+    all_accounts = select(StudentFinancialAccount.id)
+    account_ids = db.session.execute(all_accounts).scalars().all()
+    summaries = summarize_accounts(all_accounts)
+    stored = {b.account_id: b for b in AccountBalance.query.all()}
+
+    drifted, updates, inserts = [], [], []
+    for account_id in account_ids:
+        expected = _balance_row(account_id, summaries.get(account_id, {}))
+        current = stored.get(account_id)
+        if current is None:
+            drifted.append(account_id)
+            inserts.append(expected)
+            continue
+        for total_col, last_at_col, last_amount_col in BALANCE_COLUMNS.values():
+            columns_match = (
+                round(current.__dict__[total_col] or 0, 2) == round(expected[total_col], 2)
+                and current.__dict__[last_at_col] == expected[last_at_col]
+                and (not last_amount_col or current.__dict__[last_amount_col] == expected[last_amount_col])
+            )
+            if not columns_match:
+                drifted.append(account_id)
+                updates.append(expected)
+                break
+
+    if repair:
+        if updates:
+            db.session.execute(update(AccountBalance), updates)
+        if inserts:
+            db.session.execute(insert(AccountBalance), inserts)
+    return len(account_ids), drifted
+
+
+# Tie-breaker when an invoice, payment and credit share a timestamp.
+LEDGER_KIND_ORDER = {'Invoice': 0, 'Payment': 1, 'Credit': 2}
+
+
+def encode_ledger_cursor(tx_date, kind, tx_id):
+    raw = f"{tx_date.isoformat()}|{LEDGER_KIND_ORDER[kind]}|{tx_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_ledger_cursor(cursor):
+    """Returns (date, kind_order, id) for a cursor produced by encode_ledger_cursor, or raises ValueError."""
+    try:
+        tx_date, kind_order, tx_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(tx_date), int(kind_order), int(tx_id)
+    except Exception:
+        raise ValueError("Invalid ledger cursor.")
+
+
+def ledger_page(account_id, before=None, limit=50):
+    """
+    Returns one page of an account's ledger, newest first, with the running balance
+    computed in SQL by a window SUM over the union of invoices, payments and credits.
+    'before' is a decoded cursor (date, kind_order, id); only rows strictly older are returned.
+    Fetches limit + 1 rows so the caller can tell whether another page exists.
+    """
+    invoices = select(
+        literal('Invoice').label('type'), literal(LEDGER_KIND_ORDER['Invoice']).label('kind_order'),
+        Invoice.id.label('id'), Invoice.created_at.label('date'), Invoice.total_amount.label('amount'),
+        literal(None).label('detail'), Invoice.status.label('status')
+    ).where(Invoice.account_id == account_id)
+    payments = select(
+        literal('Payment'), literal(LEDGER_KIND_ORDER['Payment']),
+        Payment.id, Payment.transaction_date, -Payment.amount, Payment.method, literal('Success')
+    ).where(Payment.account_id == account_id)
+    credits = select(
+        literal('Credit'), literal(LEDGER_KIND_ORDER['Credit']),
+        Credit.id, Credit.created_at, -Credit.amount, Credit.reason, literal('Applied')
+    ).where(Credit.account_id == account_id)
+    ledger = union_all(invoices, payments, credits).subquery()
+
+    running = select(
+        ledger,
+        func.sum(ledger.c.amount).over(
+            order_by=(ledger.c.date, ledger.c.kind_order, ledger.c.id),
+            rows=(None, 0)
+        ).label('balance')
+    ).subquery()
+
+    stmt = select(running)
+    if before:
+        before_date, before_kind, before_id = before
+        stmt = stmt.where(or_(
+            running.c.date < before_date,
+            and_(running.c.date == before_date, running.c.kind_order < before_kind),
+            and_(running.c.date == before_date, running.c.kind_order == before_kind, running.c.id < before_id)
+        ))
+    stmt = stmt.order_by(running.c.date.desc(), running.c.kind_order.desc(), running.c.id.desc()).limit(limit + 1)
+    return db.session.execute(stmt).mappings().all()
+
+
+EXPORT_COLUMNS = [
+    'date', 'type', 'id', 'account_id', 'student_id', 'student_name',
+    'invoice_id', 'amount', 'status', 'detail'
+]
+
+
+def _after_cursor(date_col, kind, id_col, last):
+    """Rows of one ledger kind that sort after 'last' (date, kind_order, id), in a form the date index can serve."""
+    last_date, last_kind, last_id = last
+    if kind > last_kind:
+        same_date = True
+    elif kind == last_kind:
+        same_date = id_col > last_id
+    else:
+        same_date = False
+    return or_(date_col > last_date, and_(date_col == last_date, same_date))
+
+
+def iter_transactions(start, end, batch_size=1000):
+    """
+    Yields every invoice, payment and credit dated in [start, end) across all accounts, oldest
+    first, as mappings keyed by EXPORT_COLUMNS. Rows are read in keyset-paginated batches of
+    'batch_size' (one query per batch, resuming after the last (date, kind, id) seen), so memory
+    use stays flat whatever the range and whether or not the driver can stream results.
+    Amounts are as recorded (positive); 'type' tells charges from payments and credits.
+    """
+    last = None
+    while True:
+        branches = []
+        for kind, date_col, id_col, columns in (
+            ('Invoice', Invoice.created_at, Invoice.id, (
+                Invoice.account_id, Invoice.id, Invoice.total_amount, Invoice.status, literal(None)
+            )),
+            ('Payment', Payment.transaction_date, Payment.id, (
+                Payment.account_id, Payment.invoice_id, Payment.amount, literal('Success'), Payment.method
+            )),
+            ('Credit', Credit.created_at, Credit.id, (
+                Credit.account_id, literal(None), Credit.amount, literal('Applied'), Credit.reason
+            )),
+        ):
+            branch = select(
+                literal(kind).label('type'), literal(LEDGER_KIND_ORDER[kind]).label('kind_order'),
+                id_col.label('id'), date_col.label('date'), *(
+                    column.label(name) for column, name in zip(columns, ('account_id', 'invoice_id', 'amount', 'status', 'detail'))
+                )
+            ).where(date_col >= start, date_col < end)
+            if last:
+                branch = branch.where(_after_cursor(date_col, LEDGER_KIND_ORDER[kind], id_col, last))
+            # Each kind contributes at most one batch, read in order off its date index.
+            branch = branch.order_by(date_col, id_col).limit(batch_size).subquery()
+            branches.append(select(branch))
+        ledger = union_all(*branches).subquery()
+
+        rows = db.session.execute(
+            select(
+                ledger.c.date, ledger.c.type, ledger.c.kind_order, ledger.c.id, ledger.c.account_id,
+                Student.id.label('student_id'),
+                (Student.first_name + ' ' + Student.last_name).label('student_name'),
+                ledger.c.invoice_id, ledger.c.amount, ledger.c.status, ledger.c.detail
+            )
+            # Outer joins: a short batch must only ever mean the range is exhausted.
+            .outerjoin(StudentFinancialAccount, StudentFinancialAccount.id == ledger.c.account_id)
+            .outerjoin(Student, Student.id == StudentFinancialAccount.student_id)
+            .order_by(ledger.c.date, ledger.c.kind_order, ledger.c.id)
+            .limit(batch_size)
+        ).mappings().all()
+        if not rows:
+            return
+        for row in rows:
+            yield {column: row[column] for column in EXPORT_COLUMNS}
+        last = (rows[-1]['date'], rows[-1]['kind_order'], rows[-1]['id'])
+        if len(rows) < batch_size:
+            return
+
+
+def family_rollups(page=1, per_page=50, search=None):
+    """
+    One page of per-parent balances summed across every linked child's account: the page's
+    parents are picked first, then one grouped query over their children's account_balances
+    and one query for the children themselves. 'search' matches parent name, email or phone, or a child's name.
+    Balance rows missing for the page's accounts are seeded (and committed) first, so a child
+    whose account nobody has opened yet still counts. Returns (families, total_families).
+    """
+    family = (
+        select(Parent.id)
+        .join(parent_student_association, parent_student_association.c.parent_id == Parent.id)
+        .join(Student, Student.id == parent_student_association.c.student_id)
+        .join(StudentFinancialAccount, StudentFinancialAccount.student_id == Student.id)
+    )
+    if search:
+        pattern = f"%{search}%"
+        family = family.where(or_(
+            Parent.first_name.ilike(pattern), Parent.last_name.ilike(pattern), Parent.email.ilike(pattern),
+            Parent.phone.ilike(pattern), Student.first_name.ilike(pattern), Student.last_name.ilike(pattern)
+        ))
+    total = db.session.execute(select(func.count()).select_from(family.distinct().subquery())).scalar()
+
+    matching = family.distinct().subquery()
+    parent_ids = db.session.execute(
+        select(Parent.id).join(matching, matching.c.id == Parent.id)
+        .order_by(Parent.last_name, Parent.first_name, Parent.id)
+        .limit(per_page).offset((page - 1) * per_page)
+    ).scalars().all()
+    if not parent_ids:
+        return [], total
+
+    account_ids = db.session.execute(
+        select(StudentFinancialAccount.id)
+        .join(parent_student_association, parent_student_association.c.student_id == StudentFinancialAccount.student_id)
+        .where(parent_student_association.c.parent_id.in_(parent_ids))
+    ).scalars().all()
+    if ensure_account_balances(account_ids):
+        db.session.commit()
+
+    invoiced = func.coalesce(func.sum(AccountBalance.total_invoiced), 0)
+    paid = func.coalesce(func.sum(AccountBalance.total_paid), 0)
+    credited = func.coalesce(func.sum(AccountBalance.total_credited), 0)
+    rows = db.session.execute(
+        select(
+            Parent.id, Parent.first_name, Parent.last_name, Parent.email, Parent.phone,
+            func.count(StudentFinancialAccount.id).label('children'),
+            invoiced.label('total_invoiced'), paid.label('total_paid'), credited.label('total_credited'),
+            func.max(AccountBalance.last_invoice_at).label('last_invoice_at'),
+            func.max(AccountBalance.last_payment_at).label('last_payment_at')
+        )
+        .join(parent_student_association, parent_student_association.c.parent_id == Parent.id)
+        .join(StudentFinancialAccount, StudentFinancialAccount.student_id == parent_student_association.c.student_id)
+        .outerjoin(AccountBalance, AccountBalance.account_id == StudentFinancialAccount.id)
+        .where(Parent.id.in_(parent_ids))
+        .group_by(Parent.id, Parent.first_name, Parent.last_name, Parent.email, Parent.phone)
+        .order_by(Parent.last_name, Parent.first_name, Parent.id)
+    ).mappings().all()
+
+    children = {}
+    for child in db.session.execute(
+        select(
+            parent_student_association.c.parent_id, Student.id.label('student_id'),
+            Student.first_name, Student.last_name, StudentFinancialAccount.id.label('account_id'),
+            AccountBalance.total_invoiced, AccountBalance.total_paid, AccountBalance.total_credited
+        )
+        .join(Student, Student.id == parent_student_association.c.student_id)
+        .join(StudentFinancialAccount, StudentFinancialAccount.student_id == Student.id)
+        .outerjoin(AccountBalance, AccountBalance.account_id == StudentFinancialAccount.id)
+        .where(parent_student_association.c.parent_id.in_(parent_ids))
+        .order_by(Student.first_name)
+    ).mappings():
+        children.setdefault(child['parent_id'], []).append({
+            'student_id': child['student_id'], 'student_name': f"{child['first_name']} {child['last_name']}",
+            'account_id': child['account_id'],
+            'open_balance': (child['total_invoiced'] or 0) - (child['total_paid'] or 0) - (child['total_credited'] or 0)
+        })
+
+    families = [{
+        'parent_id': row['id'], 'parent_name': f"{row['first_name']} {row['last_name']}",
+        'email': row['email'], 'phone': row['phone'], 'children_count': row['children'],
+        'total_invoiced': row['total_invoiced'], 'total_paid': row['total_paid'], 'total_credited': row['total_credited'],
+        'open_balance': row['total_invoiced'] - row['total_paid'] - row['total_credited'],
+        'last_invoice_date': row['last_invoice_at'].isoformat() if row['last_invoice_at'] else None,
+        'last_payment_date': row['last_payment_at'].isoformat() if row['last_payment_at'] else None,
+        'children': children.get(row['id'], [])
+    } for row in rows]
+    return families, total
+
+
+# Payments within half a cent of the total settle the invoice (amounts are stored as floats).
+SETTLEMENT_TOLERANCE = 0.005
+
+
+def apply_invoice_settlements(settlements, session=None):
+    """
+    Adds amounts to invoices' amount_paid and moves their status to Paid or Partially Paid.
+    'settlements' maps invoice id to the amount to add; all invoices are updated by one
+    executemany UPDATE, computed in SQL so concurrent writers build on each other's totals.
+    Void invoices are left alone.
+    """
+    if not settlements:
+        return
+    table = Invoice.__table__
+    new_paid = table.c.amount_paid + bindparam('b_amount')
+    new_status = case(
+        (new_paid >= table.c.total_amount - SETTLEMENT_TOLERANCE, 'Paid'),
+        (new_paid > 0, 'Partially Paid'),
+        else_=table.c.status
+    )
+    stmt = (
+        update(table)
+        .where(table.c.id == bindparam('b_id'), table.c.status != 'Void')
+        .ordered_values((table.c.status, new_status), (table.c.amount_paid, new_paid))
+    )
+    (session or db.session).execute(stmt, [{'b_id': invoice_id, 'b_amount': amount} for invoice_id, amount in settlements.items()])
+
+
+def backfill_invoice_totals(batch_size=5000, session=None):
+    """
+    Recomputes Invoice.total_amount from invoice_items and Invoice.amount_paid from the
+    invoice's payment allocations, one id range at a time so each UPDATE stays short. Statuses
+    follow: fully allocated invoices become Paid, and Paid or Partially Paid ones that no
+    longer are go back to Partially Paid or Sent. Run allocate_all_funds afterwards to apply
+    any payments and credits not yet allocated. Safe to re-run. Returns rows updated.
+    """
+    session = session or db.session
+    item_total = select(func.coalesce(func.sum(InvoiceItem.amount), 0)) \
+        .where(InvoiceItem.invoice_id == Invoice.id).scalar_subquery()
+    paid_total = select(func.coalesce(func.sum(PaymentAllocation.amount), 0)) \
+        .where(PaymentAllocation.invoice_id == Invoice.id).scalar_subquery()
+    new_status = case(
+        (Invoice.status.in_(('Draft', 'Void')), Invoice.status),
+        (paid_total >= item_total - SETTLEMENT_TOLERANCE, 'Paid'),
+        (paid_total > SETTLEMENT_TOLERANCE, 'Partially Paid'),
+        (Invoice.status.in_(('Paid', 'Partially Paid')), 'Sent'),
+        else_=Invoice.status
+    )
+
+    max_id = session.execute(select(func.max(Invoice.id))).scalar() or 0
+    updated = 0
+    for start in range(0, max_id, batch_size):
+        result = session.execute(
+            update(Invoice)
+            .where(Invoice.id > start, Invoice.id <= start + batch_size)
+            # MySQL applies SET assignments left to right; the status reads the subqueries, not the columns.
+            .ordered_values((Invoice.status, new_status), (Invoice.total_amount, item_total), (Invoice.amount_paid, paid_total))
+            .execution_options(synchronize_session=False)
+        )
+        updated += result.rowcount
+        session.commit()
+    return updated
+
+
+# Aging buckets as (column, upper bound in days past due). 'current' covers invoices not yet due.
+AGING_BUCKETS = [('current', 0), ('days_1_30', 30), ('days_31_60', 60), ('days_61_90', 90), ('days_over_90', None)]
+# Invoices that are not receivables: never sent, settled or cancelled.
+CLOSED_INVOICE_STATUSES = ('Draft', 'Paid', 'Void')
+
+
+def aging_report(as_of=None):
+    """
+    Buckets every open invoice balance by days past its due_date, per account, in one
+    grouped query. Invoices without a due date count as current. Returns a list of dicts
+    (one per account with an open balance) sorted by total open balance, largest first.
+    """
+    as_of = as_of or date.today()
+    open_amount = Invoice.total_amount - Invoice.amount_paid
+
+    columns, lower = [], None
+    for name, max_days in AGING_BUCKETS:
+        if max_days == 0:
+            in_bucket = or_(Invoice.due_date.is_(None), Invoice.due_date >= as_of)
+        elif max_days is None:
+            in_bucket = Invoice.due_date < as_of - timedelta(days=lower)
+        else:
+            in_bucket = and_(Invoice.due_date < as_of - timedelta(days=lower), Invoice.due_date >= as_of - timedelta(days=max_days))
+        columns.append(func.sum(case((in_bucket, open_amount), else_=0)).label(name))
+        lower = max_days
+
+    rows = db.session.execute(
+        select(Invoice.account_id, Student.id, Student.first_name, Student.last_name, *columns, func.sum(open_amount).label('total_open'))
+        .join(StudentFinancialAccount, StudentFinancialAccount.id == Invoice.account_id)
+        .join(Student, Student.id == StudentFinancialAccount.student_id)
+        .where(Invoice.status.notin_(CLOSED_INVOICE_STATUSES), open_amount > SETTLEMENT_TOLERANCE)
+        .group_by(Invoice.account_id, Student.id, Student.first_name, Student.last_name)
+        .order_by(func.sum(open_amount).desc())
+    ).mappings().all()
+
+    return [{
+        'account_id': row['account_id'], 'student_id': row['id'],
+        'student_name': f"{row['first_name']} {row['last_name']}",
+        **{name: float(row[name] or 0) for name, _ in AGING_BUCKETS},
+        'total_open': float(row['total_open'] or 0)
+    } for row in rows]
+
+
+def refresh_aging_snapshot(as_of=None):
+    """Replaces the cached aging snapshot with a freshly computed report. Returns the number of accounts."""
+    as_of = as_of or date.today()
+    report = aging_report(as_of)
+    generated_at = datetime.utcnow()
+    db.session.execute(AgingSnapshot.__table__.delete())
+    if report:
+        db.session.execute(insert(AgingSnapshot), [{**row, 'as_of': as_of, 'generated_at': generated_at} for row in report])
+    return len(report)
+
+
+# Invoices that can still fall overdue; Overdue itself is excluded so each invoice is flipped once.
+OVERDUE_ELIGIBLE_STATUSES = ('Sent', 'Partially Paid')
+
+
+def mark_overdue_invoices(as_of=None, late_fee=None, fee_description='Late fee'):
+    """
+    Moves every unpaid invoice whose due date is before 'as_of' to Overdue, in the current
+    transaction and with a fixed number of statements however many invoices qualify.
+    With 'late_fee', each of those invoices also gets a fee item, inserted with one
+    INSERT ... SELECT, unless it already carries one with the same description (an invoice
+    that was part-paid after going overdue must not be charged again).
+    Returns (invoices_marked, fees_applied, fee_total).
+    """
+    as_of = as_of or date.today()
+    overdue = and_(
+        Invoice.status.in_(OVERDUE_ELIGIBLE_STATUSES),
+        Invoice.due_date < as_of,
+        Invoice.total_amount - Invoice.amount_paid > SETTLEMENT_TOLERANCE
+    )
+
+    # Lock the invoices up front so payments can't change which ones qualify mid-sweep.
+    targets = db.session.execute(
+        select(Invoice.id, Invoice.account_id, Invoice.created_at).where(overdue).with_for_update()
+    ).all()
+    if not targets:
+        return 0, 0, 0.0
+
+    fee_entries = []
+    if late_fee:
+        already_charged = select(InvoiceItem.id).where(
+            InvoiceItem.invoice_id == Invoice.id, InvoiceItem.description == fee_description
+        ).exists()
+        fee_target = and_(overdue, ~already_charged)
+        fee_entries = [
+            (account_id, late_fee, created_at)
+            for account_id, created_at in db.session.execute(
+                select(Invoice.account_id, Invoice.created_at).where(fee_target)
+            )
+        ]
+        # Totals move before the items go in, while fee_target still matches these invoices.
+        db.session.execute(
+            update(Invoice).where(fee_target)
+            .values(total_amount=Invoice.total_amount + late_fee)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(insert(InvoiceItem).from_select(
+            ['invoice_id', 'description', 'amount'],
+            select(Invoice.id, literal(fee_description), literal(late_fee)).where(fee_target)
+        ))
+
+    marked = db.session.execute(
+        update(Invoice).where(overdue).values(status='Overdue').execution_options(synchronize_session=False)
+    ).rowcount
+
+    record_balance_adjustment('invoice', fee_entries)
+    return marked, len(fee_entries), round(late_fee * len(fee_entries), 2) if late_fee else 0.0
@@ -0,0 +1,96 @@
+import time
+import threading
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# In-process cache for expensive reads. Each entry remembers the version of every table it
+# was computed from; committing a transaction that wrote to one of those tables bumps the
+# version, so the next read recomputes. The TTL bounds staleness for writes made by other
+# worker processes, which this process never sees commit. At most MAX_ENTRIES entries are
+# kept; the least recently used one is evicted to make room.
+
+MAX_ENTRIES = 256
+
+_lock = threading.Lock()
+_entries = OrderedDict()
+_table_versions = {}
+
+
+def table_versions(tables):
+    with _lock:
+        return tuple(_table_versions.get(t, 0) for t in tables)
+
+
+def invalidate_tables(tables):
+    with _lock:
+        for t in tables:
+            _table_versions[t] = _table_versions.get(t, 0) + 1
+
+
+def cached(key, tables, ttl, compute):
+    """
+    Returns the cached value for 'key', or calls 'compute()' and caches the result for 'ttl'
+    seconds. The entry is dropped early once any of 'tables' changes in a committed transaction.
+    Returns (value, versions), where versions identifies the data the value was built from.
+    """
+    # Versions are read before computing, so a write that commits mid-computation invalidates the result.
+    versions = table_versions(tables)
+    with _lock:
+        entry = _entries.get(key)
+        if entry:
+            if entry[0] > time.monotonic() and entry[1] == versions:
+                _entries.move_to_end(key)
+                return entry[2], versions
+            del _entries[key]
+
+    # Computed outside the lock; two threads missing at once both compute, and the last one wins.
+    value = compute()
+    with _lock:
+        _entries[key] = (time.monotonic() + ttl, versions, value)
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+    return value, versions
+
+
+def _written_tables(session):
+    return session.info.setdefault('written_tables', set())
+
+
+def _track_flush(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, '__table__', None)
+        if table is not None:
+            _written_tables(session).add(table.name)
+
+
+def _track_bulk_statement(orm_execute_state):
+    # Bulk INSERT/UPDATE/DELETE statements run through Session.execute() never reach a flush.
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None and getattr(table, 'name', None):
+            _written_tables(orm_execute_state.session).add(table.name)
+
+
+def _invalidate_on_commit(session):
+    written = session.info.pop('written_tables', None)
+    if written:
+        invalidate_tables(written)
+
+
+def _forget_on_rollback(session):
+    session.info.pop('written_tables', None)
+
+
+def init_cache():
+    """Hooks cache invalidation into every SQLAlchemy session."""
+    hooks = [
+        ('after_flush', _track_flush),
+        ('do_orm_execute', _track_bulk_statement),
+        ('after_commit', _invalidate_on_commit),
+        ('after_rollback', _forget_on_rollback),
+    ]
+    for name, fn in hooks:
+        if not event.contains(Session, name, fn):
+            event.listen(Session, name, fn)
@@ -0,0 +1,97 @@
+from datetime import date
+from bisect import bisect_right
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import select
+from app.models import db
+from app.models.student_model import Student
+from app.models.financial_model import StudentFinancialAccount, Subscription
+from app.utils.invoicing import BILLING_CYCLES, next_billing_date
+
+
+def _load_subscription_columns():
+    """Active subscriptions as parallel lists, read in one query."""
+    rows = db.session.execute(
+        select(
+            Subscription.plan_name, Subscription.cycle, Subscription.next_invoice_date, Subscription.end_date,
+            Subscription.invoice_generation_day, Subscription.items_json, Student.grade_level
+        )
+        .join(StudentFinancialAccount, StudentFinancialAccount.id == Subscription.account_id)
+        .join(Student, Student.id == StudentFinancialAccount.student_id)
+        .where(Subscription.status == 'Active')
+    ).all()
+    columns = {'plan': [], 'cycle': [], 'next_date': [], 'end_date': [], 'day': [], 'amount': [], 'grade': []}
+    for plan, cycle, next_date, end_date, day, items, grade in rows:
+        columns['plan'].append(plan)
+        columns['cycle'].append(cycle)
+        columns['next_date'].append(next_date)
+        columns['end_date'].append(end_date)
+        columns['day'].append(day)
+        columns['amount'].append(sum(float(item.get('amount') or 0) for item in items or []))
+        columns['grade'].append(grade)
+    return columns
+
+
+def _billing_schedule(cycle, first_period, invoice_generation_day, horizon_end):
+    """Every billing date from 'first_period' up to (excluding) horizon_end, as generate-invoices would bill them."""
+    periods = []
+    period = first_period
+    while period is not None and period < horizon_end:
+        periods.append(period)
+        if cycle not in BILLING_CYCLES:
+            break
+        period = next_billing_date(cycle, period, invoice_generation_day)
+    return periods
+
+
+def revenue_forecast(months=12, start=None):
+    """
+    Projects invoiced revenue from active subscriptions for the next 'months' calendar months,
+    in total and broken down by plan and by grade.
+
+    Subscriptions sharing a schedule (cycle, next invoice date, generation day) are expanded
+    once, and rows that also share plan, grade and number of billable periods are summed
+    before expansion, so the work grows with distinct schedules rather than subscriptions.
+    Periods already due but not yet billed count towards the first month.
+    """
+    start = (start or date.today()).replace(day=1)
+    horizon_end = start + relativedelta(months=months)
+    columns = _load_subscription_columns()
+
+    schedules = {}
+    grouped = {}
+    for plan, cycle, next_date, end_date, day, amount, grade in zip(
+        columns['plan'], columns['cycle'], columns['next_date'], columns['end_date'],
+        columns['day'], columns['amount'], columns['grade']
+    ):
+        key = (cycle, next_date, day)
+        periods = schedules.get(key)
+        if periods is None:
+            periods = schedules[key] = _billing_schedule(cycle, next_date, day, horizon_end)
+        billable = bisect_right(periods, end_date) if end_date else len(periods)
+        group = (key, billable, plan, grade)
+        grouped[group] = grouped.get(group, 0.0) + amount
+
+    # Month index of each schedule's periods, computed once per schedule.
+    month_indexes = {
+        key: [max(0, (p.year - start.year) * 12 + p.month - start.month) for p in periods]
+        for key, periods in schedules.items()
+    }
+
+    totals = [0.0] * months
+    by_plan, by_grade = {}, {}
+    for (key, billable, plan, grade), amount in grouped.items():
+        plan_totals = by_plan.setdefault(plan, [0.0] * months)
+        grade_totals = by_grade.setdefault(grade, [0.0] * months)
+        for index in month_indexes[key][:billable]:
+            totals[index] += amount
+            plan_totals[index] += amount
+            grade_totals[index] += amount
+
+    rounded = lambda values: [round(v, 2) for v in values]
+    return {
+        'months': [(start + relativedelta(months=i)).strftime('%Y-%m') for i in range(months)],
+        'totals': rounded(totals),
+        'by_plan': {plan: rounded(values) for plan, values in sorted(by_plan.items())},
+        'by_grade': {grade: rounded(values) for grade, values in sorted(by_grade.items())},
+        'subscriptions': len(columns['plan']),
+    }
@@ -0,0 +1,394 @@
+import os
+from datetime import datetime, date
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import select, insert, update
+from sqlalchemy.orm import joinedload
+from app.models import db
+from app.models.student_model import Student, Parent, parent_student_association
+from app.models.financial_model import StudentFinancialAccount, Invoice, InvoiceItem, Subscription, InvoiceRun, InvoiceBatch
+from app.utils.billing import record_balance_activity, ensure_financial_accounts
+from app.utils.allocation import allocate_account_funds
+from app.utils.notifications import send_emails_in_background
+
+
+def invoice_due_date(run_day, due_day):
+    """Due date for an invoice raised on 'run_day': this month's due_day, or next month's if it has passed."""
+    if run_day.day > due_day:
+        return run_day + relativedelta(months=1, day=due_day)
+    return run_day + relativedelta(day=due_day)
+
+
+# How far each subscription cycle advances. Month-based cycles snap back to the
+# subscription's invoice_generation_day so short months don't make the date drift.
+BILLING_CYCLES = {
+    'Weekly': relativedelta(weeks=1),
+    'Bi-Weekly': relativedelta(weeks=2),
+    'Monthly': relativedelta(months=1),
+    'Quarterly': relativedelta(months=3),
+    'Semi-Annually': relativedelta(months=6),
+    'Yearly': relativedelta(years=1),
+    'Annually': relativedelta(years=1),
+}
+
+
+def next_billing_date(cycle, period, invoice_generation_day):
+    """The period after 'period', or None for cycles that are not advanced automatically."""
+    step = BILLING_CYCLES.get(cycle)
+    if step is None:
+        return None
+    if step.months or step.years:
+        return period + step + relativedelta(day=invoice_generation_day)
+    return period + step
+
+
+def plan_billing_periods(sub, today, catch_up=False):
+    """
+    Works out which periods of a due subscription to bill on 'today'.
+    Normally that's just next_invoice_date; with 'catch_up' it's every missed period up to today.
+    Periods after end_date are never billed. Returns (periods, next_invoice_date, status).
+    """
+    periods = []
+    period = sub.next_invoice_date
+    while period is not None and period <= today:
+        if sub.end_date and period > sub.end_date:
+            break
+        periods.append(period)
+        period = next_billing_date(sub.cycle, period, sub.invoice_generation_day)
+        if not catch_up:
+            break
+
+    status = sub.status
+    if sub.end_date and period is not None and period > sub.end_date:
+        status = 'Ended'
+    # Unknown cycles (only possible in rows older than the cycle check on enrollment) keep their
+    # date and stay Active; the (subscription, period) check stops them being billed twice.
+    return periods, period or sub.next_invoice_date, status
+
+
+def _due_subscriptions(today):
+    return select(Subscription.id).where(
+        Subscription.status == 'Active',
+        Subscription.next_invoice_date <= today
+    )
+
+
+def _in_partition(stmt, account_id_from, account_id_to):
+    if account_id_from is not None:
+        stmt = stmt.where(Subscription.account_id >= account_id_from)
+    if account_id_to is not None:
+        stmt = stmt.where(Subscription.account_id <= account_id_to)
+    return stmt
+
+
+def _subscription_total(sub):
+    # Treat an empty string for amount as 0
+    return sum(float(i.get('amount') or 0) for i in sub.items_json)
+
+
+def bill_subscriptions(subscription_ids, today, catch_up=False):
+    """
+    Generates the invoices for the given subscriptions in the current transaction.
+    Rows are locked with FOR UPDATE SKIP LOCKED and re-checked for being due, so a
+    subscription claimed by another run is skipped instead of billed twice.
+    Returns (invoices_created, emails) where emails are ready for send_emails_in_background.
+    """
+    locked_ids = db.session.execute(
+        _due_subscriptions(today)
+        .where(Subscription.id.in_(subscription_ids))
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+    if not locked_ids:
+        return 0, []
+
+    subs = Subscription.query.options(
+        joinedload(Subscription.account).joinedload(StudentFinancialAccount.student).selectinload(Student.parents)
+    ).filter(Subscription.id.in_(locked_ids)).order_by(Subscription.id).all()
+
+    plans = {sub.id: plan_billing_periods(sub, today, catch_up) for sub in subs}
+    all_periods = {period for periods, _, _ in plans.values() for period in periods}
+
+    # Periods that already have an invoice (e.g. from an interrupted catch-up) are not billed again.
+    already_billed = set()
+    if all_periods:
+        already_billed = set(db.session.execute(
+            select(Invoice.subscription_id, Invoice.billing_period)
+            .where(Invoice.subscription_id.in_(locked_ids), Invoice.billing_period.in_(all_periods))
+        ).all())
+
+    now = datetime.utcnow()
+    totals = {sub.id: _subscription_total(sub) for sub in subs}
+    invoice_rows, billed, advanced = [], [], []
+    for sub in subs:
+        periods, next_date, status = plans[sub.id]
+        advanced.append({'id': sub.id, 'next_invoice_date': next_date, 'status': status})
+        new_periods = [period for period in periods if (sub.id, period) not in already_billed]
+        if not new_periods:
+            continue
+        billed.append((sub, new_periods))
+        for period in new_periods:
+            invoice_rows.append({
+                'account_id': sub.account_id, 'status': 'Sent',
+                # Missed periods are due relative to their own period, not the day they were caught up.
+                'due_date': invoice_due_date(period if catch_up else today, sub.due_day),
+                'created_at': now, 'subscription_id': sub.id, 'billing_period': period,
+                'total_amount': totals[sub.id], 'amount_paid': 0
+            })
+
+    emails = []
+    if invoice_rows:
+        db.session.execute(insert(Invoice), invoice_rows)
+        # MySQL can't return ids from a multi-row insert, so read them back by (subscription, period).
+        invoice_ids = {
+            (sub_id, period): invoice_id for invoice_id, sub_id, period in db.session.execute(
+                select(Invoice.id, Invoice.subscription_id, Invoice.billing_period).where(
+                    Invoice.subscription_id.in_([sub.id for sub, _ in billed]),
+                    Invoice.billing_period.in_({row['billing_period'] for row in invoice_rows})
+                )
+            )
+        }
+        due_dates = {(row['subscription_id'], row['billing_period']): row['due_date'] for row in invoice_rows}
+
+        item_rows, balance_entries = [], []
+        frontend_url = os.getenv('FRONTEND_URL', 'http://localhost:5173')
+        for sub, periods in billed:
+            total = totals[sub.id]
+            for period in periods:
+                invoice_id = invoice_ids[(sub.id, period)]
+                item_rows.extend(
+                    {'invoice_id': invoice_id, 'description': i.get('description', ''), 'amount': float(i.get('amount') or 0)}
+                    for i in sub.items_json
+                )
+                balance_entries.append((sub.account_id, total, now))
+
+            student = sub.account.student
+            parent = student.parents[0] if student.parents else None
+            if parent:
+                student_name = f"{student.first_name} {student.last_name}"
+                last_due = due_dates[(sub.id, periods[-1])]
+                if len(periods) == 1:
+                    message = f"A new tuition invoice for {student_name} is ready. The total amount is ${total:.2f} and is due on {last_due.strftime('%B %d, %Y')}."
+                else:
+                    message = f"{len(periods)} tuition invoices for {student_name} are ready, totalling ${total * len(periods):.2f}. The most recent is due on {last_due.strftime('%B %d, %Y')}."
+                emails.append((
+                    f"New Tuition Invoice for {student_name}",
+                    [parent.email],
+                    # The parent portal link doesn't exist yet, so we'll link to a placeholder
+                    {'message': message, 'action_link': f"{frontend_url}/parent/billing"}
+                ))
+
+        if item_rows:
+            db.session.execute(insert(InvoiceItem), item_rows)
+        record_balance_activity('invoice', balance_entries)
+        # Credit or prepayment sitting on an account goes straight onto its new invoices.
+        allocate_account_funds({sub.account_id for sub, _ in billed})
+
+    db.session.execute(update(Subscription), advanced)
+    return len(invoice_rows), emails
+
+
+def preview_invoice_generation(today=None, catch_up=False, chunk_size=500):
+    """
+    Dry run of generate-invoices: reports what would be billed without locking or writing anything.
+    Returns subscription/invoice counts and totals, with a breakdown per billing month.
+    """
+    today = today or date.today()
+    report = {'subscriptions': 0, 'invoices': 0, 'total_amount': 0.0, 'ending': 0, 'by_month': {}}
+    last_id = 0
+    while True:
+        subs = Subscription.query.filter(
+            Subscription.id.in_(_due_subscriptions(today).where(Subscription.id > last_id))
+        ).order_by(Subscription.id).limit(chunk_size).all()
+        if not subs:
+            break
+        last_id = subs[-1].id
+        plans = {sub.id: plan_billing_periods(sub, today, catch_up) for sub in subs}
+        all_periods = {period for periods, _, _ in plans.values() for period in periods}
+        already_billed = set()
+        if all_periods:
+            already_billed = set(db.session.execute(
+                select(Invoice.subscription_id, Invoice.billing_period)
+                .where(Invoice.subscription_id.in_(list(plans)), Invoice.billing_period.in_(all_periods))
+            ).all())
+
+        for sub in subs:
+            periods, _, status = plans[sub.id]
+            periods = [period for period in periods if (sub.id, period) not in already_billed]
+            if status == 'Ended':
+                report['ending'] += 1
+            if not periods:
+                continue
+            total = _subscription_total(sub)
+            report['subscriptions'] += 1
+            report['invoices'] += len(periods)
+            report['total_amount'] += total * len(periods)
+            for period in periods:
+                month = report['by_month'].setdefault(period.strftime('%Y-%m'), {'invoices': 0, 'total_amount': 0.0})
+                month['invoices'] += 1
+                month['total_amount'] += total
+        db.session.expunge_all()
+    return report
+
+
+def _open_run(today, account_id_from, account_id_to):
+    """Returns the unfinished run for this date and partition, or starts a new one."""
+    run = InvoiceRun.query.filter(
+        InvoiceRun.run_date == today,
+        InvoiceRun.account_id_from == account_id_from,
+        InvoiceRun.account_id_to == account_id_to,
+        InvoiceRun.status != 'Completed'
+    ).order_by(InvoiceRun.id.desc()).first()
+    if run:
+        print(f"Resuming run #{run.id} after subscription {run.last_subscription_id}.")
+        run.status = 'Running'
+        run.error = None
+    else:
+        run = InvoiceRun(run_date=today, account_id_from=account_id_from, account_id_to=account_id_to)
+        db.session.add(run)
+    db.session.commit()
+    return run
+
+
+def run_invoice_generation(today=None, chunk_size=200, account_id_from=None, account_id_to=None, catch_up=False):
+    """
+    Bills every due subscription in the given account id range, one committed chunk at a time.
+    The run's checkpoint moves with each chunk; if a chunk fails it is retried one subscription
+    at a time so a single bad row is skipped and logged instead of rolling back the rest.
+    """
+    today = today or date.today()
+    run = _open_run(today, account_id_from, account_id_to)
+    label = f"[accounts {account_id_from}-{account_id_to}] " if account_id_from is not None else ""
+
+    while True:
+        chunk_ids = db.session.execute(
+            _in_partition(_due_subscriptions(today), account_id_from, account_id_to)
+            .where(Subscription.id > run.last_subscription_id)
+            .order_by(Subscription.id)
+            .limit(chunk_size)
+        ).scalars().all()
+        if not chunk_ids:
+            break
+
+        try:
+            created, emails = bill_subscriptions(chunk_ids, today, catch_up)
+            run.last_subscription_id = chunk_ids[-1]
+            run.invoices_created += created
+            db.session.commit()
+            send_emails_in_background(emails)
+            print(f"{label}Chunk up to subscription {chunk_ids[-1]}: {created} invoice(s) created.")
+        except Exception as e:
+            db.session.rollback()
+            print(f"{label}Chunk ending at subscription {chunk_ids[-1]} failed ({e}); retrying row by row.")
+            for sub_id in chunk_ids:
+                try:
+                    created, emails = bill_subscriptions([sub_id], today, catch_up)
+                    run.last_subscription_id = sub_id
+                    run.invoices_created += created
+                    db.session.commit()
+                    send_emails_in_background(emails)
+                except Exception as row_error:
+                    db.session.rollback()
+                    run.last_subscription_id = sub_id
+                    run.failed_subscriptions += 1
+                    run.error = f"Subscription {sub_id}: {row_error}"
+                    db.session.commit()
+                    print(f"{label}  - Subscription {sub_id} skipped: {row_error}")
+
+    run.status = 'Completed' if not run.failed_subscriptions else 'Failed'
+    run.finished_at = datetime.utcnow()
+    db.session.commit()
+    return {'run_id': run.id, 'invoices_created': run.invoices_created, 'failed': run.failed_subscriptions}
+
+
+def partition_due_accounts(workers, today=None):
+    """Splits the accounts with due subscriptions into 'workers' contiguous account id ranges of similar size."""
+    today = today or date.today()
+    account_ids = db.session.execute(
+        select(Subscription.account_id).distinct()
+        .where(Subscription.status == 'Active', Subscription.next_invoice_date <= today)
+        .order_by(Subscription.account_id)
+    ).scalars().all()
+    if not account_ids:
+        return []
+    size = -(-len(account_ids) // workers)
+    return [(account_ids[i], account_ids[min(i + size, len(account_ids)) - 1]) for i in range(0, len(account_ids), size)]
+
+
+def run_invoice_partition(account_id_from, account_id_to, chunk_size, today_iso, catch_up=False):
+    """Entry point for worker processes: builds its own app and bills one account id range."""
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        return run_invoice_generation(date.fromisoformat(today_iso), chunk_size, account_id_from, account_id_to, catch_up)
+
+
+def create_invoice_batch(student_filter, items, description, due_date=None, status='Sent', created_by=None):
+    """
+    Invoices the same one-off items to every student matched by 'student_filter', in the
+    current transaction: one INSERT for the invoices, one for their items, and one balance
+    update per account, whatever the size of the group. 'items' is a list of
+    {description, amount} dicts. Returns (batch, invoices, emails); the emails are ready
+    for send_emails_in_background once the caller has committed.
+    """
+    total = sum(item['amount'] for item in items)
+    if ensure_financial_accounts(student_filter):
+        db.session.flush()
+    students = db.session.execute(
+        select(Student.id, Student.first_name, Student.last_name, StudentFinancialAccount.id)
+        .join(StudentFinancialAccount, StudentFinancialAccount.student_id == Student.id)
+        .where(student_filter)
+        .order_by(Student.last_name, Student.first_name)
+    ).all()
+
+    batch = InvoiceBatch(description=description, created_by=created_by, invoice_count=len(students), total_amount=total * len(students))
+    db.session.add(batch)
+    db.session.flush()
+    if not students:
+        return batch, [], []
+
+    now = datetime.utcnow()
+    db.session.execute(insert(Invoice), [{
+        'account_id': account_id, 'status': status, 'due_date': due_date, 'created_at': now,
+        'batch_id': batch.id, 'total_amount': total, 'amount_paid': 0
+    } for _, _, _, account_id in students])
+    # MySQL can't return ids from a multi-row insert, so read them back by (batch, account).
+    invoice_ids = dict(db.session.execute(
+        select(Invoice.account_id, Invoice.id).where(Invoice.batch_id == batch.id)
+    ).all())
+    db.session.execute(insert(InvoiceItem), [
+        {'invoice_id': invoice_ids[account_id], 'description': item['description'], 'amount': item['amount']}
+        for _, _, _, account_id in students for item in items
+    ])
+    record_balance_activity('invoice', [(account_id, total, now) for _, _, _, account_id in students])
+    # Credit or prepayment sitting on an account goes straight onto its new invoice.
+    allocate_account_funds(invoice_ids.keys())
+
+    invoices = [{
+        'student_id': student_id, 'student_name': f"{first_name} {last_name}",
+        'account_id': account_id, 'invoice_id': invoice_ids[account_id], 'total_amount': total
+    } for student_id, first_name, last_name, account_id in students]
+
+    emails = []
+    if status != 'Draft':
+        parent_emails = {}
+        for student_id, email in db.session.execute(
+            select(parent_student_association.c.student_id, Parent.email)
+            .join(Parent, Parent.id == parent_student_association.c.parent_id)
+            .where(parent_student_association.c.student_id.in_([inv['student_id'] for inv in invoices]))
+            .order_by(Parent.id)
+        ):
+            parent_emails.setdefault(student_id, email)
+
+        frontend_url = os.getenv('FRONTEND_URL', 'http://localhost:5173')
+        due_text = f" and is due on {due_date.strftime('%B %d, %Y')}" if due_date else ""
+        for inv in invoices:
+            email = parent_emails.get(inv['student_id'])
+            if email:
+                emails.append((
+                    f"New Invoice for {inv['student_name']}: {description}",
+                    [email],
+                    {
+                        'message': f"A new invoice for {inv['student_name']} ({description}) is ready. The total amount is ${total:.2f}{due_text}.",
+                        'action_link': f"{frontend_url}/parent/billing"
+                    }
+                ))
+    return batch, invoices, emails
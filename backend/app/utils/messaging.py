@@ -0,0 +1,234 @@
+import base64
+from datetime import datetime, timezone
+from sqlalchemy import select, update, func, and_, or_, tuple_
+from sqlalchemy.orm import aliased
+from flask import g, has_app_context
+from app.models import db
+from app.models.staff_model import Staff
+from app.models.super_admin_model import SuperAdmin
+from app.models.conversation_model import Conversation, Message, ConversationParticipant
+
+
+def participant_is(user, role):
+    """Matches the ConversationParticipant rows belonging to 'user'."""
+    if role == 'superadmin':
+        return ConversationParticipant.super_admin_id == user.id
+    return ConversationParticipant.staff_id == user.id
+
+
+def participant_is_not(user, role):
+    """Matches every other participant (the NULL check keeps the other role's rows in)."""
+    column = ConversationParticipant.super_admin_id if role == 'superadmin' else ConversationParticipant.staff_id
+    return or_(column.is_(None), column != user.id)
+
+
+SENDER_MODELS = {'staff': Staff, 'superadmin': SuperAdmin}
+
+
+def resolve_sender_names(messages):
+    """
+    Names of the senders of 'messages' that don't carry one, keyed by (sender_type, sender_id),
+    with one query per sender type. Names are remembered for the rest of the request, so
+    serializing more messages later only looks up senders not seen yet.
+    """
+    directory = g.setdefault('sender_names', {}) if has_app_context() else {}
+    missing = {}
+    for message in messages:
+        key = (message.sender_type, message.sender_id)
+        if message.sender_name is None and key not in directory and message.sender_type in SENDER_MODELS:
+            missing.setdefault(message.sender_type, set()).add(message.sender_id)
+    for sender_type, sender_ids in missing.items():
+        model = SENDER_MODELS[sender_type]
+        for sender_id, name in db.session.execute(select(model.id, model.name).where(model.id.in_(sender_ids))):
+            directory[(sender_type, sender_id)] = name
+    return directory
+
+
+def backfill_sender_names(session=None):
+    """Copies sender names onto messages sent before they carried one, one UPDATE per sender type."""
+    session = session or db.session
+    updated = 0
+    for sender_type, model in SENDER_MODELS.items():
+        name = select(model.name).where(model.id == Message.sender_id).scalar_subquery()
+        updated += session.execute(
+            update(Message.__table__)
+            .where(Message.__table__.c.sender_type == sender_type, Message.__table__.c.sender_name.is_(None))
+            .values(sender_name=name)
+        ).rowcount
+    return updated
+
+
+def is_conversation_participant(conversation_id, user, role):
+    """Whether 'user' is in the conversation, from one indexed lookup instead of loading their conversations."""
+    return db.session.execute(
+        select(ConversationParticipant.id).where(
+            ConversationParticipant.conversation_id == conversation_id, participant_is(user, role)
+        ).limit(1)
+    ).first() is not None
+
+
+def _unread_by_participant():
+    """
+    Join condition for the messages a participant has not read: sent by someone else and newer
+    than last_read_at, or any such message if they have never read the conversation.
+    """
+    return and_(
+        Message.conversation_id == ConversationParticipant.conversation_id,
+        or_(ConversationParticipant.last_read_at.is_(None), Message.created_at > ConversationParticipant.last_read_at),
+        or_(
+            and_(ConversationParticipant.staff_id.isnot(None),
+                 or_(Message.sender_type != 'staff', Message.sender_id != ConversationParticipant.staff_id)),
+            and_(ConversationParticipant.super_admin_id.isnot(None),
+                 or_(Message.sender_type != 'superadmin', Message.sender_id != ConversationParticipant.super_admin_id)),
+        )
+    )
+
+
+def record_new_message(message, sender, role):
+    """
+    Bookkeeping for a message just added to the session: points its conversation at it and
+    bumps the unread counter of every other participant, one UPDATE each.
+    """
+    db.session.flush()
+    db.session.execute(
+        update(Conversation)
+        .where(Conversation.id == message.conversation_id)
+        .values(last_message_id=message.id, last_activity_at=message.created_at)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        update(ConversationParticipant)
+        .where(ConversationParticipant.conversation_id == message.conversation_id, participant_is_not(sender, role))
+        .values(unread_count=ConversationParticipant.unread_count + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def mark_conversation_read(conversation_id, user, role):
+    """Moves the user's read marker to now and clears their unread counter."""
+    db.session.execute(
+        update(ConversationParticipant)
+        .where(ConversationParticipant.conversation_id == conversation_id, participant_is(user, role))
+        .values(last_read_at=datetime.now(timezone.utc), unread_count=0)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def unread_total(user, role):
+    """The user's unread messages across all conversations, read from the stored counters."""
+    return db.session.execute(
+        select(func.coalesce(func.sum(ConversationParticipant.unread_count), 0)).where(participant_is(user, role))
+    ).scalar()
+
+
+def count_unread_messages(user, role):
+    """Fallback for unread_total that counts from the messages themselves, in one joined query."""
+    return db.session.execute(
+        select(func.count(Message.id))
+        .select_from(ConversationParticipant)
+        .join(Message, _unread_by_participant())
+        .where(participant_is(user, role))
+    ).scalar()
+
+
+def rebuild_unread_counts(session=None):
+    """Recomputes every participant's unread counter from the messages in one UPDATE. Returns rows updated."""
+    counted = (
+        select(func.count(Message.id))
+        .where(_unread_by_participant())
+        .correlate(ConversationParticipant)
+        .scalar_subquery()
+    )
+    return (session or db.session).execute(
+        update(ConversationParticipant).values(unread_count=counted).execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def unread_counts_by_conversation(user, role, conversation_ids):
+    """Fallback for the stored counters: the user's unread messages per conversation, in one grouped query."""
+    return dict(db.session.execute(
+        select(ConversationParticipant.conversation_id, func.count(Message.id))
+        .select_from(ConversationParticipant)
+        .join(Message, _unread_by_participant())
+        .where(participant_is(user, role), ConversationParticipant.conversation_id.in_(conversation_ids))
+        .group_by(ConversationParticipant.conversation_id)
+    ).all())
+
+
+def encode_inbox_cursor(last_activity_at, conversation_id):
+    raw = f"{last_activity_at.isoformat()}|{conversation_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_inbox_cursor(cursor):
+    """Returns (last_activity_at, conversation_id) for a cursor produced by encode_inbox_cursor, or raises ValueError."""
+    try:
+        last_activity_at, conversation_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(last_activity_at), int(conversation_id)
+    except Exception:
+        raise ValueError("Invalid inbox cursor.")
+
+
+def inbox_page(user, role, before=None, limit=50, use_counters=True):
+    """
+    One page of the user's conversations, most recently active first, built with a fixed
+    number of queries whatever the page size: the page itself (with the user's unread
+    counter), the other participants' names, and the last messages by their pointers.
+    'before' is a decoded cursor (last_activity_at, id); only older conversations are returned.
+    Fetches limit + 1 rows so the caller can tell whether another page exists.
+    """
+    query = (
+        select(Conversation.id, Conversation.last_activity_at, Conversation.last_message_id, ConversationParticipant.unread_count)
+        .join(ConversationParticipant, ConversationParticipant.conversation_id == Conversation.id)
+        .where(participant_is(user, role))
+        .order_by(Conversation.last_activity_at.desc(), Conversation.id.desc())
+        .limit(limit + 1)
+    )
+    if before:
+        query = query.where(tuple_(Conversation.last_activity_at, Conversation.id) < tuple_(*before))
+    rows = db.session.execute(query).all()
+    if not rows:
+        return []
+    conversation_ids = [row.id for row in rows]
+
+    names = {}
+    for conversation_id, staff_name, admin_name in db.session.execute(
+        select(ConversationParticipant.conversation_id, Staff.name, SuperAdmin.name)
+        .outerjoin(Staff, Staff.id == ConversationParticipant.staff_id)
+        .outerjoin(SuperAdmin, SuperAdmin.id == ConversationParticipant.super_admin_id)
+        .where(ConversationParticipant.conversation_id.in_(conversation_ids), participant_is_not(user, role))
+        .order_by(ConversationParticipant.id)
+    ):
+        names.setdefault(conversation_id, []).extend(name for name in (staff_name, admin_name) if name)
+
+    last_messages = {}
+    message_ids = [row.last_message_id for row in rows if row.last_message_id]
+    if message_ids:
+        last_messages = dict(db.session.execute(select(Message.id, Message.content).where(Message.id.in_(message_ids))).all())
+
+    unread = {row.id: row.unread_count for row in rows} if use_counters else unread_counts_by_conversation(user, role, conversation_ids)
+
+    return [{
+        'id': row.id,
+        'participant_names': ", ".join(names.get(row.id, [])) or "Yourself",
+        'last_message': last_messages.get(row.last_message_id, "No messages yet."),
+        'last_message_time': row.last_activity_at.isoformat() + 'Z',
+        'last_activity_at': row.last_activity_at,
+        'unread_count': unread.get(row.id, 0),
+    } for row in rows]
+
+
+def rebuild_last_messages(session=None):
+    """
+    Points every conversation at its newest message and its time (the conversation's creation
+    time if it has none, or now if that was never recorded) in one UPDATE. Returns rows updated.
+    """
+    newest = select(func.max(Message.id)).where(Message.conversation_id == Conversation.id).correlate(Conversation).scalar_subquery()
+    latest = aliased(Message)
+    newest_at = select(latest.created_at).where(latest.id == newest).correlate(Conversation).scalar_subquery()
+    return (session or db.session).execute(
+        update(Conversation).values(
+            last_message_id=newest,
+            last_activity_at=func.coalesce(newest_at, Conversation.created_at, func.now())
+        ).execution_options(synchronize_session=False)
+    ).rowcount
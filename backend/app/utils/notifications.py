@@ -6,6 +6,7 @@ from threading import Thread
 from app.models import db
 from app.models.notification_model import Notification
 from app.models.push_subscription_model import PushSubscription
+from app.utils.realtime import publish, channel_for
 from pywebpush import webpush, WebPushException
 
 def send_async_email(app, msg):
@@ -24,6 +25,36 @@ def send_email_in_background(subject, recipients, template_data):
     thr.start()
     return thr
 
+def send_async_email_batch(app, msgs):
+    with app.app_context():
+        from app import mail
+        try:
+            with mail.connect() as conn:
+                for msg in msgs:
+                    conn.send(msg)
+        except Exception as e:
+            app.logger.error(f"Failed to send email batch: {e}")
+
+def send_emails_in_background(emails):
+    """
+    Sends many templated emails from one background thread over a single mail connection.
+    'emails' is a list of (subject, recipients, template_data) tuples.
+    """
+    return send_html_emails_in_background([
+        (subject, recipients, render_template('email/notification.html', **template_data))
+        for subject, recipients, template_data in emails
+    ])
+
+def send_html_emails_in_background(emails):
+    """Like send_emails_in_background, for already-rendered (subject, recipients, html) tuples."""
+    if not emails:
+        return None
+    app = current_app._get_current_object()
+    msgs = [Message(subject, recipients=recipients, html=html) for subject, recipients, html in emails]
+    thr = Thread(target=send_async_email_batch, args=[app, msgs])
+    thr.start()
+    return thr
+
 def send_push_notification(user, payload):
     """Finds a user's subscription and sends a push notification."""
     from app.models.staff_model import Staff
@@ -99,6 +130,8 @@ def create_notifications_and_send_emails(recipients, message, target_obj=None):
             "url": target_link
         }
         send_push_notification(user, push_payload)
+
+    publish([channel_for(user) for user in recipients], 'notification', {'message': message, 'target_link': target_link})
     
     email_data = { 'message': message, 'action_link': full_action_link }
     send_email_in_background(
@@ -0,0 +1,206 @@
+import csv
+import io
+from datetime import datetime
+from sqlalchemy import select, insert
+from app.models import db
+from app.models.student_model import Student, Parent, parent_student_association
+from app.models.financial_model import StudentFinancialAccount, Invoice, Payment
+from app.utils.allocation import allocate_account_funds
+from app.utils.billing import record_balance_activity, CLOSED_INVOICE_STATUSES, SETTLEMENT_TOLERANCE
+
+# Deposit files name their columns differently; each field accepts any of these headers.
+IMPORT_COLUMN_ALIASES = {
+    'amount': ('amount', 'payment_amount', 'paid'),
+    'date': ('date', 'transaction_date', 'payment_date'),
+    'method': ('method', 'payment_method'),
+    'notes': ('notes', 'reference', 'memo', 'description'),
+    'invoice_id': ('invoice_id', 'invoice', 'invoice_number'),
+    'student_id_number': ('student_id_number', 'student_id', 'student_number'),
+    'parent_email': ('parent_email', 'email', 'payer_email'),
+}
+
+IN_CLAUSE_CHUNK = 1000
+
+
+def _chunks(values, size=IN_CLAUSE_CHUNK):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _parse_row(raw):
+    """Normalises one CSV row to the import fields, or raises ValueError."""
+    row = {key.strip().lower(): (value or '').strip() for key, value in raw.items() if key}
+    fields = {}
+    for field, aliases in IMPORT_COLUMN_ALIASES.items():
+        fields[field] = next((row[alias] for alias in aliases if row.get(alias)), None)
+
+    try:
+        fields['amount'] = float(fields['amount'].replace('$', '').replace(',', ''))
+    except (AttributeError, ValueError):
+        raise ValueError("Missing or invalid amount.")
+    if fields['amount'] <= 0:
+        raise ValueError("Amount must be positive.")
+
+    if fields['date']:
+        try:
+            fields['date'] = datetime.fromisoformat(fields['date'])
+        except ValueError:
+            raise ValueError("Date must be in YYYY-MM-DD format.")
+
+    if fields['invoice_id']:
+        try:
+            fields['invoice_id'] = int(fields['invoice_id'].lstrip('#'))
+        except ValueError:
+            raise ValueError("Invalid invoice id.")
+
+    if fields['parent_email']:
+        fields['parent_email'] = fields['parent_email'].lower()
+    return fields
+
+
+class PaymentMatchIndex:
+    """
+    Everything needed to match a deposit file, loaded with a handful of queries up front:
+    accounts by student id number, accounts by parent email, and the open invoices of
+    every account the file can reach. Open balances are tracked in memory as rows are
+    matched, so two payments in one file never both settle the same remaining amount.
+    """
+
+    def __init__(self, rows):
+        numbers = {r['student_id_number'] for r in rows if r['student_id_number']}
+        emails = {r['parent_email'] for r in rows if r['parent_email']}
+        invoice_ids = {r['invoice_id'] for r in rows if r['invoice_id']}
+
+        self.accounts_by_number = {}
+        for chunk in _chunks(numbers):
+            for number, account_id in db.session.execute(
+                select(Student.student_id_number, StudentFinancialAccount.id)
+                .join(StudentFinancialAccount, StudentFinancialAccount.student_id == Student.id)
+                .where(Student.student_id_number.in_(chunk))
+            ):
+                self.accounts_by_number[number] = account_id
+
+        self.accounts_by_email = {}
+        for chunk in _chunks(emails):
+            for email, account_id in db.session.execute(
+                select(Parent.email, StudentFinancialAccount.id)
+                .join(parent_student_association, parent_student_association.c.parent_id == Parent.id)
+                .join(StudentFinancialAccount, StudentFinancialAccount.student_id == parent_student_association.c.student_id)
+                .where(Parent.email.in_(chunk))
+                .order_by(StudentFinancialAccount.id)
+            ):
+                self.accounts_by_email.setdefault(email.lower(), []).append(account_id)
+
+        account_ids = set(self.accounts_by_number.values())
+        for ids in self.accounts_by_email.values():
+            account_ids.update(ids)
+
+        # Open invoices of reachable accounts, plus any invoice the file names directly.
+        self.invoices = {}
+        columns = (Invoice.id, Invoice.account_id, Invoice.status, Invoice.total_amount, Invoice.amount_paid, Invoice.due_date)
+        for chunk in _chunks(account_ids):
+            for inv in db.session.execute(
+                select(*columns).where(Invoice.account_id.in_(chunk), Invoice.status.notin_(CLOSED_INVOICE_STATUSES))
+            ):
+                self.invoices[inv.id] = inv
+        for chunk in _chunks(invoice_ids - set(self.invoices)):
+            for inv in db.session.execute(select(*columns).where(Invoice.id.in_(chunk))):
+                self.invoices[inv.id] = inv
+
+        self.remaining = {inv.id: inv.total_amount - inv.amount_paid for inv in self.invoices.values()}
+        self.open_by_account = {}
+        for inv in sorted(self.invoices.values(), key=lambda i: (i.due_date is None, i.due_date, i.id)):
+            if inv.status not in CLOSED_INVOICE_STATUSES:
+                self.open_by_account.setdefault(inv.account_id, []).append(inv.id)
+
+    def _open_invoice_for_amount(self, account_ids, amount):
+        """The oldest open invoice among 'account_ids' whose remaining balance equals 'amount'."""
+        for account_id in account_ids:
+            for invoice_id in self.open_by_account.get(account_id, []):
+                if abs(self.remaining[invoice_id] - amount) <= SETTLEMENT_TOLERANCE:
+                    return invoice_id
+        return None
+
+    def match(self, row):
+        """Returns (account_id, invoice_id, status, message) for a parsed row."""
+        amount = row['amount']
+        by_number = self.accounts_by_number.get(row['student_id_number']) if row['student_id_number'] else None
+        by_email = self.accounts_by_email.get(row['parent_email'], []) if row['parent_email'] else []
+
+        if row['invoice_id']:
+            inv = self.invoices.get(row['invoice_id'])
+            if not inv:
+                return None, None, 'unmatched', f"Invoice #{row['invoice_id']} not found."
+            if inv.status == 'Void':
+                return None, None, 'unmatched', f"Invoice #{inv.id} has been voided."
+            if (by_number and by_number != inv.account_id) or (by_email and inv.account_id not in by_email):
+                return None, None, 'unmatched', f"Invoice #{inv.id} does not belong to the given student or parent."
+            return inv.account_id, inv.id, 'matched', None
+
+        if row['student_id_number'] and not by_number:
+            return None, None, 'unmatched', f"No account for student id number '{row['student_id_number']}'."
+        candidates = [by_number] if by_number else by_email
+        if not candidates:
+            return None, None, 'unmatched', "No invoice id, student id number or known parent email."
+
+        invoice_id = self._open_invoice_for_amount(candidates, amount)
+        if invoice_id:
+            return self.invoices[invoice_id].account_id, invoice_id, 'matched', None
+        if len(candidates) > 1:
+            return None, None, 'unmatched', "Parent has several children and no open invoice matches the amount."
+        return candidates[0], None, 'unapplied', "No open invoice matches the amount; recorded on the account and allocated to its oldest open invoices."
+
+    def apply(self, invoice_id, amount):
+        self.remaining[invoice_id] -= amount
+
+
+def import_payments(file_text, default_method='Bank Transfer', dry_run=False):
+    """
+    Matches every row of a deposit CSV to an account and, where possible, an open invoice,
+    then records all matched payments in bulk in the current transaction: one multi-row
+    INSERT for the payments, one balance update per account, and the allocation engine's
+    executemany UPDATE settling the invoices. Nothing is written when 'dry_run' is set. The caller commits.
+    Returns (report, summary), where 'report' has one entry per data row.
+    """
+    reader = csv.DictReader(io.StringIO(file_text))
+    parsed, report = [], []
+    for line_number, raw in enumerate(reader, start=2):
+        try:
+            parsed.append((line_number, _parse_row(raw)))
+        except ValueError as e:
+            report.append({'row': line_number, 'status': 'error', 'message': str(e)})
+
+    index = PaymentMatchIndex([row for _, row in parsed])
+    now = datetime.utcnow()
+    payment_rows = []
+    for line_number, row in parsed:
+        account_id, invoice_id, status, message = index.match(row)
+        entry = {
+            'row': line_number, 'status': status, 'amount': row['amount'],
+            'account_id': account_id, 'invoice_id': invoice_id, 'message': message
+        }
+        report.append(entry)
+        if account_id is None:
+            continue
+        if invoice_id:
+            index.apply(invoice_id, row['amount'])
+        payment_rows.append({
+            'account_id': account_id, 'invoice_id': invoice_id, 'amount': row['amount'],
+            'method': row['method'] or default_method, 'notes': row['notes'],
+            'transaction_date': row['date'] or now,
+        })
+
+    report.sort(key=lambda e: e['row'])
+    summary = {status: sum(1 for e in report if e['status'] == status) for status in ('matched', 'unapplied', 'unmatched', 'error')}
+    summary['total_rows'] = len(report)
+    summary['amount_recorded'] = round(sum(p['amount'] for p in payment_rows), 2)
+
+    if dry_run or not payment_rows:
+        return report, summary
+
+    db.session.execute(insert(Payment), payment_rows)
+    record_balance_activity('payment', [(p['account_id'], p['amount'], p['transaction_date']) for p in payment_rows])
+    # Settles the matched invoices and spreads unapplied payments over the oldest open ones.
+    allocate_account_funds({p['account_id'] for p in payment_rows})
+    return report, summary
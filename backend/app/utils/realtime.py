@@ -0,0 +1,246 @@
+import json
+import queue
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import event, select, insert, delete, func, or_
+from sqlalchemy.orm import Session
+from app.models import db
+
+# Publish/subscribe hub for live events (new messages, notifications, task assignments),
+# streamed to browsers over Server-Sent Events by /api/messaging/stream. Events published
+# inside a transaction are held until it commits, so a client is never told about a row it
+# can't read yet. The configured backend then carries them to the subscribers: 'local'
+# straight to this process's hub, 'database' through the realtime_events table to the hub
+# of every worker process.
+
+logger = logging.getLogger(__name__)
+
+# Events queued for a client that stops reading are dropped past this; it refetches on reconnect.
+SUBSCRIBER_QUEUE_SIZE = 100
+# Outbox ids are taken at INSERT but become visible at COMMIT, so a poller can see id N+1
+# before N. Skipped ids are looked for again for this many seconds; events are inserted just
+# before their transaction commits, so one still missing after that was rolled back.
+OUTBOX_GAP_GRACE = 10
+
+
+def user_channel(role, user_id):
+    """The channel carrying one user's events; 'role' is 'staff' or 'superadmin', as in the JWT."""
+    return f"{role}:{user_id}"
+
+
+def channel_for(user):
+    """user_channel for a Staff or SuperAdmin instance."""
+    return user_channel('superadmin' if user.__class__.__name__ == 'SuperAdmin' else 'staff', user.id)
+
+
+class Subscription:
+    def __init__(self, channels):
+        self.channels = set(channels)
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def get(self, timeout):
+        """The next (event, data) for this subscriber, or None if nothing arrives within 'timeout' seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventHub:
+    """Fans events out to the subscribers of their channel within this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, channels):
+        subscription = Subscription(channels)
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    def has_subscribers(self):
+        with self._lock:
+            return bool(self._subscribers)
+
+    def dispatch(self, channel, event_name, data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait((event_name, data))
+            except queue.Full:
+                pass
+
+
+class LocalBackend:
+    """Delivers committed events to this process's hub only; enough for a single worker process."""
+
+    def __init__(self, hub):
+        self.hub = hub
+
+    def stage(self, session, events):
+        pass
+
+    def deliver(self, events):
+        for channel, event_name, data in events:
+            self.hub.dispatch(channel, event_name, data)
+
+    def start(self):
+        pass
+
+
+def prune_realtime_events(retention, session=None):
+    """Deletes realtime_events rows older than 'retention' seconds. Returns rows deleted; the caller commits."""
+    from app.models.realtime_event_model import RealtimeEvent
+    cutoff = datetime.utcnow() - timedelta(seconds=retention)
+    return (session or db.session).execute(delete(RealtimeEvent).where(RealtimeEvent.created_at < cutoff)).rowcount
+
+
+class DatabaseBackend:
+    """
+    Writes events to realtime_events in the publishing transaction, pruning rows older than
+    'retention' seconds along the way at most once per 'retention' per process, so the table
+    stays small whether or not anyone is listening. A poller thread in each worker process
+    reads the new rows every 'interval' seconds while it has subscribers and hands them to its hub,
+    along with rows that committed after a higher id had already been read.
+    """
+
+    def __init__(self, hub, app, interval, retention):
+        self.hub = hub
+        self.app = app
+        self.interval = interval
+        self.retention = retention
+        self._thread = None
+        self._lock = threading.Lock()
+        self._last_pruned = time.monotonic()
+
+    def stage(self, session, events):
+        from app.models.realtime_event_model import RealtimeEvent
+        now = datetime.utcnow()
+        session.execute(insert(RealtimeEvent), [
+            {'channel': channel, 'event': event_name, 'payload': json.dumps(data), 'created_at': now}
+            for channel, event_name, data in events
+        ])
+        with self._lock:
+            prune = time.monotonic() - self._last_pruned > self.retention
+            if prune:
+                self._last_pruned = time.monotonic()
+        if prune:
+            prune_realtime_events(self.retention, session)
+
+    def deliver(self, events):
+        # The poller picks the rows up, in this process as in every other.
+        pass
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='realtime-poller', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        from app.models.realtime_event_model import RealtimeEvent
+        # 'gaps' maps ids below last_id not seen yet to when they were first skipped.
+        last_id, gaps = None, {}
+        with self.app.app_context():
+            while True:
+                time.sleep(self.interval)
+                try:
+                    if not self.hub.has_subscribers():
+                        last_id, gaps = None, {}
+                        continue
+                    if last_id is None:
+                        # Start from now: a client that just connected fetches what it missed itself.
+                        last_id = db.session.execute(select(func.coalesce(func.max(RealtimeEvent.id), 0))).scalar()
+                        continue
+                    unseen = RealtimeEvent.id > last_id
+                    if gaps:
+                        unseen = or_(unseen, RealtimeEvent.id.in_(list(gaps)))
+                    now = time.monotonic()
+                    for row in db.session.execute(
+                        select(RealtimeEvent.id, RealtimeEvent.channel, RealtimeEvent.event, RealtimeEvent.payload)
+                        .where(unseen).order_by(RealtimeEvent.id)
+                    ):
+                        if row.id > last_id:
+                            gaps.update((skipped, now) for skipped in range(last_id + 1, row.id))
+                            last_id = row.id
+                        else:
+                            del gaps[row.id]
+                        self.hub.dispatch(row.channel, row.event, json.loads(row.payload))
+                    gaps = {gap: skipped_at for gap, skipped_at in gaps.items() if now - skipped_at < OUTBOX_GAP_GRACE}
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Realtime poller failed: {e}")
+                finally:
+                    db.session.remove()
+
+
+_hub = EventHub()
+_backend = LocalBackend(_hub)
+
+
+def publish(channels, event_name, data):
+    """
+    Queues 'event_name' with the JSON-serialisable 'data' for every channel in 'channels'.
+    It reaches subscribers once the current transaction commits, and never if it rolls back.
+    """
+    db.session.info.setdefault('realtime_events', []).extend(
+        (channel, event_name, data) for channel in set(channels)
+    )
+
+
+def subscribe(channels):
+    _backend.start()
+    return _hub.subscribe(channels)
+
+
+def unsubscribe(subscription):
+    _hub.unsubscribe(subscription)
+
+
+def _stage_on_commit(session):
+    events = session.info.get('realtime_events')
+    if events:
+        _backend.stage(session, events)
+
+
+def _deliver_on_commit(session):
+    events = session.info.pop('realtime_events', None)
+    if events:
+        _backend.deliver(events)
+
+
+def _forget_on_rollback(session):
+    session.info.pop('realtime_events', None)
+
+
+def init_realtime(app):
+    """Picks the event backend from the app config and hooks publishing into every SQLAlchemy session."""
+    global _backend
+    if app.config.get('REALTIME_BACKEND') == 'database':
+        _backend = DatabaseBackend(_hub, app, app.config['REALTIME_POLL_INTERVAL'], app.config['REALTIME_EVENT_RETENTION'])
+    else:
+        _backend = LocalBackend(_hub)
+
+    hooks = [
+        ('before_commit', _stage_on_commit),
+        ('after_commit', _deliver_on_commit),
+        ('after_rollback', _forget_on_rollback),
+    ]
+    for name, fn in hooks:
+        if not event.contains(Session, name, fn):
+            event.listen(Session, name, fn)
@@ -0,0 +1,32 @@
+from contextlib import contextmanager
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+# Helpers for the revisions in migrations/versions. init_db() runs db.create_all(), so a
+# database created from scratch already has every column and index the models define by the
+# time 'flask db upgrade' runs; revisions check before adding anything. Data backfills reuse
+# the app's functions through a session joined to the migration's connection, so they run in
+# the revision's transaction and see the columns it has just added.
+
+
+def has_column(bind, table, column):
+    return column in {c['name'] for c in sa.inspect(bind).get_columns(table)}
+
+
+def has_index(bind, table, name):
+    """Whether 'table' has an index or unique constraint called 'name'."""
+    inspector = sa.inspect(bind)
+    names = {i['name'] for i in inspector.get_indexes(table)}
+    names.update(u['name'] for u in inspector.get_unique_constraints(table))
+    return name in names
+
+
+@contextmanager
+def migration_session(bind):
+    """A Session on the migration's connection; its commits stay inside the revision's transaction."""
+    session = Session(bind=bind)
+    try:
+        yield session
+        session.flush()
+    finally:
+        session.close()
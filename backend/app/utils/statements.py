@@ -0,0 +1,97 @@
+import os
+from datetime import timedelta
+from sqlalchemy import select, func, union_all
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from app.models import db
+from app.models.student_model import Student, Parent, parent_student_association
+from app.models.financial_model import StudentFinancialAccount, Invoice, Payment, Credit
+from app.utils.billing import iter_transactions
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'templates')
+STATEMENT_TEMPLATE = 'email/statement.html'
+
+
+def _opening_balances(before):
+    """Balance of every account as of 'before', from one grouped query over the whole ledger."""
+    ledger = union_all(
+        select(Invoice.account_id.label('account_id'), Invoice.total_amount.label('amount')).where(Invoice.created_at < before),
+        select(Payment.account_id, -Payment.amount).where(Payment.transaction_date < before),
+        select(Credit.account_id, -Credit.amount).where(Credit.created_at < before),
+    ).subquery()
+    return dict(db.session.execute(
+        select(ledger.c.account_id, func.sum(ledger.c.amount)).group_by(ledger.c.account_id)
+    ).all())
+
+
+def _describe(tx):
+    if tx['type'] == 'Invoice':
+        return f"Invoice #{tx['id']}", tx['amount']
+    if tx['type'] == 'Payment':
+        return f"Payment ({tx['detail']})", -tx['amount']
+    return f"Credit: {tx['detail']}", -tx['amount']
+
+
+def collect_statements(period_start, period_end, include_inactive=False):
+    """
+    Builds the data for one statement per parent covering [period_start, period_end), with
+    every linked child's opening balance, transactions and closing balance. All of it comes
+    from three bulk reads: families, opening balances and the period's transactions.
+    Families with no activity in the period and nothing owing are left out unless
+    'include_inactive' is set. Returns plain dicts, so they can be sent to other processes.
+    """
+    families = {}
+    for parent_id, first_name, last_name, email, student_id, student_first, student_last, account_id in db.session.execute(
+        select(
+            Parent.id, Parent.first_name, Parent.last_name, Parent.email,
+            Student.id, Student.first_name, Student.last_name, StudentFinancialAccount.id
+        )
+        .join(parent_student_association, parent_student_association.c.parent_id == Parent.id)
+        .join(Student, Student.id == parent_student_association.c.student_id)
+        .join(StudentFinancialAccount, StudentFinancialAccount.student_id == Student.id)
+        .order_by(Parent.id, Student.first_name)
+    ):
+        family = families.setdefault(parent_id, {
+            'parent_id': parent_id, 'parent_name': f"{first_name} {last_name}", 'email': email, 'children': []
+        })
+        family['children'].append({'student_id': student_id, 'student_name': f"{student_first} {student_last}", 'account_id': account_id})
+
+    opening = _opening_balances(period_start)
+    transactions = {}
+    for tx in iter_transactions(period_start, period_end):
+        description, amount = _describe(tx)
+        transactions.setdefault(tx['account_id'], []).append({'date': tx['date'].strftime('%Y-%m-%d'), 'description': description, 'amount': amount})
+
+    statements = []
+    for family in families.values():
+        has_activity = False
+        for child in family['children']:
+            balance = float(opening.get(child['account_id']) or 0)
+            child['opening_balance'] = balance
+            child['transactions'] = transactions.get(child['account_id'], [])
+            for tx in child['transactions']:
+                balance += tx['amount']
+                tx['balance'] = balance
+            child['closing_balance'] = balance
+            has_activity = has_activity or bool(child['transactions'])
+        family['total_due'] = sum(child['closing_balance'] for child in family['children'])
+        family['period_start'] = period_start.strftime('%B %d, %Y')
+        family['period_end'] = (period_end - timedelta(days=1)).strftime('%B %d, %Y')
+        if include_inactive or has_activity or abs(family['total_due']) > 0.005:
+            statements.append(family)
+    return statements
+
+
+_environment = None
+
+
+def render_statement_batch(statements):
+    """
+    Worker entry point: renders a batch of statements to HTML with a plain Jinja environment,
+    so worker processes never need to build the Flask app or touch the database.
+    Returns a list of (parent_id, email, html) tuples.
+    """
+    global _environment
+    if _environment is None:
+        _environment = Environment(loader=FileSystemLoader(TEMPLATE_DIR), autoescape=select_autoescape(['html']))
+    template = _environment.get_template(STATEMENT_TEMPLATE)
+    return [(s['parent_id'], s['email'], template.render(**s)) for s in statements]
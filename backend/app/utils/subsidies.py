@@ -0,0 +1,204 @@
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import select, insert, update, delete, case, func, bindparam, and_, or_
+from sqlalchemy.exc import IntegrityError
+from app.models import db
+from app.models.financial_model import StudentFinancialAccount, Invoice, InvoiceItem
+from app.models.subsidy_model import Subsidy, StudentSubsidy, SubsidyClaim, SubsidyClaimLine
+from app.utils.billing import record_balance_adjustment, SETTLEMENT_TOLERANCE
+from app.utils.allocation import allocate_account_funds, release_excess_allocations
+
+# Invoice items for an agency's share are named like the ones CreateInvoiceModal adds by hand.
+SUBSIDY_ITEM_PREFIX = 'Subsidy: '
+# Statuses of invoices still waiting on the family (spelled out: executemany can't expand IN lists).
+OPEN_STATUSES = ('Sent', 'Partially Paid', 'Overdue')
+
+
+def _month_invoices(student_ids, period_start, period_end):
+    """Each student's tuition invoice for the month: the subscription invoice if there is one, else the earliest."""
+    in_month = or_(
+        and_(Invoice.billing_period >= period_start, Invoice.billing_period < period_end),
+        and_(Invoice.billing_period.is_(None), Invoice.created_at >= period_start, Invoice.created_at < period_end)
+    )
+    invoices = {}
+    for inv in db.session.execute(
+        select(
+            StudentFinancialAccount.student_id, Invoice.id, Invoice.account_id, Invoice.created_at,
+            Invoice.total_amount, Invoice.subscription_id
+        )
+        .join(StudentFinancialAccount, StudentFinancialAccount.id == Invoice.account_id)
+        .where(StudentFinancialAccount.student_id.in_(student_ids), Invoice.status != 'Void', in_month)
+        .order_by(Invoice.subscription_id.is_(None), Invoice.created_at, Invoice.id)
+    ):
+        invoices.setdefault(inv.student_id, inv)
+    return invoices
+
+
+def generate_subsidy_claims(period_start, subsidy_ids=None):
+    """
+    Creates one claim per active subsidy for the month starting 'period_start', in the current
+    transaction. Each awarded student's tuition invoice for the month gets a claim line for the
+    agency's share, and a negative 'Subsidy: <name>' item so the family no longer owes that part
+    (an item added by hand is claimed as it is instead). Subsidies already claimed for the month,
+    including by a run that overlaps this one, are skipped. Apart from one claim INSERT per
+    subsidy, all reads and writes are bulk statements, whatever the number of students.
+    Returns a report with one entry per subsidy.
+    """
+    period_start = period_start.replace(day=1)
+    period_end = period_start + relativedelta(months=1)
+
+    subsidies = Subsidy.query.filter(Subsidy.is_active.is_(True))
+    if subsidy_ids:
+        subsidies = subsidies.filter(Subsidy.id.in_(subsidy_ids))
+    # Locking the subsidies makes overlapping runs for the same month take turns.
+    subsidies = {s.id: s for s in subsidies.order_by(Subsidy.id).with_for_update().all()}
+    claimed = set(db.session.execute(
+        select(SubsidyClaim.subsidy_id).where(SubsidyClaim.subsidy_id.in_(subsidies), SubsidyClaim.period == period_start)
+    ).scalars())
+
+    report = {sid: {'subsidy_id': sid, 'name': s.name, 'status': 'already_claimed' if sid in claimed else 'no_awards',
+                    'claim_id': None, 'students': 0, 'amount': 0.0, 'missing_invoices': []}
+              for sid, s in subsidies.items()}
+    pending = [sid for sid in subsidies if sid not in claimed]
+    if not pending:
+        return list(report.values())
+
+    awards = db.session.execute(
+        select(StudentSubsidy.subsidy_id, StudentSubsidy.student_id, StudentSubsidy.monthly_amount).where(
+            StudentSubsidy.subsidy_id.in_(pending), StudentSubsidy.is_active.is_(True),
+            StudentSubsidy.start_date < period_end,
+            or_(StudentSubsidy.end_date.is_(None), StudentSubsidy.end_date >= period_start)
+        )
+    ).all()
+
+    # Take each month's claim before billing anything against it. A run that committed the
+    # claim after 'claimed' was read trips uq_subsidy_claim_period; only that subsidy is skipped.
+    now = datetime.utcnow()
+    claim_ids = {}
+    for sid in sorted({award.subsidy_id for award in awards}):
+        try:
+            with db.session.begin_nested():
+                claim_ids[sid] = db.session.execute(insert(SubsidyClaim).values(
+                    subsidy_id=sid, period=period_start, status='Submitted', created_at=now, amount=0, amount_received=0
+                )).inserted_primary_key[0]
+        except IntegrityError:
+            report[sid]['status'] = 'already_claimed'
+    awards = [award for award in awards if award.subsidy_id in claim_ids]
+    if not awards:
+        return list(report.values())
+    for award in awards:
+        report[award.subsidy_id]['status'] = 'no_invoices'
+
+    invoices = _month_invoices({a.student_id for a in awards}, period_start, period_end)
+    manual_items = {}
+    if invoices:
+        for invoice_id, description, amount in db.session.execute(
+            select(InvoiceItem.invoice_id, InvoiceItem.description, InvoiceItem.amount).where(
+                InvoiceItem.invoice_id.in_([inv.id for inv in invoices.values()]),
+                InvoiceItem.description.like(f"{SUBSIDY_ITEM_PREFIX}%")
+            )
+        ):
+            manual_items[(invoice_id, description)] = abs(amount)
+
+    lines, new_items, adjustments = {}, [], {}
+    for award in awards:
+        subsidy = subsidies[award.subsidy_id]
+        inv = invoices.get(award.student_id)
+        if inv is None:
+            report[award.subsidy_id]['missing_invoices'].append(award.student_id)
+            continue
+        description = f"{SUBSIDY_ITEM_PREFIX}{subsidy.name}"
+        amount = manual_items.get((inv.id, description))
+        if amount is None:
+            reduced = adjustments.get(inv.id, (0.0, None, None))[0]
+            # The agency can't be billed for more than the invoice is worth.
+            amount = min(award.monthly_amount, max(inv.total_amount - reduced, 0))
+            if amount <= SETTLEMENT_TOLERANCE:
+                continue
+            new_items.append({'invoice_id': inv.id, 'description': description, 'amount': -amount})
+            adjustments[inv.id] = (reduced + amount, inv.account_id, inv.created_at)
+        lines.setdefault(award.subsidy_id, []).append({'student_id': award.student_id, 'invoice_id': inv.id, 'amount': amount})
+
+    # A subsidy with nothing to bill this month keeps no claim.
+    empty = [claim_ids.pop(sid) for sid in list(claim_ids) if sid not in lines]
+    if empty:
+        db.session.execute(delete(SubsidyClaim).where(SubsidyClaim.id.in_(empty)))
+    if not lines:
+        return list(report.values())
+
+    totals = {sid: round(sum(line['amount'] for line in claim_lines), 2) for sid, claim_lines in lines.items()}
+    db.session.execute(
+        update(SubsidyClaim.__table__).where(SubsidyClaim.__table__.c.id == bindparam('b_id'))
+        .values(amount=bindparam('b_amount')),
+        [{'b_id': claim_ids[sid], 'b_amount': amount} for sid, amount in totals.items()]
+    )
+    db.session.execute(insert(SubsidyClaimLine), [
+        {**line, 'claim_id': claim_ids[sid]} for sid, claim_lines in lines.items() for line in claim_lines
+    ])
+
+    if new_items:
+        db.session.execute(insert(InvoiceItem), new_items)
+        # Lower the family's share; an invoice they have already covered becomes Paid.
+        table = Invoice.__table__
+        new_total = table.c.total_amount - bindparam('b_reduction')
+        db.session.execute(
+            update(table).where(table.c.id == bindparam('b_id')).ordered_values(
+                (table.c.status, case(
+                    (and_(or_(*(table.c.status == status for status in OPEN_STATUSES)), table.c.amount_paid >= new_total - SETTLEMENT_TOLERANCE), 'Paid'),
+                    else_=table.c.status
+                )),
+                (table.c.total_amount, new_total)
+            ),
+            [{'b_id': invoice_id, 'b_reduction': reduction} for invoice_id, (reduction, _, _) in adjustments.items()]
+        )
+        record_balance_adjustment('invoice', [(account_id, -reduction, created_at) for reduction, account_id, created_at in adjustments.values()])
+        # Payments already allocated past an invoice's new total go back to the family's funds,
+        # to be applied to their next open invoice.
+        allocate_account_funds(release_excess_allocations(adjustments))
+
+    db.session.execute(
+        update(Subsidy.__table__).where(Subsidy.__table__.c.id == bindparam('b_id'))
+        .values(total_invoiced=Subsidy.__table__.c.total_invoiced + bindparam('b_amount')),
+        [{'b_id': sid, 'b_amount': amount} for sid, amount in totals.items()]
+    )
+
+    for sid, claim_lines in lines.items():
+        report[sid].update(status='created', claim_id=claim_ids[sid], students=len(claim_lines), amount=totals[sid])
+    return list(report.values())
+
+
+def record_claim_payment(claim_id, amount):
+    """
+    Records money received from an agency against a claim, moving the claim's status and the
+    subsidy's received total in SQL, like apply_invoice_settlements does for invoices.
+    Returns False if the claim does not exist.
+    """
+    new_received = SubsidyClaim.amount_received + amount
+    result = db.session.execute(
+        update(SubsidyClaim).where(SubsidyClaim.id == claim_id).ordered_values(
+            (SubsidyClaim.status, case(
+                (new_received >= SubsidyClaim.amount - SETTLEMENT_TOLERANCE, 'Paid'),
+                (new_received > 0, 'Partially Paid'),
+                else_=SubsidyClaim.status
+            )),
+            (SubsidyClaim.amount_received, new_received)
+        ).execution_options(synchronize_session=False)
+    )
+    if not result.rowcount:
+        return False
+    subsidy_id = select(SubsidyClaim.subsidy_id).where(SubsidyClaim.id == claim_id).scalar_subquery()
+    db.session.execute(
+        update(Subsidy).where(Subsidy.id == subsidy_id)
+        .values(total_received=Subsidy.total_received + amount)
+        .execution_options(synchronize_session=False)
+    )
+    return True
+
+
+def rebuild_subsidy_totals():
+    """Recomputes every subsidy's invoiced and received totals from its claims in one UPDATE."""
+    invoiced = select(func.coalesce(func.sum(SubsidyClaim.amount), 0)).where(SubsidyClaim.subsidy_id == Subsidy.id).scalar_subquery()
+    received = select(func.coalesce(func.sum(SubsidyClaim.amount_received), 0)).where(SubsidyClaim.subsidy_id == Subsidy.id).scalar_subquery()
+    return db.session.execute(
+        update(Subsidy).values(total_invoiced=invoiced, total_received=received).execution_options(synchronize_session=False)
+    ).rowcount
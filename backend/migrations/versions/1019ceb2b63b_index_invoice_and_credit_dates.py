@@ -0,0 +1,28 @@
+"""index invoices.created_at and credits.created_at
+
+Revision ID: 1019ceb2b63b
+Revises: 66d578bf767a
+Create Date: 2026-10-18 09:30:00.000000
+
+"""
+from alembic import op
+from app.utils.schema import has_index
+
+
+# revision identifiers, used by Alembic.
+revision = '1019ceb2b63b'
+down_revision = '66d578bf767a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    for table in ('invoices', 'credits'):
+        if not has_index(bind, table, f'ix_{table}_created_at'):
+            op.create_index(f'ix_{table}_created_at', table, ['created_at'])
+
+
+def downgrade():
+    op.drop_index('ix_credits_created_at', table_name='credits')
+    op.drop_index('ix_invoices_created_at', table_name='invoices')
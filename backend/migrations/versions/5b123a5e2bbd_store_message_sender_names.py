@@ -0,0 +1,33 @@
+"""store the sender's name on each message
+
+Revision ID: 5b123a5e2bbd
+Revises: d0c998a2d135
+Create Date: 2026-10-18 10:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from app.utils.schema import has_column, migration_session
+from app.utils.messaging import backfill_sender_names
+
+
+# revision identifiers, used by Alembic.
+revision = '5b123a5e2bbd'
+down_revision = 'd0c998a2d135'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    with op.batch_alter_table('messages') as batch_op:
+        if not has_column(bind, 'messages', 'sender_name'):
+            batch_op.add_column(sa.Column('sender_name', sa.String(length=100), nullable=True))
+
+    with migration_session(bind) as session:
+        backfill_sender_names(session)
+
+
+def downgrade():
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.drop_column('sender_name')
@@ -0,0 +1,39 @@
+"""store invoice total_amount and amount_paid
+
+Revision ID: 5bfb1f86e091
+Revises: 69956eca06a5
+Create Date: 2026-10-18 09:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from app.utils.schema import has_column, migration_session
+from app.utils.billing import backfill_invoice_totals
+from app.utils.allocation import allocate_all_funds
+
+
+# revision identifiers, used by Alembic.
+revision = '5bfb1f86e091'
+down_revision = '69956eca06a5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    with op.batch_alter_table('invoices') as batch_op:
+        for column in ('total_amount', 'amount_paid'):
+            if not has_column(bind, 'invoices', column):
+                batch_op.add_column(sa.Column(column, sa.Float(), server_default='0', nullable=False))
+
+    # total_amount from invoice_items and amount_paid from payment_allocations; then the
+    # existing payments and credits are allocated, which fills amount_paid and the statuses.
+    with migration_session(bind) as session:
+        backfill_invoice_totals(session=session)
+        allocate_all_funds(session=session)
+
+
+def downgrade():
+    with op.batch_alter_table('invoices') as batch_op:
+        batch_op.drop_column('amount_paid')
+        batch_op.drop_column('total_amount')
@@ -0,0 +1,25 @@
+"""index payments.transaction_date
+
+Revision ID: 66d578bf767a
+Revises: 5bfb1f86e091
+Create Date: 2026-10-18 09:20:00.000000
+
+"""
+from alembic import op
+from app.utils.schema import has_index
+
+
+# revision identifiers, used by Alembic.
+revision = '66d578bf767a'
+down_revision = '5bfb1f86e091'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not has_index(op.get_bind(), 'payments', 'ix_payments_transaction_date'):
+        op.create_index('ix_payments_transaction_date', 'payments', ['transaction_date'])
+
+
+def downgrade():
+    op.drop_index('ix_payments_transaction_date', table_name='payments')
@@ -0,0 +1,38 @@
+"""link invoices to the subscription period they bill
+
+Revision ID: 69956eca06a5
+Revises: 
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from app.utils.schema import has_column, has_index
+
+
+# revision identifiers, used by Alembic.
+revision = '69956eca06a5'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    # Invoices raised before the billing engine have no subscription link and keep none.
+    with op.batch_alter_table('invoices') as batch_op:
+        if not has_column(bind, 'invoices', 'subscription_id'):
+            batch_op.add_column(sa.Column('subscription_id', sa.Integer(), nullable=True))
+            batch_op.create_foreign_key('fk_invoices_subscription_id', 'subscriptions', ['subscription_id'], ['id'])
+        if not has_column(bind, 'invoices', 'billing_period'):
+            batch_op.add_column(sa.Column('billing_period', sa.Date(), nullable=True))
+        if not has_index(bind, 'invoices', 'uq_invoice_subscription_period'):
+            batch_op.create_unique_constraint('uq_invoice_subscription_period', ['subscription_id', 'billing_period'])
+
+
+def downgrade():
+    with op.batch_alter_table('invoices') as batch_op:
+        batch_op.drop_constraint('uq_invoice_subscription_period', type_='unique')
+        batch_op.drop_constraint('fk_invoices_subscription_id', type_='foreignkey')
+        batch_op.drop_column('billing_period')
+        batch_op.drop_column('subscription_id')
@@ -0,0 +1,32 @@
+"""store subsidy invoiced and received totals
+
+Revision ID: 6cb2d23b65f1
+Revises: e49b0f269663
+Create Date: 2026-10-18 09:50:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from app.utils.schema import has_column
+
+
+# revision identifiers, used by Alembic.
+revision = '6cb2d23b65f1'
+down_revision = 'e49b0f269663'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    # Claims start with this change, so every existing subsidy has invoiced and received nothing.
+    with op.batch_alter_table('subsidies') as batch_op:
+        for column in ('total_invoiced', 'total_received'):
+            if not has_column(bind, 'subsidies', column):
+                batch_op.add_column(sa.Column(column, sa.Float(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('subsidies') as batch_op:
+        batch_op.drop_column('total_received')
+        batch_op.drop_column('total_invoiced')
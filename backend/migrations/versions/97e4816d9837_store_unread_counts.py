@@ -0,0 +1,33 @@
+"""store each participant's unread message count
+
+Revision ID: 97e4816d9837
+Revises: 6cb2d23b65f1
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from app.utils.schema import has_column, migration_session
+from app.utils.messaging import rebuild_unread_counts
+
+
+# revision identifiers, used by Alembic.
+revision = '97e4816d9837'
+down_revision = '6cb2d23b65f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    with op.batch_alter_table('conversation_participants') as batch_op:
+        if not has_column(bind, 'conversation_participants', 'unread_count'):
+            batch_op.add_column(sa.Column('unread_count', sa.Integer(), server_default='0', nullable=False))
+
+    with migration_session(bind) as session:
+        rebuild_unread_counts(session)
+
+
+def downgrade():
+    with op.batch_alter_table('conversation_participants') as batch_op:
+        batch_op.drop_column('unread_count')
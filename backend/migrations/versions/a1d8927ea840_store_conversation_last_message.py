@@ -0,0 +1,46 @@
+"""store each conversation's last message and activity time
+
+Revision ID: a1d8927ea840
+Revises: 97e4816d9837
+Create Date: 2026-10-18 10:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from app.utils.schema import has_column, migration_session
+from app.utils.messaging import rebuild_last_messages
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1d8927ea840'
+down_revision = '97e4816d9837'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    if has_column(bind, 'conversations', 'last_activity_at'):
+        return
+
+    # last_activity_at is added nullable, filled from the messages, and only then made NOT NULL,
+    # so no existing conversation is left with a zero or made-up date.
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.add_column(sa.Column('last_message_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('last_activity_at', sa.DateTime(), nullable=True))
+        batch_op.create_foreign_key('fk_conversations_last_message_id', 'messages', ['last_message_id'], ['id'], ondelete='SET NULL')
+
+    with migration_session(bind) as session:
+        rebuild_last_messages(session)
+
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.alter_column('last_activity_at', existing_type=sa.DateTime(), nullable=False, server_default=sa.func.now())
+        batch_op.create_index('ix_conversations_last_activity_at', ['last_activity_at'])
+
+
+def downgrade():
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.drop_index('ix_conversations_last_activity_at')
+        batch_op.drop_constraint('fk_conversations_last_message_id', type_='foreignkey')
+        batch_op.drop_column('last_activity_at')
+        batch_op.drop_column('last_message_id')
@@ -0,0 +1,25 @@
+"""index messages by conversation and id
+
+Revision ID: d0c998a2d135
+Revises: a1d8927ea840
+Create Date: 2026-10-18 10:20:00.000000
+
+"""
+from alembic import op
+from app.utils.schema import has_index
+
+
+# revision identifiers, used by Alembic.
+revision = 'd0c998a2d135'
+down_revision = 'a1d8927ea840'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not has_index(op.get_bind(), 'messages', 'ix_messages_conversation_id_id'):
+        op.create_index('ix_messages_conversation_id_id', 'messages', ['conversation_id', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_messages_conversation_id_id', table_name='messages')
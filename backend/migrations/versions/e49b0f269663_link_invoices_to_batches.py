@@ -0,0 +1,34 @@
+"""link invoices to the invoice batch that raised them
+
+Revision ID: e49b0f269663
+Revises: 1019ceb2b63b
+Create Date: 2026-10-18 09:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from app.utils.schema import has_column, has_index
+
+
+# revision identifiers, used by Alembic.
+revision = 'e49b0f269663'
+down_revision = '1019ceb2b63b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    with op.batch_alter_table('invoices') as batch_op:
+        if not has_column(bind, 'invoices', 'batch_id'):
+            batch_op.add_column(sa.Column('batch_id', sa.Integer(), nullable=True))
+            batch_op.create_foreign_key('fk_invoices_batch_id', 'invoice_batches', ['batch_id'], ['id'])
+        if not has_index(bind, 'invoices', 'uq_invoice_batch_account'):
+            batch_op.create_unique_constraint('uq_invoice_batch_account', ['batch_id', 'account_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('invoices') as batch_op:
+        batch_op.drop_constraint('uq_invoice_batch_account', type_='unique')
+        batch_op.drop_constraint('fk_invoices_batch_id', type_='foreignkey')
+        batch_op.drop_column('batch_id')
@@ -0,0 +1,95 @@
+import os
+from datetime import date, datetime, timedelta
+
+# The config reads these at import time; tests always run against a private in-memory database.
+os.environ.pop('FLASK_ENV', None)
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ.setdefault('SECRET_KEY', 'test-secret')
+os.environ.setdefault('JWT_SECRET_KEY', 'test-jwt-secret-that-is-long-enough-for-hs256')
+
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+from app import create_app
+from app.models import db
+from app.models.staff_model import Staff
+from app.models.student_model import Student
+from app.models.financial_model import StudentFinancialAccount, Invoice, InvoiceItem
+from app.utils import cache
+
+
+@pytest.fixture
+def app():
+    app = create_app()
+    app.config.update(TESTING=True, MAIL_SUPPRESS_SEND=True)
+    with app.app_context():
+        yield app
+        db.session.remove()
+    cache._entries.clear()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers(app):
+    """Builds the Authorization header for a staff member (created if needed) with the given departments."""
+    def make(email='accounting@example.com', role='staff', departments=('Accounting Department', 'Administration Department')):
+        if role == 'staff' and not Staff.query.filter_by(email=email).first():
+            staff = Staff(name=email.split('@')[0], email=email)
+            staff.set_password('password')
+            db.session.add(staff)
+            db.session.commit()
+        token = create_access_token(identity=email, additional_claims={'role': role, 'departmentNames': list(departments)})
+        return {'Authorization': f'Bearer {token}'}
+    return make
+
+
+@pytest.fixture
+def make_account(app):
+    """Creates a student with a financial account and one Sent invoice per amount in 'invoices', oldest first."""
+    counter = iter(range(1, 10_000))
+
+    def make(invoices=(), first_name=None):
+        n = next(counter)
+        student = Student(first_name=first_name or f'Student{n}', last_name='Test', date_of_birth=date(2015, 1, 1),
+                          grade_level='1', student_id_number=f'T{n:04d}')
+        account = StudentFinancialAccount(student=student)
+        db.session.add_all([student, account])
+        for age, amount in enumerate(reversed(invoices)):
+            invoice = Invoice(account=account, status='Sent', due_date=date.today() - timedelta(days=30 * age),
+                              created_at=datetime.utcnow() - timedelta(days=30 * age))
+            invoice.items.append(InvoiceItem(description='Tuition', amount=amount))
+            db.session.add(invoice)
+        db.session.commit()
+        return account
+    return make
+
+
+class QueryCounter:
+    """Counts the statements sent to the database inside a 'with' block."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+@pytest.fixture
+def count_queries(app):
+    return lambda: QueryCounter(db.engine)
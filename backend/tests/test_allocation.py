@@ -0,0 +1,148 @@
+from datetime import date
+import pytest
+from sqlalchemy import select, update, func
+from app.models import db
+from app.models.financial_model import Invoice, InvoiceItem, Credit, Payment, PaymentAllocation, Subscription
+from app.utils.allocation import allocate_account_funds
+from app.utils.billing import backfill_invoice_totals
+from app.utils.invoicing import bill_subscriptions
+
+
+def _invoices(account):
+    """The account's invoices, oldest due first."""
+    return Invoice.query.filter_by(account_id=account.id).order_by(Invoice.due_date, Invoice.id).all()
+
+
+def _allocated(invoice_id):
+    return db.session.execute(
+        select(func.coalesce(func.sum(PaymentAllocation.amount), 0)).where(PaymentAllocation.invoice_id == invoice_id)
+    ).scalar()
+
+
+def _pay(client, headers, account, amount, invoice_id=None):
+    response = client.post(f'/api/billing/accounts/{account.student_id}/payments', headers=headers,
+                           json={'amount': amount, 'invoice_id': invoice_id})
+    assert response.status_code == 201
+    db.session.expire_all()
+
+
+def test_targeted_payment_is_capped_and_the_rest_goes_oldest_first(client, auth_headers, make_account):
+    account = make_account([100, 80])
+    older, newer = _invoices(account)
+
+    _pay(client, auth_headers(), account, 150, invoice_id=newer.id)
+
+    assert (newer.amount_paid, newer.status) == (80, 'Paid')
+    assert (older.amount_paid, older.status) == (70, 'Partially Paid')
+    assert _allocated(newer.id) == 80
+    assert _allocated(older.id) == 70
+
+
+def test_payment_to_a_settled_invoice_goes_to_the_open_ones(client, auth_headers, make_account):
+    account = make_account([100, 80])
+    older, newer = _invoices(account)
+    headers = auth_headers()
+
+    _pay(client, headers, account, 80, invoice_id=newer.id)
+    _pay(client, headers, account, 50, invoice_id=newer.id)
+
+    assert (newer.amount_paid, newer.status) == (80, 'Paid')
+    assert (older.amount_paid, older.status) == (50, 'Partially Paid')
+
+
+def test_overpayment_stays_unallocated_until_a_new_invoice(client, auth_headers, make_account):
+    account = make_account([100])
+    [invoice] = _invoices(account)
+
+    _pay(client, auth_headers(), account, 130)
+    assert (invoice.amount_paid, invoice.status) == (100, 'Paid')
+    assert _allocated(invoice.id) == 100
+
+    later = Invoice(account_id=account.id, status='Sent')
+    later.items.append(InvoiceItem(description='Tuition', amount=50))
+    db.session.add(later)
+    db.session.flush()
+    assert allocate_account_funds([account.id]) == (1, 30)
+    db.session.commit()
+    assert (later.amount_paid, later.status) == (30, 'Partially Paid')
+
+
+def test_credits_are_allocated_like_payments(make_account):
+    account = make_account([100])
+    db.session.add(Credit(account_id=account.id, amount=20, reason='Sibling discount'))
+    db.session.commit()
+
+    assert allocate_account_funds([account.id]) == (1, 20)
+    db.session.commit()
+    [invoice] = _invoices(account)
+    assert (invoice.amount_paid, invoice.status) == (20, 'Partially Paid')
+    assert allocate_account_funds([account.id]) == (0, 0.0)
+
+
+def test_backfill_rebuilds_amount_paid_from_allocations(client, auth_headers, make_account):
+    account = make_account([100, 80])
+    older, newer = _invoices(account)
+    _pay(client, auth_headers(), account, 120)
+
+    # Drift that the backfill repairs: amount_paid no longer matches the allocations.
+    db.session.execute(update(Invoice).where(Invoice.id == older.id).values(amount_paid=0, status='Sent'))
+    db.session.execute(update(Invoice).where(Invoice.id == newer.id).values(amount_paid=80, status='Paid'))
+    db.session.commit()
+
+    backfill_invoice_totals()
+    db.session.commit()
+    db.session.expire_all()
+    first = [(i.total_amount, i.amount_paid, i.status) for i in (older, newer)]
+    assert first == [(100, 100, 'Paid'), (80, 20, 'Partially Paid')]
+
+    backfill_invoice_totals()
+    db.session.commit()
+    db.session.expire_all()
+    assert [(i.total_amount, i.amount_paid, i.status) for i in (older, newer)] == first
+    assert allocate_account_funds([account.id]) == (0, 0.0)
+
+
+@pytest.mark.parametrize('status', ['Draft', 'Void'])
+def test_closed_invoices_receive_nothing(make_account, status):
+    account = make_account([100])
+    [invoice] = _invoices(account)
+    invoice.status = status
+    db.session.add(Credit(account_id=account.id, amount=20, reason='Refund'))
+    db.session.commit()
+
+    assert allocate_account_funds([account.id]) == (0, 0.0)
+
+
+def test_new_invoice_takes_existing_credit(client, auth_headers, make_account):
+    account = make_account()
+    db.session.add(Credit(account_id=account.id, amount=200, reason='Scholarship'))
+    db.session.commit()
+
+    response = client.post(f'/api/billing/accounts/{account.student_id}/invoices', headers=auth_headers(),
+                           json={'status': 'Sent', 'items': [{'description': 'Tuition', 'amount': 150}]})
+    assert response.status_code == 201
+    assert (response.json['amount_paid'], response.json['status']) == (150, 'Paid')
+
+
+def test_subscription_invoice_takes_existing_overpayment(make_account):
+    account = make_account()
+    db.session.add_all([
+        Payment(account_id=account.id, amount=100, method='Cash'),
+        Subscription(account_id=account.id, plan_name='Tuition', cycle='Monthly', start_date=date.today(),
+                     invoice_generation_day=date.today().day, due_day=28, next_invoice_date=date.today(),
+                     items_json=[{'description': 'Tuition', 'amount': 150}]),
+    ])
+    db.session.commit()
+
+    assert bill_subscriptions([Subscription.query.one().id], date.today())[0] == 1
+    db.session.commit()
+    [invoice] = _invoices(account)
+    assert (invoice.amount_paid, invoice.status) == (100, 'Partially Paid')
+
+
+def test_subscription_with_unknown_cycle_stays_active(app):
+    from app.utils.invoicing import plan_billing_periods
+    today = date.today()
+    sub = Subscription(cycle='Custom', status='Active', next_invoice_date=today, end_date=date(today.year + 1, 1, 1),
+                       invoice_generation_day=today.day)
+    assert plan_billing_periods(sub, today) == ([today], today, 'Active')
@@ -0,0 +1,106 @@
+from app.models import db
+from app.models.financial_model import Payment, Credit
+
+
+def test_accounts_summary_uses_a_fixed_number_of_queries(client, auth_headers, make_account, count_queries):
+    headers = auth_headers()
+    make_account([110, 110])
+    client.get('/api/billing/accounts', headers=headers)  # seeds the stored balances
+    with count_queries() as few:
+        response = client.get('/api/billing/accounts', headers=headers)
+    assert len(response.json) == 1
+
+    for _ in range(10):
+        make_account([110, 110, 110])
+    client.get('/api/billing/accounts', headers=headers)
+    with count_queries() as many:
+        response = client.get('/api/billing/accounts', headers=headers)
+    assert len(response.json) == 11
+    assert many.count == few.count
+
+
+def test_accounts_summary_balances(client, auth_headers, make_account):
+    account = make_account([100, 50])
+    db.session.add_all([Payment(account=account, amount=30, method='Cash'), Credit(account=account, amount=5, reason='Goodwill')])
+    db.session.commit()
+
+    response = client.get('/api/billing/accounts', headers=auth_headers())
+    assert response.status_code == 200
+    [summary] = response.json
+    assert summary['open_balance'] == 115
+    assert summary['last_invoice_amount'] == 50
+    assert summary['last_payment_amount'] == 30
+
+
+def test_family_rollup_counts_children_without_a_balance_row(client, auth_headers, make_account):
+    from app.models.student_model import Parent
+    active, withdrawn = make_account([100]), make_account([70])
+    withdrawn.student.status = 'Withdrawn'
+    parent = Parent(first_name='Pat', last_name='Family', email='pat@example.com', phone='555')
+    parent.children.extend([active.student, withdrawn.student])
+    db.session.add(parent)
+    db.session.commit()
+
+    response = client.get('/api/billing/families', headers=auth_headers())
+    assert response.status_code == 200
+    [family] = response.json['families']
+    assert family['children_count'] == 2
+    assert family['open_balance'] == 170
+    assert sorted(child['open_balance'] for child in family['children']) == [70, 100]
+
+
+def test_enroll_by_status_alone(client, auth_headers, make_account):
+    from app.models.financial_model import Subscription
+    active, withdrawn = make_account(), make_account()
+    withdrawn.student.status = 'Withdrawn'
+    db.session.commit()
+
+    response = client.post('/api/billing/subscriptions', headers=auth_headers(), json={
+        'selector': {'status': 'Withdrawn'},
+        'plan_data': {
+            'plan_name': 'Alumni Fees', 'cycle': 'Monthly', 'start_date': '2026-01-01T00:00:00.000Z',
+            'invoice_generation_day': 1, 'due_day': 15, 'items_json': [{'description': 'Fees', 'amount': 20}]
+        }
+    })
+    assert response.status_code == 201
+    assert response.json['created'] == 1
+    assert [s.account_id for s in Subscription.query.all()] == [withdrawn.id]
+
+
+def test_enroll_rejects_unknown_cycle(client, auth_headers, make_account):
+    make_account()
+    response = client.post('/api/billing/subscriptions', headers=auth_headers(), json={
+        'selector': {'status': 'Active'},
+        'plan_data': {
+            'plan_name': 'Tuition', 'cycle': 'Fortnightly', 'start_date': '2026-01-01T00:00:00.000Z',
+            'invoice_generation_day': 1, 'due_day': 15, 'items_json': [{'description': 'Tuition', 'amount': 100}]
+        }
+    })
+    assert response.status_code == 400
+
+
+def test_aging_report_ignores_a_stale_snapshot(client, auth_headers, make_account):
+    from datetime import date, timedelta
+    from app.utils.billing import refresh_aging_snapshot
+    make_account([100])
+    refresh_aging_snapshot(date.today() - timedelta(days=3))
+    db.session.commit()
+    make_account([40])
+
+    response = client.get('/api/billing/reports/aging', headers=auth_headers())
+    assert (response.json['source'], response.json['totals']['total_open']) == ('live', 140)
+
+    refresh_aging_snapshot()
+    db.session.commit()
+    response = client.get('/api/billing/reports/aging', headers=auth_headers())
+    assert (response.json['source'], response.json['totals']['total_open']) == ('snapshot', 140)
+
+
+def test_batch_invoices_reject_a_settled_status(client, auth_headers, make_account):
+    from app.models.financial_model import Invoice
+    make_account()
+    response = client.post('/api/billing/invoices/batch', headers=auth_headers(), json={
+        'selector': {'status': 'Active'}, 'status': 'Paid', 'items': [{'description': 'Trip', 'amount': 25}]
+    })
+    assert response.status_code == 400
+    assert Invoice.query.count() == 0
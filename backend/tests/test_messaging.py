@@ -0,0 +1,27 @@
+from app.models import db
+from app.models.staff_model import Staff
+from app.models.conversation_model import Conversation, ConversationParticipant, Message
+from app.utils.messaging import count_unread_messages, rebuild_unread_counts, unread_total
+
+
+def test_participants_who_never_read_count_every_message_from_others(app):
+    sender, reader = Staff(name='Sender', email='sender@example.com'), Staff(name='Reader', email='reader@example.com')
+    for staff in (sender, reader):
+        staff.set_password('password')
+    conversation = Conversation()
+    db.session.add_all([sender, reader, conversation])
+    db.session.flush()
+    db.session.add_all([
+        ConversationParticipant(conversation_id=conversation.id, staff_id=sender.id),
+        ConversationParticipant(conversation_id=conversation.id, staff_id=reader.id, last_read_at=None),
+    ])
+    db.session.add_all([Message(content=f'm{n}', conversation_id=conversation.id, sender_type='staff', sender_id=sender.id) for n in range(3)])
+    db.session.commit()
+    db.session.execute(ConversationParticipant.__table__.update().values(last_read_at=None))
+
+    assert count_unread_messages(reader, 'staff') == 3
+    assert count_unread_messages(sender, 'staff') == 0
+    rebuild_unread_counts()
+    db.session.commit()
+    assert unread_total(reader, 'staff') == 3
+    assert unread_total(sender, 'staff') == 0
@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta
+from sqlalchemy import select, func
+from app.models import db
+from app.models.financial_model import Invoice, PaymentAllocation
+
+
+def _allocated(invoice_id):
+    return db.session.execute(
+        select(func.coalesce(func.sum(PaymentAllocation.amount), 0)).where(PaymentAllocation.invoice_id == invoice_id)
+    ).scalar()
+
+
+def test_subsidy_on_a_paid_invoice_frees_the_surplus(client, auth_headers, make_account):
+    headers = auth_headers()
+    account = make_account([100, 110])
+    older, current = Invoice.query.filter_by(account_id=account.id).order_by(Invoice.due_date).all()
+    older.created_at = datetime.utcnow() - timedelta(days=90)
+    db.session.commit()
+    client.post(f'/api/billing/accounts/{account.student_id}/payments', headers=headers, json={'amount': 110, 'invoice_id': current.id})
+
+    subsidy_id = client.post('/api/subsidies/', headers=headers, json={'name': 'ESA'}).json['id']
+    client.post(f'/api/subsidies/{subsidy_id}/students', headers=headers,
+                json={'student_id': account.student_id, 'monthly_amount': 60, 'start_date': '2020-01-01'})
+    response = client.post('/api/subsidies/claims/generate', headers=headers, json={})
+    assert response.status_code == 201
+    db.session.expire_all()
+
+    assert (current.total_amount, current.amount_paid, current.status) == (50, 50, 'Paid')
+    assert (older.amount_paid, older.status) == (60, 'Partially Paid')
+    assert _allocated(current.id) == 50
+    assert _allocated(older.id) == 60
+
+
+def test_claim_payment_without_a_body_is_rejected(client, auth_headers):
+    response = client.post('/api/subsidies/claims/1/payments', headers=auth_headers(), data='null', content_type='application/json')
+    assert response.status_code == 400
@@ -6,13 +6,20 @@ import { useAuth } from "../../../context/AuthContext";
 import useAutosizeTextArea from "../../../hooks/useAutosizeTextArea";
 import { format, parseISO, isToday, isYesterday } from "date-fns";
 
+const MESSAGE_PAGE_SIZE = 50;
+
 const ChatWindow = ({ conversationId, conversation }) => {
   const [messages, setMessages] = useState([]);
   const [newMessage, setNewMessage] = useState("");
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState("");
-  const { user } = useAuth();
+  const [hasOlder, setHasOlder] = useState(false);
+  const [loadingOlder, setLoadingOlder] = useState(false);
+  const { user, streamConnected, subscribeToStream, refreshCounts } =
+    useAuth();
   const messagesEndRef = useRef(null);
+  const messagesRef = useRef([]);
+  const skipScrollRef = useRef(false);
   const textAreaRef = useRef(null);
 
   useAutosizeTextArea(textAreaRef.current, newMessage);
@@ -21,35 +28,97 @@ const ChatWindow = ({ conversationId, conversation }) => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
   };
 
-  const fetchMessages = useCallback(
-    async (isInitialLoad = false) => {
-      if (!conversationId) return;
-      if (isInitialLoad) setLoading(true);
-      try {
-        const data = await getMessages(conversationId);
-        setMessages((currentMessages) =>
-          JSON.stringify(currentMessages) !== JSON.stringify(data)
-            ? data
-            : currentMessages
-        );
-      } catch (err) {
-        setError("Failed to load messages.");
-      } finally {
-        if (isInitialLoad) setLoading(false);
-      }
-    },
-    [conversationId]
-  );
+  // Messages with a numeric id come from the server; temporary ones are still sending.
+  const lastServerId = (list) =>
+    list.reduce(
+      (max, msg) => (typeof msg.id === "number" && msg.id > max ? msg.id : max),
+      0
+    );
 
-  useEffect(() => {
-    if (conversationId) {
-      fetchMessages(true);
-      const interval = setInterval(() => fetchMessages(false), 5000);
-      return () => clearInterval(interval);
+  const fetchMessages = useCallback(async () => {
+    if (!conversationId) return;
+    setLoading(true);
+    try {
+      const data = await getMessages(conversationId, {
+        limit: MESSAGE_PAGE_SIZE,
+      });
+      setMessages(data);
+      setHasOlder(data.length === MESSAGE_PAGE_SIZE);
+    } catch (err) {
+      setError("Failed to load messages.");
+    } finally {
+      setLoading(false);
+    }
+  }, [conversationId]);
+
+  const fetchNewMessages = useCallback(async () => {
+    if (!conversationId) return;
+    try {
+      const data = await getMessages(conversationId, {
+        after_id: lastServerId(messagesRef.current),
+      });
+      if (data.length === 0) return;
+      setMessages((currentMessages) => {
+        const known = new Set(currentMessages.map((msg) => msg.id));
+        return [...currentMessages, ...data.filter((msg) => !known.has(msg.id))];
+      });
+    } catch (err) {
+      setError("Failed to load messages.");
+    }
+  }, [conversationId]);
+
+  const fetchOlderMessages = async () => {
+    const oldest = messages.find((msg) => typeof msg.id === "number");
+    if (!oldest) return;
+    try {
+      setLoadingOlder(true);
+      skipScrollRef.current = true;
+      const data = await getMessages(conversationId, {
+        before_id: oldest.id,
+        limit: MESSAGE_PAGE_SIZE,
+      });
+      setMessages((currentMessages) => [...data, ...currentMessages]);
+      setHasOlder(data.length === MESSAGE_PAGE_SIZE);
+    } catch (err) {
+      setError("Failed to load older messages.");
+    } finally {
+      setLoadingOlder(false);
     }
+  };
+
+  useEffect(() => {
+    messagesRef.current = messages;
+  }, [messages]);
+
+  useEffect(() => {
+    if (conversationId) fetchMessages();
   }, [conversationId, fetchMessages]);
 
+  // New messages arrive over the live stream; poll only while it is down.
+  useEffect(() => {
+    if (!conversationId || streamConnected) return;
+    const interval = setInterval(() => fetchNewMessages(), 5000);
+    return () => clearInterval(interval);
+  }, [conversationId, streamConnected, fetchNewMessages]);
+
   useEffect(() => {
+    if (!conversationId) return;
+    return subscribeToStream((name, data) => {
+      // 'ready' follows a reconnect, so catch up on anything missed meanwhile.
+      if (
+        name === "ready" ||
+        (name === "message" && data.conversation_id === conversationId)
+      ) {
+        fetchNewMessages().then(refreshCounts);
+      }
+    });
+  }, [conversationId, subscribeToStream, fetchNewMessages, refreshCounts]);
+
+  useEffect(() => {
+    if (skipScrollRef.current) {
+      skipScrollRef.current = false;
+      return;
+    }
     scrollToBottom();
   }, [messages]);
 
@@ -73,8 +142,11 @@ const ChatWindow = ({ conversationId, conversation }) => {
         conversationId,
         optimisticMessage.content
       );
+      // A poll may already have picked the message up; keep a single copy.
       setMessages((prevMessages) =>
-        prevMessages.map((msg) => (msg.id === tempId ? sentMessage : msg))
+        prevMessages.some((msg) => msg.id === sentMessage.id)
+          ? prevMessages.filter((msg) => msg.id !== tempId)
+          : prevMessages.map((msg) => (msg.id === tempId ? sentMessage : msg))
       );
     } catch (err) {
       setError("Failed to send message.");
@@ -136,6 +208,22 @@ const ChatWindow = ({ conversationId, conversation }) => {
             {error}
           </Alert>
         )}
+        {hasOlder && (
+          <div className="text-center mb-2">
+            <Button
+              variant="outline-secondary"
+              size="sm"
+              onClick={fetchOlderMessages}
+              disabled={loadingOlder}
+            >
+              {loadingOlder ? (
+                <Spinner as="span" animation="border" size="sm" />
+              ) : (
+                "Load older messages"
+              )}
+            </Button>
+          </div>
+        )}
         {messages.map((msg) => {
           const isMe = isMyMessage(msg);
           return (
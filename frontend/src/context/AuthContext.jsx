@@ -4,6 +4,7 @@ import React, {
   useContext,
   useEffect,
   useCallback,
+  useRef,
 } from "react";
 import { jwtDecode } from "jwt-decode";
 import api from "../utils/api";
@@ -12,7 +13,12 @@ import {
   markAllAsRead,
 } from "../services/notificationService";
 import { getActiveTasksCount } from "../services/taskService";
-import { getUnreadMessagesCount } from "../services/messagingService";
+import {
+  getUnreadMessagesCount,
+  openEventStream,
+} from "../services/messagingService";
+
+const STREAM_EVENTS = ["ready", "message", "notification", "task"];
 
 const AuthContext = createContext(null);
 
@@ -25,6 +31,8 @@ export const AuthProvider = ({ children }) => {
   const [notifications, setNotifications] = useState([]);
   const [unreadTasks, setUnreadTasks] = useState(0);
   const [unreadMessages, setUnreadMessages] = useState(0);
+  const [streamConnected, setStreamConnected] = useState(false);
+  const streamListeners = useRef(new Set());
 
   const fetchCounts = useCallback(async () => {
     if (!isAuthenticated) return;
@@ -44,9 +52,36 @@ export const AuthProvider = ({ children }) => {
 
   useEffect(() => {
     fetchCounts(); // Fetch immediately on login
+    // Live events keep the counts current; poll only while the stream is down.
+    if (streamConnected) return;
     const interval = setInterval(fetchCounts, 30000); // Poll every 30 seconds
     return () => clearInterval(interval);
-  }, [fetchCounts]);
+  }, [fetchCounts, streamConnected]);
+
+  useEffect(() => {
+    if (!isAuthenticated) return;
+    const source = openEventStream();
+    STREAM_EVENTS.forEach((name) =>
+      source.addEventListener(name, (event) => {
+        if (name === "ready") setStreamConnected(true);
+        else fetchCounts();
+        const data = JSON.parse(event.data);
+        streamListeners.current.forEach((listener) => listener(name, data));
+      })
+    );
+    // EventSource reconnects by itself; fall back to polling until it does.
+    source.onerror = () => setStreamConnected(false);
+    return () => {
+      source.close();
+      setStreamConnected(false);
+    };
+  }, [isAuthenticated, fetchCounts]);
+
+  // Lets components react to live events; returns the unsubscribe function.
+  const subscribeToStream = useCallback((listener) => {
+    streamListeners.current.add(listener);
+    return () => streamListeners.current.delete(listener);
+  }, []);
 
   const markAllNotificationsAsRead = async () => {
     try {
@@ -130,6 +165,8 @@ export const AuthProvider = ({ children }) => {
     unreadMessages,
     markAllNotificationsAsRead,
     refreshCounts: fetchCounts, // Expose a manual refresh function
+    streamConnected,
+    subscribeToStream,
   };
 
   return (
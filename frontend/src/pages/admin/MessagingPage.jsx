@@ -1,5 +1,5 @@
 import React, { useState, useEffect, useCallback } from "react";
-import { Button, Card } from "react-bootstrap";
+import { Button, Card, Spinner } from "react-bootstrap";
 import { PlusCircleFill } from "react-bootstrap-icons";
 import ConversationList from "../../components/admin/messaging/ConversationList";
 import ChatWindow from "../../components/admin/messaging/ChatWindow";
@@ -9,6 +9,8 @@ import "../../styles/Messaging.css";
 
 const MessagingPage = () => {
   const [conversations, setConversations] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const [activeConversationId, setActiveConversationId] = useState(null);
   const [loading, setLoading] = useState(true);
   const [showNewModal, setShowNewModal] = useState(false);
@@ -16,7 +18,8 @@ const MessagingPage = () => {
   const fetchConversations = useCallback(async () => {
     try {
       const data = await getConversations();
-      setConversations(data);
+      setConversations(data.conversations);
+      setNextCursor(data.next_cursor);
     } catch (error) {
       console.error("Failed to fetch conversations.");
     } finally {
@@ -29,6 +32,20 @@ const MessagingPage = () => {
     fetchConversations();
   }, [fetchConversations]);
 
+  const fetchOlderConversations = async () => {
+    if (!nextCursor) return;
+    try {
+      setLoadingOlder(true);
+      const data = await getConversations({ before: nextCursor });
+      setConversations((prev) => [...prev, ...data.conversations]);
+      setNextCursor(data.next_cursor);
+    } catch (error) {
+      console.error("Failed to fetch older conversations.");
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   const handleSelectConversation = (id) => {
     setActiveConversationId(id);
     setTimeout(() => fetchConversations(), 1000);
@@ -64,6 +81,22 @@ const MessagingPage = () => {
             onSelect={handleSelectConversation}
             loading={loading}
           />
+          {nextCursor && !loading && (
+            <div className="text-center p-2">
+              <Button
+                variant="outline-secondary"
+                size="sm"
+                onClick={fetchOlderConversations}
+                disabled={loadingOlder}
+              >
+                {loadingOlder ? (
+                  <Spinner as="span" animation="border" size="sm" />
+                ) : (
+                  "Load older conversations"
+                )}
+              </Button>
+            </div>
+          )}
         </div>
         <div className="chat-window-area">
           <ChatWindow
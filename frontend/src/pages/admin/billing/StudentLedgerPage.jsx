@@ -26,6 +26,7 @@ const StudentLedgerPage = () => {
   const [ledger, setLedger] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState("");
+  const [loadingOlder, setLoadingOlder] = useState(false);
 
   const [showInvoiceModal, setShowInvoiceModal] = useState(false);
   const [showPaymentModal, setShowPaymentModal] = useState(false);
@@ -48,6 +49,25 @@ const StudentLedgerPage = () => {
     fetchLedger();
   }, [fetchLedger]);
 
+  const fetchOlderTransactions = async () => {
+    if (!ledger?.next_cursor) return;
+    try {
+      setLoadingOlder(true);
+      const data = await getStudentLedger(studentId, {
+        before: ledger.next_cursor,
+      });
+      setLedger((prev) => ({
+        ...prev,
+        transactions: [...prev.transactions, ...data.transactions],
+        next_cursor: data.next_cursor,
+      }));
+    } catch (err) {
+      setError("Failed to load older transactions.");
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   const handleShowPaymentModal = (invoice = null) => {
     setSelectedInvoice(invoice);
     setShowPaymentModal(true);
@@ -141,7 +161,7 @@ const StudentLedgerPage = () => {
           <tbody>
             {ledger &&
               ledger.transactions.map((tx, index) => (
-                <tr key={index}>
+                <tr key={`${tx.type}-${tx.id ?? index}`}>
                   <td>{new Date(tx.date).toLocaleDateString()}</td>
                   <td>
                     <strong>{tx.type}</strong>
@@ -194,6 +214,21 @@ const StudentLedgerPage = () => {
               ))}
           </tbody>
         </Table>
+        {ledger?.next_cursor && (
+          <div className="text-center">
+            <Button
+              variant="outline-secondary"
+              onClick={fetchOlderTransactions}
+              disabled={loadingOlder}
+            >
+              {loadingOlder ? (
+                <Spinner as="span" animation="border" size="sm" />
+              ) : (
+                "Load older transactions"
+              )}
+            </Button>
+          </div>
+        )}
       </div>
 
       <CreateInvoiceModal
@@ -75,9 +75,9 @@ const SubsidyAccountsPage = () => {
                 <td>
                   <strong>{sub.name}</strong>
                 </td>
-                <td>$0.00</td>
-                <td>$0.00</td>
-                <td>$0.00</td>
+                <td>${(sub.invoiced ?? 0).toFixed(2)}</td>
+                <td>${(sub.received ?? 0).toFixed(2)}</td>
+                <td>${(sub.outstanding ?? 0).toFixed(2)}</td>
               </tr>
             ))}
           </tbody>
@@ -137,9 +137,11 @@ export const getBillingAccounts = async () => {
   }
 };
 
-export const getStudentLedger = async (studentId) => {
+export const getStudentLedger = async (studentId, params = {}) => {
   try {
-    const response = await api.get(`/billing/accounts/${studentId}`);
+    const response = await api.get(`/billing/accounts/${studentId}`, {
+      params,
+    });
     return response.data;
   } catch (error) {
     console.error(`Error fetching ledger for student ${studentId}:`, error);
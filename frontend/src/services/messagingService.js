@@ -10,10 +10,18 @@ export const getUnreadMessagesCount = async () => {
   }
 };
 
-// Fetch all conversations for the current user
-export const getConversations = async () => {
+// Open the live event stream (EventSource can't send headers, so the token goes in the URL)
+export const openEventStream = () => {
+  const token = localStorage.getItem("authToken");
+  return new EventSource(
+    `${import.meta.env.VITE_API_BASE_URL}/api/messaging/stream?jwt=${encodeURIComponent(token)}`
+  );
+};
+
+// Fetch a page of the current user's conversations ({ conversations, next_cursor })
+export const getConversations = async (params = {}) => {
   try {
-    const response = await api.get("/messaging/conversations");
+    const response = await api.get("/messaging/conversations", { params });
     return response.data;
   } catch (error) {
     console.error("Error fetching conversations:", error);
@@ -21,11 +29,13 @@ export const getConversations = async () => {
   }
 };
 
-// Fetch all messages for a specific conversation
-export const getMessages = async (conversationId) => {
+// Fetch messages for a specific conversation: the latest page by default,
+// newer ones with { after_id } or older ones with { before_id, limit }
+export const getMessages = async (conversationId, params = {}) => {
   try {
     const response = await api.get(
-      `/messaging/conversations/${conversationId}/messages`
+      `/messaging/conversations/${conversationId}/messages`,
+      { params }
     );
     return response.data;
   } catch (error) {